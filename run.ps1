@@ -182,6 +182,20 @@ function Show-SystemStatus {
     Write-Host "   Input:  $inputFiles archivo(s)" -ForegroundColor Gray
     Write-Host "   Output: $outputFiles archivo(s)" -ForegroundColor Gray
     
+    # Progreso del lote en curso (output/.estado.json)
+    if (Test-Path "output/.estado.json") {
+        Write-Host ""
+        Write-Host "📈 Progreso:" -ForegroundColor Cyan
+        $status = Get-Content "output/.estado.json" -Raw | ConvertFrom-Json
+        foreach ($stage in $status.etapas.PSObject.Properties) {
+            $state = $stage.Value
+            $eta = if ($state.eta_s) { "ETA $([math]::Round($state.eta_s / 60)) min" } else { "ETA ?" }
+            if ($state.terminada) { $eta = "terminada" }
+            Write-Host "   $($stage.Name): $($state.porcentaje)% ($($state.elementos.hechos)/$($state.elementos.total) archivos) - $eta" -ForegroundColor Gray
+        }
+        Write-Host "   Actualizado: $($status.actualizado)" -ForegroundColor Gray
+    }
+    
     # Modelo Ollama
     Write-Host ""
     Write-Host "🤖 Modelo Ollama:" -ForegroundColor Cyan
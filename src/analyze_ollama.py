@@ -1,36 +1,59 @@
 """
 Módulo para análisis avanzado de transcripciones usando Ollama.
 Genera resúmenes, puntos clave y análisis de temas.
+
+Implementación asíncrona sobre el event loop compartido del cliente de
+Ollama; los métodos síncronos envuelven a sus versiones *_async.
 """
+import asyncio
 import os
-import requests
 import logging
+from pathlib import Path
+
+from artifacts import adopt_existing, is_complete, write_artifact
+from log_setup import file_context
+from ollama_client import OllamaClient, OllamaError, map_ordered, run_sync
+from output_layout import FORMATTED_SUFFIX, create_layout_from_env
+from progress import StageProgress, StatusFile
 
 logger = logging.getLogger(__name__)
 
 class TranscriptionAnalyzer:
-    def __init__(self, ollama_url="http://ollama:11434", model="llama3.2:3b"):
+    def __init__(self, ollama_url="http://ollama:11434", model="llama3.2:3b", client=None,
+                 keep_alive='30m', concurrency=None, per_host_concurrency=2):
+        """
+        Args:
+            ollama_url: URL de Ollama o lista de URLs (se reparten los chunks)
+            model: Modelo de Ollama
+            client: OllamaClient compartido (se crea uno si no se indica)
+            keep_alive: Tiempo que el modelo permanece cargado entre peticiones
+            concurrency: Archivos y chunks por archivo en curso a la vez
+                (None = capacidad total del cliente)
+            per_host_concurrency: Peticiones simultáneas por host de Ollama
+        """
         self.ollama_url = ollama_url
         self.model = model
         self.max_chunk_size = 15000
+        self.client = client or OllamaClient(
+            ollama_url,
+            keep_alive=keep_alive,
+            per_host_concurrency=per_host_concurrency
+        )
+        self.concurrency = concurrency or self.client.max_in_flight
         
-    def _call_ollama(self, prompt, context=""):
-        """Llama a Ollama con un prompt específico."""
+    async def _call_ollama(self, prompt, context="", system=None):
+        """
+        Llama a Ollama con un prompt específico.
+        
+        Las instrucciones que se repiten en cada chunk van en `system`, para
+        que Ollama reutilice ese prefijo en lugar de re-evaluarlo.
+        """
         full_prompt = f"{context}\n\n{prompt}" if context else prompt
+        extra = {"system": system} if system else {}
         
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": full_prompt,
-                    "stream": False
-                },
-                timeout=300
-            )
-            response.raise_for_status()
-            return response.json()["response"]
-        except Exception as e:
+            return (await self.client.generate_async(full_prompt, model=self.model, **extra))["response"]
+        except (OllamaError, KeyError) as e:
             logger.error(f"Error al llamar Ollama: {e}")
             return None
     
@@ -59,7 +82,7 @@ class TranscriptionAnalyzer:
         
         return chunks
     
-    def generate_summary(self, transcription):
+    async def generate_summary_async(self, transcription):
         """
         Genera un resumen ejecutivo de la transcripción.
         """
@@ -80,20 +103,23 @@ Transcripción:
 
 Resumen ejecutivo:"""
             
-            return self._call_ollama(prompt)
+            return await self._call_ollama(prompt)
         else:
             # Procesar chunks y luego resumir todo
-            partial_summaries = []
-            for i, chunk in enumerate(chunks):
+            system = "Resume brevemente el fragmento de transcripción que te entregue el usuario."
+            
+            async def summarize(item):
+                i, chunk = item
                 logger.info(f"Resumiendo chunk {i+1}/{len(chunks)}...")
-                prompt = f"""Resume brevemente el siguiente fragmento de transcripción:
-
-{chunk}
+                prompt = f"""{chunk}
 
 Resumen breve:"""
-                partial = self._call_ollama(prompt)
-                if partial:
-                    partial_summaries.append(partial)
+                return await self._call_ollama(prompt, system=system)
+            
+            partial_summaries = [
+                partial for partial in await map_ordered(summarize, enumerate(chunks), self.concurrency)
+                if partial
+            ]
             
             # Resumen final de todos los resúmenes parciales
             combined = "\n\n".join(partial_summaries)
@@ -103,9 +129,13 @@ Resumen breve:"""
 
 Resumen ejecutivo final (3-5 párrafos):"""
             
-            return self._call_ollama(final_prompt)
+            return await self._call_ollama(final_prompt)
     
-    def generate_key_points(self, transcription):
+    def generate_summary(self, transcription):
+        """Versión síncrona de generate_summary_async()."""
+        return run_sync(self.generate_summary_async(transcription))
+    
+    async def generate_key_points_async(self, transcription):
         """
         Extrae los puntos clave más importantes de la transcripción.
         """
@@ -113,26 +143,28 @@ Resumen ejecutivo final (3-5 párrafos):"""
         
         chunks = self._chunk_text(transcription)
         all_points = []
-        
-        for i, chunk in enumerate(chunks):
-            if len(chunks) > 1:
-                logger.info(f"Extrayendo puntos del chunk {i+1}/{len(chunks)}...")
-            
-            prompt = f"""Extrae los puntos clave más importantes de la siguiente transcripción.
+        system = """Extrae los puntos clave más importantes de la transcripción que te entregue el usuario.
 
 Instrucciones:
 - Lista los puntos en formato bullet (•)
 - Incluye solo información relevante y específica
 - Máximo 10 puntos por transcripción
 - Sé conciso pero claro
-- En español
-
-Transcripción:
+- En español"""
+        
+        async def extract(item):
+            i, chunk = item
+            if len(chunks) > 1:
+                logger.info(f"Extrayendo puntos del chunk {i+1}/{len(chunks)}...")
+            
+            prompt = f"""Transcripción:
 {chunk}
 
 Puntos clave:"""
             
-            points = self._call_ollama(prompt)
+            return await self._call_ollama(prompt, system=system)
+        
+        for points in await map_ordered(extract, enumerate(chunks), self.concurrency):
             if points:
                 all_points.append(points)
         
@@ -145,11 +177,15 @@ Puntos clave:"""
 
 Lista consolidada de puntos clave (máximo 15 puntos):"""
             
-            return self._call_ollama(consolidate_prompt)
+            return await self._call_ollama(consolidate_prompt)
         
         return all_points[0] if all_points else None
     
-    def generate_topics(self, transcription):
+    def generate_key_points(self, transcription):
+        """Versión síncrona de generate_key_points_async()."""
+        return run_sync(self.generate_key_points_async(transcription))
+    
+    async def generate_topics_async(self, transcription):
         """
         Identifica los temas principales discutidos en la transcripción.
         """
@@ -177,33 +213,176 @@ Transcripción:
 
 Temas principales:"""
         
-        return self._call_ollama(prompt)
+        return await self._call_ollama(prompt)
     
-    def generate_complete_analysis(self, transcription):
+    def generate_topics(self, transcription):
+        """Versión síncrona de generate_topics_async()."""
+        return run_sync(self.generate_topics_async(transcription))
+    
+    async def generate_complete_analysis_async(self, transcription):
         """
         Genera un análisis completo: resumen + puntos clave + temas.
+        Los tres análisis se piden a Ollama concurrentemente.
         Retorna un diccionario con cada componente.
         """
         logger.info("Iniciando análisis completo de la transcripción...")
         
         analysis = {}
+        summary, key_points, topics = await asyncio.gather(
+            self.generate_summary_async(transcription),
+            self.generate_key_points_async(transcription),
+            self.generate_topics_async(transcription)
+        )
         
         # Resumen
-        summary = self.generate_summary(transcription)
         if summary:
             analysis['summary'] = summary
             logger.info("✓ Resumen generado")
         
         # Puntos clave
-        key_points = self.generate_key_points(transcription)
         if key_points:
             analysis['key_points'] = key_points
             logger.info("✓ Puntos clave extraídos")
         
         # Temas
-        topics = self.generate_topics(transcription)
         if topics:
             analysis['topics'] = topics
             logger.info("✓ Temas identificados")
         
         return analysis
+    
+    def generate_complete_analysis(self, transcription):
+        """Versión síncrona de generate_complete_analysis_async()."""
+        return run_sync(self.generate_complete_analysis_async(transcription))
+    
+    @staticmethod
+    def _write_section(path, title, content):
+        write_artifact(path, "=" * 80 + f"\n{title}\n" + "=" * 80 + "\n\n" + content)
+    
+    @staticmethod
+    def _is_up_to_date(formatted_file, output_dir, suffixes):
+        """Indica si todos los análisis habilitados existen y son más recientes que el texto formateado."""
+        base_name = formatted_file.stem.replace('_transcripcion_formateado', '')
+        source_mtime = formatted_file.stat().st_mtime
+        for suffix in suffixes:
+            path = output_dir / f"{base_name}{suffix}"
+            if not is_complete(path) or path.stat().st_mtime < source_mtime:
+                return False
+        return True
+    
+    async def analyze_file_async(self, formatted_file, output_dir, summary=True, key_points=True,
+                                 topics=True, lease_queue=None, progress=None):
+        """
+        Analiza una transcripción formateada y guarda cada análisis habilitado.
+        
+        Args:
+            formatted_file: Ruta a *_transcripcion_formateado.txt
+            output_dir: Directorio donde guardar _resumen, _puntos_clave y _temas
+            summary: Generar resumen ejecutivo
+            key_points: Extraer puntos clave
+            topics: Identificar temas principales
+            lease_queue: LeaseQueue opcional (modo worker)
+            progress: StageProgress opcional
+        
+        Returns:
+            bool: True si se analizó el archivo
+        """
+        formatted_file = Path(formatted_file)
+        output_dir = Path(output_dir)
+        sections = [section for section in (
+            (summary, '_resumen.txt', "RESUMEN EJECUTIVO", self.generate_summary_async, "Resumen guardado"),
+            (key_points, '_puntos_clave.txt', "PUNTOS CLAVE", self.generate_key_points_async, "Puntos clave guardados"),
+            (topics, '_temas.txt', "TEMAS PRINCIPALES", self.generate_topics_async, "Temas guardados"),
+        ) if section[0]]
+        
+        lease = None
+        if lease_queue:
+            if self._is_up_to_date(formatted_file, output_dir, [section[1] for section in sections]):
+                logger.info(f"⏭️  Saltando {formatted_file.name} (ya analizado)")
+                return False
+            lease = lease_queue.claim(f"analisis-{formatted_file.name}")
+            if lease is None:
+                logger.info(f"⏳ {formatted_file.name} en análisis por otro worker")
+                return False
+        
+        logger.info(f"Analizando: {formatted_file.name}")
+        if progress:
+            progress.start_item(formatted_file.name)
+        
+        ok = False
+        try:
+            # Leer transcripción (la E/S va en hilos: el loop es compartido
+            # con los demás análisis y formateos en curso)
+            transcription = await asyncio.to_thread(formatted_file.read_text, encoding='utf-8')
+            
+            base_name = formatted_file.stem.replace('_transcripcion_formateado', '')
+            with file_context(formatted_file.name):
+                results = await asyncio.gather(*(generate(transcription) for _, _, _, generate, _ in sections))
+            
+            for (_, suffix, title, _, message), content in zip(sections, results):
+                if content:
+                    path = output_dir / f"{base_name}{suffix}"
+                    await asyncio.to_thread(self._write_section, path, title, content)
+                    logger.info(f"  ✓ {message}: {path.name}")
+            ok = True
+            return True
+        
+        except Exception as e:
+            logger.error(f"  ✗ Error al analizar {formatted_file.name}: {e}")
+            return False
+        finally:
+            if progress:
+                progress.complete(formatted_file.name, ok=ok)
+            if lease:
+                lease.release()
+    
+    async def process_directory_async(self, output_dir, summary=True, key_points=True, topics=True,
+                                      lease_queue=None):
+        """
+        Analiza todas las transcripciones formateadas de un directorio.
+        
+        Los archivos se analizan concurrentemente (hasta `concurrency` a la vez).
+        
+        Args:
+            output_dir: Directorio con *_transcripcion_formateado.txt
+            summary: Generar resúmenes
+            key_points: Extraer puntos clave
+            topics: Identificar temas
+            lease_queue: LeaseQueue opcional (modo worker)
+        
+        Returns:
+            int: Número de archivos analizados
+        """
+        output_dir = Path(output_dir)
+        adopt_existing(output_dir)
+        
+        # Buscar todas las transcripciones formateadas
+        formatted_files = create_layout_from_env(output_dir).files(FORMATTED_SUFFIX)
+        
+        if not formatted_files:
+            logger.warning("No se encontraron transcripciones formateadas para analizar.")
+            return 0
+        
+        logger.info(f"Analizando {len(formatted_files)} transcripción(es)...\n")
+        progress = StageProgress(
+            'analisis',
+            {f.name: f.stat().st_size for f in formatted_files},
+            unit='bytes',
+            status=StatusFile.from_env(output_dir)
+        )
+        results = await map_ordered(
+            lambda formatted_file: self.analyze_file_async(
+                formatted_file, formatted_file.parent, summary, key_points, topics, lease_queue, progress
+            ),
+            formatted_files,
+            self.concurrency
+        )
+        progress.finish()
+        logger.info("Análisis completado.\n")
+        # El formateo ya informó las llamadas con su system prompt
+        self.client.stats.report(self.model)
+        return sum(1 for ok in results if ok)
+    
+    def process_directory(self, output_dir, summary=True, key_points=True, topics=True, lease_queue=None):
+        """Versión síncrona de process_directory_async()."""
+        return run_sync(self.process_directory_async(output_dir, summary, key_points, topics, lease_queue))
@@ -0,0 +1,362 @@
+"""
+Archivo comprimido por audio para la salida terminada.
+
+Con ARCHIVE_OUTPUTS=true, al final de cada ejecución los archivos completos
+de cada audio (versión detallada, segmentos, SRT/VTT, texto formateado y
+análisis) se guardan en un único '<nombre>_archivo.zip' y se eliminan los
+originales. La transcripción '<nombre>_transcripcion.txt' y la tabla de
+palabras se conservan sin comprimir: la primera es la marca de reanudación
+y la entrada del formateo, la segunda se lee con memory mapping.
+
+Cada archivo es un miembro del ZIP y se lee por separado, descomprimiendo
+en streaming. Los segmentos se guardan en bloques de SEGMENT_BLOCK con su
+rango de tiempo en el manifiesto, así leer un segmento o un intervalo solo
+descomprime el bloque que lo contiene. El formateo y el índice de búsqueda
+leen los segmentos directamente del archivo.
+
+Uso como CLI:
+    python src/archive.py archivar [directorio]
+    python src/archive.py extraer [directorio]
+    python src/archive.py leer <audio> <archivo> [--directorio DIR]
+    python src/archive.py segmentos <audio> [--desde S] [--hasta S] [--directorio DIR]
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+from artifacts import is_complete, marker_path, write_artifact
+from log_setup import setup_logging
+from output_layout import ARCHIVE_SUFFIX, FORMATTED_SUFFIX, TRANSCRIPT_SUFFIX, base_name_of, create_layout_from_env
+from segments import iter_segments, segments_path_for
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+SEGMENTS_SUFFIX = "_segmentos.jsonl"
+# Segmentos por bloque: un acceso aleatorio descomprime como mucho un bloque
+SEGMENT_BLOCK = 256
+# Archivos de cada audio que se archivan
+ARCHIVED_SUFFIXES = (
+    "_transcripcion_detallada.txt",
+    SEGMENTS_SUFFIX,
+    "_transcripcion.srt",
+    "_transcripcion.vtt",
+    FORMATTED_SUFFIX,
+    "_resumen.txt",
+    "_puntos_clave.txt",
+    "_temas.txt",
+)
+COMPRESSION = {
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+
+def archive_path_for(path):
+    """Archivo comprimido del audio al que pertenece un archivo de salida (None si no es de un audio)."""
+    path = Path(path)
+    base_name = base_name_of(path.name)
+    return path.parent / f"{base_name}{ARCHIVE_SUFFIX}" if base_name else None
+
+
+class ArtifactArchive:
+    """Lectura de un archivo comprimido de audio, miembro a miembro y en streaming."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._zip = zipfile.ZipFile(self.path)
+        self.manifest = json.loads(self._zip.read(MANIFEST_NAME))
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def names(self):
+        """Nombres de los archivos guardados."""
+        return list(self.manifest['artefactos'])
+
+    def __contains__(self, name):
+        return name in self.manifest['artefactos']
+
+    def read_member(self, member):
+        """Contenido descomprimido de un miembro del ZIP (ej: un bloque de segmentos)."""
+        return self._zip.read(member)
+
+    def _open_text(self, member):
+        return io.TextIOWrapper(self._zip.open(member), encoding='utf-8')
+
+    def iter_lines(self, name):
+        """Líneas de un archivo guardado, descomprimidas a medida que se leen."""
+        if name not in self:
+            raise KeyError(f"{name} no está en {self.path.name}")
+        if name.endswith(SEGMENTS_SUFFIX):
+            members = [block['nombre'] for block in self.manifest['segmentos']]
+        else:
+            members = [name]
+        for member in members:
+            with self._open_text(member) as f:
+                yield from f
+
+    def read_text(self, name):
+        """Contenido completo de un archivo guardado."""
+        return "".join(self.iter_lines(name))
+
+    def iter_segments(self, start=None, end=None):
+        """
+        Segmentos guardados, opcionalmente solo los que se solapan con [start, end].
+
+        Solo se descomprimen los bloques cuyo rango de tiempo se solapa.
+
+        Args:
+            start: Segundo inicial (None = desde el principio)
+            end: Segundo final (None = hasta el final)
+
+        Yields:
+            dict: Un segmento
+        """
+        for block in self.manifest['segmentos']:
+            if (start is not None and block['fin'] < start) or (end is not None and block['inicio'] > end):
+                continue
+            with self._open_text(block['nombre']) as f:
+                for line in f:
+                    segment = json.loads(line)
+                    if (start is not None and segment.get('end', 0) < start) or \
+                            (end is not None and segment.get('start', 0) > end):
+                        continue
+                    yield segment
+
+    def segment(self, index):
+        """Segmento número `index` (desde 0), descomprimiendo solo su bloque."""
+        block_index, offset = divmod(index, SEGMENT_BLOCK)
+        blocks = self.manifest['segmentos']
+        if index < 0 or block_index >= len(blocks) or offset >= blocks[block_index]['cantidad']:
+            raise IndexError(index)
+        with self._open_text(blocks[block_index]['nombre']) as f:
+            for position, line in enumerate(f):
+                if position == offset:
+                    return json.loads(line)
+
+
+def _write_segment_blocks(bundle, data, manifest):
+    """Guarda un JSONL de segmentos en bloques de SEGMENT_BLOCK líneas."""
+    lines = [line for line in data.decode('utf-8').splitlines(keepends=True) if line.strip()]
+    manifest['segmentos'] = []
+    for number, first in enumerate(range(0, len(lines), SEGMENT_BLOCK)):
+        block = lines[first:first + SEGMENT_BLOCK]
+        name = f"segmentos/{number:05d}.jsonl"
+        bundle.writestr(name, "".join(block))
+        manifest['segmentos'].append({
+            'nombre': name,
+            'primero': first,
+            'cantidad': len(block),
+            'inicio': json.loads(block[0]).get('start', 0),
+            'fin': max(json.loads(line).get('end', 0) for line in block),
+        })
+
+
+def archive_audio(directory, base_name, compression='deflate'):
+    """
+    Guarda los archivos completos de un audio en '<nombre>_archivo.zip' y elimina los originales.
+
+    Si el archivo comprimido ya existe, se conservan sus miembros y se
+    reemplazan los que tengan una versión nueva sin comprimir (p. ej. un
+    texto formateado de nuevo).
+
+    Returns:
+        tuple: (archivos agregados, bytes que ocupaban sin comprimir)
+    """
+    directory = Path(directory)
+    target = directory / f"{base_name}{ARCHIVE_SUFFIX}"
+    files = [directory / f"{base_name}{suffix}" for suffix in ARCHIVED_SUFFIXES]
+    files = [path for path in files if is_complete(path)]
+    if not files:
+        return 0, 0
+
+    new_names = {path.name for path in files}
+    manifest = {'audio': base_name, 'creado': datetime.now().isoformat(timespec='seconds'),
+                'artefactos': {}, 'segmentos': []}
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=COMPRESSION[compression]) as bundle:
+        if is_complete(target):
+            with ArtifactArchive(target) as previous:
+                for name, info in previous.manifest['artefactos'].items():
+                    if name in new_names:
+                        continue
+                    if name.endswith(SEGMENTS_SUFFIX):
+                        for block in previous.manifest['segmentos']:
+                            bundle.writestr(block['nombre'], previous.read_member(block['nombre']))
+                        manifest['segmentos'] = previous.manifest['segmentos']
+                    else:
+                        bundle.writestr(name, previous.read_member(name))
+                    manifest['artefactos'][name] = info
+        for path in files:
+            data = path.read_bytes()
+            if path.name.endswith(SEGMENTS_SUFFIX):
+                _write_segment_blocks(bundle, data, manifest)
+            else:
+                bundle.writestr(path.name, data)
+            manifest['artefactos'][path.name] = {'sha256': hashlib.sha256(data).hexdigest(), 'bytes': len(data)}
+        bundle.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+
+    write_artifact(target, buffer.getvalue())
+    original_bytes = 0
+    for path in files:
+        original_bytes += path.stat().st_size
+        path.unlink()
+        marker_path(path).unlink(missing_ok=True)
+    return len(files), original_bytes
+
+
+def extract_audio(archive_path):
+    """
+    Restaura los archivos de un archivo comprimido y lo elimina.
+
+    Returns:
+        int: Archivos restaurados
+    """
+    archive_path = Path(archive_path)
+    with ArtifactArchive(archive_path) as archive:
+        names = archive.names()
+        for name in names:
+            write_artifact(archive_path.parent / name, archive.read_text(name))
+    archive_path.unlink()
+    marker_path(archive_path).unlink(missing_ok=True)
+    return len(names)
+
+
+def archive_directory(output_dir, compression='deflate', lease_queue=None):
+    """
+    Archiva la salida terminada de todos los audios.
+
+    En modo worker se saltan los audios que otro worker está formateando o
+    analizando.
+
+    Returns:
+        int: Audios archivados
+    """
+    layout = create_layout_from_env(output_dir)
+    archived = 0
+    original = 0
+    for transcript in layout.files(TRANSCRIPT_SUFFIX):
+        base_name = transcript.name[:-len(TRANSCRIPT_SUFFIX)]
+        if lease_queue and (lease_queue.is_claimed(f"formato-{transcript.name}")
+                            or lease_queue.is_claimed(f"analisis-{base_name}{FORMATTED_SUFFIX}")):
+            continue
+        count, original_bytes = archive_audio(transcript.parent, base_name, compression)
+        if count:
+            archived += 1
+            original += original_bytes
+    if archived:
+        logger.info(f"✓ {archived} audio(s) archivados ({original / (1024 * 1024):.1f} MB sin comprimir)")
+    return archived
+
+
+def archive_from_env(output_dir, lease_queue=None):
+    """Archiva la salida si ARCHIVE_OUTPUTS=true (compresión: ARCHIVE_COMPRESSION)."""
+    if os.environ.get('ARCHIVE_OUTPUTS', 'false').lower() != 'true':
+        return 0
+    compression = os.environ.get('ARCHIVE_COMPRESSION', 'deflate').lower()
+    if compression not in COMPRESSION:
+        raise ValueError(f"ARCHIVE_COMPRESSION inválido: {compression} ({', '.join(COMPRESSION)})")
+    return archive_directory(output_dir, compression, lease_queue)
+
+
+def archive_containing(path):
+    """Archivo comprimido que contiene un archivo de salida (None si no está archivado)."""
+    archive_path = archive_path_for(path)
+    if archive_path is None or not is_complete(archive_path):
+        return None
+    with ArtifactArchive(archive_path) as archive:
+        return archive_path if Path(path).name in archive else None
+
+
+def _iter_archived_segments(archive_path):
+    with ArtifactArchive(archive_path) as archive:
+        yield from archive.iter_segments()
+
+
+def segment_source(transcript_path):
+    """
+    Segmentos estructurados de una transcripción, del JSONL o del archivo comprimido.
+
+    Returns:
+        Función sin argumentos que devuelve un iterador nuevo de segmentos,
+        o None si la transcripción no tiene segmentos
+    """
+    jsonl_path = segments_path_for(transcript_path)
+    if jsonl_path.exists():
+        return lambda: iter_segments(jsonl_path)
+    archive_path = archive_containing(jsonl_path)
+    if archive_path:
+        return lambda: _iter_archived_segments(archive_path)
+    return None
+
+
+def _audio_dir(output_dir, audio):
+    return create_layout_from_env(output_dir).audio_dir(audio)
+
+
+def main():
+    """Función principal (CLI)."""
+    setup_logging('archive')
+
+    default_dir = os.environ.get('OUTPUT_DIR', '/app/output')
+    parser = argparse.ArgumentParser(description="Archivo comprimido de la salida")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    archivar = subparsers.add_parser('archivar', help="Comprime la salida terminada de cada audio")
+    archivar.add_argument('directorio', nargs='?', default=default_dir)
+    archivar.add_argument('--compresion', choices=sorted(COMPRESSION),
+                          default=os.environ.get('ARCHIVE_COMPRESSION', 'deflate'))
+
+    extraer = subparsers.add_parser('extraer', help="Restaura los archivos sin comprimir")
+    extraer.add_argument('directorio', nargs='?', default=default_dir)
+
+    leer = subparsers.add_parser('leer', help="Escribe un archivo guardado en la salida estándar")
+    leer.add_argument('audio')
+    leer.add_argument('archivo', help="Nombre (ej: clase1_resumen.txt) o sufijo (ej: _resumen.txt)")
+    leer.add_argument('--directorio', default=default_dir)
+
+    segmentos = subparsers.add_parser('segmentos', help="Segmentos de un intervalo de tiempo (JSONL)")
+    segmentos.add_argument('audio')
+    segmentos.add_argument('--desde', type=float)
+    segmentos.add_argument('--hasta', type=float)
+    segmentos.add_argument('--directorio', default=default_dir)
+
+    args = parser.parse_args()
+
+    if args.comando == 'archivar':
+        archive_directory(args.directorio, args.compresion)
+    elif args.comando == 'extraer':
+        layout = create_layout_from_env(args.directorio)
+        restored = sum(extract_audio(path) for directory in layout.dirs()
+                       for path in directory.glob(f"*{ARCHIVE_SUFFIX}"))
+        print(f"{restored} archivo(s) restaurados.")
+    else:
+        archive_path = _audio_dir(args.directorio, args.audio) / f"{args.audio}{ARCHIVE_SUFFIX}"
+        with ArtifactArchive(archive_path) as archive:
+            if args.comando == 'leer':
+                name = args.archivo if args.archivo in archive else f"{args.audio}{args.archivo}"
+                for line in archive.iter_lines(name):
+                    sys.stdout.write(line)
+            else:
+                for segment in archive.iter_segments(args.desde, args.hasta):
+                    print(json.dumps(segment, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Escritura atómica de los archivos de salida (transcripciones, segmentos,
+textos formateados y análisis).
+
+Cada archivo se arma completo en memoria y se escribe de una vez en un
+temporal del mismo directorio, con fsync, antes de renombrarlo sobre la ruta
+final: una caída nunca deja un archivo a medias con el nombre definitivo.
+Después se registra una marca de completitud (<dir>/.completos/<nombre>.json)
+con el tamaño y el SHA-256, y la reanudación solo da por terminado un
+archivo si su marca existe y coincide.
+
+Uso como CLI:
+    python src/artifacts.py verificar [directorio] [--eliminar]
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+MARKER_DIR = ".completos"
+
+
+def marker_path(path):
+    """Ruta de la marca de completitud de un archivo de salida."""
+    path = Path(path)
+    return path.parent / MARKER_DIR / f"{path.name}.json"
+
+
+def _fsync_dir(directory):
+    """Persiste las entradas de un directorio (el rename) en disco; no disponible en Windows."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """
+    Escribe bytes o texto en `path` de forma atómica (temporal + fsync + rename).
+
+    Args:
+        path: Ruta final
+        data: Contenido (str se codifica en UTF-8)
+    """
+    path = Path(path)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Temporal oculto y sin la extensión final: ninguna etapa lo toma como salida
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def atomic_stream(path):
+    """
+    Archivo binario que se escribe por partes y se renombra sobre `path` al cerrar.
+
+    Para salidas demasiado grandes para armarlas en memoria: mientras se
+    escribe solo existe el temporal, y si el bloque falla se elimina.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+
+def write_artifact(path, content):
+    """
+    Escribe un archivo de salida de forma atómica y registra su marca de completitud.
+
+    La marca anterior se elimina antes de escribir: si el proceso cae entre
+    el rename y la nueva marca, el archivo se considera incompleto y se
+    vuelve a generar.
+
+    Args:
+        path: Ruta final del archivo
+        content: Contenido completo (str o bytes)
+
+    Returns:
+        str: SHA-256 del contenido
+    """
+    path = Path(path)
+    data = content.encode('utf-8') if isinstance(content, str) else bytes(content)
+    marker = marker_path(path)
+    marker.unlink(missing_ok=True)
+    atomic_write(path, data)
+    checksum = hashlib.sha256(data).hexdigest()
+    atomic_write(marker, json.dumps({
+        'sha256': checksum,
+        'bytes': len(data),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+    }))
+    _fsync_dir(path.parent)
+    _fsync_dir(marker.parent)
+    return checksum
+
+
+@contextmanager
+def open_artifact(path):
+    """
+    Buffer de texto que se escribe con write_artifact() al salir del bloque.
+
+    Si el bloque lanza una excepción no se escribe nada.
+    """
+    buffer = io.StringIO()
+    yield buffer
+    write_artifact(path, buffer.getvalue())
+
+
+def is_complete(path, verify=False):
+    """
+    Indica si un archivo de salida está completo según su marca.
+
+    Args:
+        path: Ruta del archivo
+        verify: Si True, además recalcula el SHA-256 (lee el archivo entero);
+            si no, basta con que coincida el tamaño
+
+    Returns:
+        bool: True si el archivo existe, tiene marca y coincide con ella
+    """
+    path = Path(path)
+    try:
+        size = path.stat().st_size
+        marker = json.loads(marker_path(path).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return False
+    if marker.get('bytes') != size:
+        return False
+    if verify:
+        return hashlib.sha256(path.read_bytes()).hexdigest() == marker.get('sha256')
+    return True
+
+
+def _output_files(directory):
+    """Archivos de salida de un directorio y sus subcarpetas (sin los ocultos)."""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        files.extend(Path(root) / name for name in sorted(names) if not name.startswith('.'))
+    return files
+
+
+def adopt_existing(directory):
+    """
+    Registra marcas para los archivos escritos antes de que existieran las marcas.
+
+    Solo actúa si el directorio todavía no tiene carpeta de marcas, es decir,
+    la primera vez que esta versión usa un directorio de salida; así una
+    actualización no obliga a transcribir todo de nuevo.
+
+    Returns:
+        int: Archivos registrados
+    """
+    directory = Path(directory)
+    if not directory.is_dir() or (directory / MARKER_DIR).exists():
+        return 0
+    files = _output_files(directory)
+    for path in files:
+        data = path.read_bytes()
+        atomic_write(marker_path(path), json.dumps({
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'bytes': len(data),
+            'fecha': datetime.fromtimestamp(path.stat().st_mtime).isoformat(timespec='seconds'),
+            'adoptado': True,
+        }))
+    (directory / MARKER_DIR).mkdir(exist_ok=True)
+    if files:
+        logger.info(f"✓ {len(files)} archivo(s) de salida existentes registrados como completos")
+    return len(files)
+
+
+def verify_directory(directory):
+    """
+    Verifica los archivos de salida de un directorio contra sus marcas.
+
+    Returns:
+        list: Tuplas (ruta, problema) con problema 'sin_marca' o 'corrupto'
+    """
+    problems = []
+    for path in _output_files(directory):
+        if not marker_path(path).exists():
+            problems.append((path, 'sin_marca'))
+        elif not is_complete(path, verify=True):
+            problems.append((path, 'corrupto'))
+    return problems
+
+
+def main():
+    """Función principal (CLI)."""
+    setup_logging('artifacts')
+
+    parser = argparse.ArgumentParser(description="Verificación de los archivos de salida")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    verificar = subparsers.add_parser('verificar', help="Compara los archivos con su tamaño y SHA-256")
+    verificar.add_argument('directorio', nargs='?', default=os.environ.get('OUTPUT_DIR', '/app/output'))
+    verificar.add_argument('--eliminar', action='store_true',
+                           help="Elimina los archivos con problemas para que se regeneren")
+
+    args = parser.parse_args()
+
+    problems = verify_directory(args.directorio)
+    for path, problem in problems:
+        print(f"{problem}: {path.name}")
+        if args.eliminar:
+            path.unlink()
+            marker_path(path).unlink(missing_ok=True)
+    if not problems:
+        print("Todos los archivos coinciden con sus marcas.")
+    return 1 if problems and not args.eliminar else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
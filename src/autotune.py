@@ -0,0 +1,361 @@
+"""
+Calibración automática según los recursos del contenedor.
+
+Lee los límites de CPU y memoria del cgroup, mide el modelo de Whisper
+(factor de tiempo real con distintos hilos) y la velocidad de Ollama
+(tokens/s), y con eso elige los workers de transcripción, los hilos de
+torch, la concurrencia de formateo y el tamaño de los chunks. El perfil se
+guarda en output/.perfil_rendimiento.json: las ejecuciones siguientes con
+los mismos recursos y modelos lo reutilizan sin volver a medir.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from artifacts import atomic_write
+
+logger = logging.getLogger(__name__)
+
+PROFILE_NAME = ".perfil_rendimiento.json"
+SAMPLE_RATE = 16000
+# Whisper procesa el audio en ventanas de 30 s: medir menos no ahorra tiempo
+BENCHMARK_SECONDS = 30
+CHARS_PER_TOKEN = 4
+# Memoria que se reserva para el sistema y el resto del pipeline
+MEMORY_RESERVE_MB = 1024
+
+
+def _read(path):
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    """
+    CPUs disponibles: cuota del cgroup (v2 o v1) acotada por la afinidad del proceso.
+
+    Returns:
+        float: Número de CPUs (puede ser fraccionario, ej: 1.5)
+    """
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cpus = float(os.cpu_count() or 1)
+
+    quota = period = None
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')  # cgroup v2: "<cuota> <periodo>" o "max <periodo>"
+    if cpu_max:
+        value, _, period_value = cpu_max.partition(' ')
+        if value != 'max':
+            quota, period = float(value), float(period_value or 100000)
+    else:
+        quota_value = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')  # cgroup v1 (-1 = sin límite)
+        period_value = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota_value and period_value and int(quota_value) > 0:
+            quota, period = float(quota_value), float(period_value)
+
+    if quota and period:
+        cpus = min(cpus, quota / period)
+    return max(cpus, 1.0)
+
+
+def cgroup_memory_limit_mb():
+    """
+    Memoria disponible en MB: límite del cgroup (v2 o v1) o, sin límite, la RAM física.
+
+    Returns:
+        int: Memoria en MB
+    """
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limit = physical
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read(path)
+        if value and value.isdigit():
+            # cgroup v1 indica "sin límite" con un valor enorme
+            limit = min(int(value), physical)
+            break
+    return limit // (1024 * 1024)
+
+
+def read_resources():
+    """Límites de CPU y memoria del contenedor."""
+    return {'cpus': round(cgroup_cpu_limit(), 2), 'memoria_mb': cgroup_memory_limit_mb()}
+
+
+def _thread_candidates(cpus):
+    """Hilos por worker a medir: todas las CPUs, la mitad, un cuarto..."""
+    candidates = []
+    threads = cpus
+    while threads >= 1 and len(candidates) < 3:
+        candidates.append(threads)
+        threads //= 2
+    return sorted(set(candidates))
+
+
+def _model_memory_mb(model):
+    """Memoria estimada de un worker: pesos del modelo ×2 (activaciones) + runtime."""
+    weights = sum(p.numel() * p.element_size() for p in model.parameters())
+    return int(2 * weights / (1024 * 1024)) + 512
+
+
+def benchmark_whisper(transcriber, audio, threads):
+    """
+    Mide el factor de tiempo real (segundos de cómputo por segundo de audio).
+
+    Args:
+        transcriber: AudioTranscriber con el modelo cargado
+        audio: Muestra de audio PCM 16 kHz (numpy float32)
+        threads: Hilos de torch para la medición
+
+    Returns:
+        float: Factor de tiempo real (RTF); < 1 es más rápido que tiempo real
+    """
+    import torch
+
+    torch.set_num_threads(threads)
+    start = time.perf_counter()
+    transcriber.model.transcribe(
+        audio,
+        language=transcriber.language,
+        fp16=False,
+        verbose=None,
+        temperature=0.0,
+        condition_on_previous_text=False
+    )
+    return (time.perf_counter() - start) / (len(audio) / SAMPLE_RATE)
+
+
+def benchmark_ollama(client, model):
+    """
+    Mide la velocidad de Ollama con una petición corta.
+
+    Returns:
+        dict: 'tokens_por_segundo' (generación) y 'prompt_tokens_por_segundo'
+    """
+    prompt = "Escribe los números del 1 al 40 en palabras, separados por comas."
+    result = client.generate(prompt, model=model, options={"num_predict": 64, "temperature": 0},
+                             record_stats=False)
+    eval_seconds = result.get('eval_duration', 0) / 1e9
+    prompt_seconds = result.get('prompt_eval_duration', 0) / 1e9
+    return {
+        'tokens_por_segundo': result.get('eval_count', 0) / eval_seconds if eval_seconds else 0.0,
+        'prompt_tokens_por_segundo': (
+            result.get('prompt_eval_count', 0) / prompt_seconds if prompt_seconds else 0.0
+        ),
+    }
+
+
+def sample_audio(input_dir):
+    """
+    Primeros 30 s del primer audio de input_dir (ruido si no hay ninguno).
+
+    Medir con habla real da un RTF representativo: con ruido Whisper
+    decodifica muy poco texto.
+    """
+    import numpy as np
+
+    from transcribe import AUDIO_EXTENSIONS
+
+    samples = BENCHMARK_SECONDS * SAMPLE_RATE
+    input_dir = Path(input_dir)
+    if input_dir.exists():
+        for path in sorted(input_dir.iterdir()):
+            if path.is_file() and path.suffix.lower() in AUDIO_EXTENSIONS:
+                try:
+                    import whisper
+
+                    audio = whisper.load_audio(str(path))[:samples]
+                    if len(audio) >= SAMPLE_RATE:
+                        return audio
+                except Exception as e:
+                    logger.warning(f"⚠️  No se pudo leer {path.name} para la calibración: {e}")
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(samples) * 0.01).astype(np.float32)
+
+
+class AutoTuner:
+    """Perfil de rendimiento persistente y su aplicación a cada etapa."""
+
+    def __init__(self, profile_path, recalibrate=False, chunk_seconds=180.0):
+        """
+        Args:
+            profile_path: Archivo JSON del perfil
+            recalibrate: Medir de nuevo aunque exista un perfil compatible
+            chunk_seconds: Tiempo objetivo de generación por chunk de formateo
+        """
+        self.profile_path = Path(profile_path)
+        self.recalibrate = recalibrate
+        self.chunk_seconds = chunk_seconds
+        self.resources = read_resources()
+        self.profile = {} if recalibrate else self._read(warn=True)
+
+    @classmethod
+    def from_env(cls, output_dir):
+        """Crea el calibrador desde AUTOTUNE y AUTOTUNE_CHUNK_SECONDS (None si AUTOTUNE=false)."""
+        mode = os.environ.get('AUTOTUNE', 'true').lower()
+        if mode == 'false':
+            return None
+        return cls(
+            Path(output_dir) / PROFILE_NAME,
+            recalibrate=mode == 'recalibrar',
+            chunk_seconds=float(os.environ.get('AUTOTUNE_CHUNK_SECONDS', '180'))
+        )
+
+    def _read(self, warn=False):
+        """Perfil guardado ({} si no existe o está ilegible)."""
+        if not self.profile_path.exists():
+            return {}
+        try:
+            return json.loads(self.profile_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            if warn:
+                logger.warning(f"Perfil de rendimiento ilegible, se recalibra: {e}")
+            return {}
+
+    def _section(self, name, key):
+        """Sección del perfil si se midió con los mismos recursos y modelo."""
+        section = self.profile.get(name)
+        if section and section.get('clave') == key:
+            return section
+        return None
+
+    def _save(self, name, section):
+        # Se relee el archivo: la transcripción y el formateo calibran en
+        # procesos distintos y cada uno guarda solo su sección
+        self.profile = dict(self._read(), **{name: section})
+        atomic_write(self.profile_path, json.dumps(self.profile, ensure_ascii=False, indent=2))
+
+    def tune_transcription(self, transcriber, input_dir):
+        """
+        Elige workers de transcripción e hilos de torch y los aplica a este proceso.
+
+        Mide el RTF con todas las CPUs, la mitad y un cuarto por worker, y
+        se queda con la combinación de mayor rendimiento total (workers / RTF)
+        que cabe en memoria. En GPU (real o simulada) se usa un solo worker.
+        TRANSCRIPTION_WORKERS y TORCH_THREADS tienen prioridad sobre el perfil.
+
+        Args:
+            transcriber: AudioTranscriber con el modelo cargado
+            input_dir: Directorio de audios (se mide con el primero)
+
+        Returns:
+            dict: 'trabajadores' e 'hilos'
+        """
+        import torch
+
+        cpus = max(1, int(self.resources['cpus']))
+        key = f"{transcriber.model_name}-{transcriber.device}-{self.resources['cpus']}cpu-{self.resources['memoria_mb']}mb"
+        section = self._section('whisper', key)
+
+        if section is None:
+            logger.info("⏳ Calibrando Whisper (solo la primera vez con estos recursos)...")
+            worker_memory = _model_memory_mb(transcriber.model)
+            memory_workers = max(1, (self.resources['memoria_mb'] - MEMORY_RESERVE_MB) // worker_memory)
+            audio = sample_audio(input_dir)
+
+            rtf = {}
+            if transcriber.device != 'cpu':
+                rtf[cpus] = benchmark_whisper(transcriber, audio, cpus)
+                best = cpus
+            else:
+                # De menos a más hilos: la primera medición incluye la
+                # inicialización, lo que favorece la opción conservadora
+                for threads in _thread_candidates(cpus):
+                    if cpus // threads <= memory_workers:
+                        rtf[threads] = benchmark_whisper(transcriber, audio, threads)
+                        logger.info(f"  {threads} hilo(s): RTF {rtf[threads]:.2f}")
+                # Más workers solo si rinden al menos un 10% más en total
+                best = max(rtf)
+                for threads in sorted(rtf, reverse=True):
+                    if (cpus // threads) / rtf[threads] > 1.1 * (cpus // best) / rtf[best]:
+                        best = threads
+
+            section = {
+                'clave': key,
+                'rtf': {str(threads): round(value, 3) for threads, value in rtf.items()},
+                'memoria_worker_mb': worker_memory,
+                'trabajadores': cpus // best,
+                'hilos': best,
+            }
+            self._save('whisper', section)
+
+        workers = int(os.environ.get('TRANSCRIPTION_WORKERS') or section['trabajadores'])
+        threads = int(os.environ.get('TORCH_THREADS') or section['hilos'])
+        torch.set_num_threads(threads)
+        logger.info(
+            f"⚙️  Transcripción: {workers} worker(s) × {threads} hilo(s) "
+            f"(RTF medido: {section['rtf'].get(str(section['hilos']), '?')})"
+        )
+        return {'trabajadores': workers, 'hilos': threads}
+
+    def tune_formatter(self, formatter):
+        """
+        Ajusta concurrencia, tamaño de chunk y timeouts de un formateador de Ollama.
+
+        El chunk se limita para que su salida quepa en max_tokens y se genere
+        en unos chunk_seconds a la velocidad medida. OLLAMA_CONCURRENCY tiene
+        prioridad sobre la concurrencia del perfil. Otros motores no se tocan.
+
+        Returns:
+            dict: Sección 'ollama' del perfil (None si el motor no usa Ollama)
+        """
+        client = getattr(formatter, 'client', None)
+        if formatter.name != 'ollama' or client is None:
+            return None
+
+        key = f"{formatter.model_name}@{','.join(client.hosts)}"
+        section = self._section('ollama', key)
+        if section is None:
+            logger.info("⏳ Midiendo la velocidad de Ollama...")
+            try:
+                speed = benchmark_ollama(client, formatter.model_name)
+            except Exception as e:
+                logger.warning(f"⚠️  No se pudo medir Ollama, se mantienen los valores por defecto: {e}")
+                return None
+            tokens_per_second = speed['tokens_por_segundo'] or client.tokens_per_second
+            prompt_per_second = speed['prompt_tokens_por_segundo'] or tokens_per_second * 10
+
+            # En CPU las peticiones en paralelo solo se reparten la misma CPU
+            # (y esperan en cola sin que su timeout lo contemple)
+            per_host = 1 if tokens_per_second < 10 else 2 if tokens_per_second < 40 else 4
+            format_chunk = min(
+                formatter.max_tokens * CHARS_PER_TOKEN * 0.9,
+                self.chunk_seconds * tokens_per_second * CHARS_PER_TOKEN
+            )
+            # El análisis genera poco texto: lo limita la evaluación del prompt
+            analysis_chunk = self.chunk_seconds * prompt_per_second * CHARS_PER_TOKEN / 4
+            section = {
+                'clave': key,
+                'tokens_por_segundo': round(tokens_per_second, 1),
+                'prompt_tokens_por_segundo': round(prompt_per_second, 1),
+                'concurrencia_por_host': per_host,
+                'chunk_formateo': int(min(max(format_chunk, 2000), 25000)),
+                'chunk_analisis': int(min(max(analysis_chunk, 4000), 15000)),
+            }
+            self._save('ollama', section)
+
+        if not os.environ.get('OLLAMA_CONCURRENCY'):
+            client.set_concurrency(section['concurrencia_por_host'])
+            formatter.concurrency = client.max_in_flight
+        formatter.chunk_size = section['chunk_formateo']
+        # Margen de 2× para los timeouts: las peticiones simultáneas de un
+        # host se reparten su velocidad
+        client.tokens_per_second = section['tokens_por_segundo'] / (2 * client.per_host_concurrency)
+        client.prompt_chars_per_second = (
+            section['prompt_tokens_por_segundo'] * CHARS_PER_TOKEN / (2 * client.per_host_concurrency)
+        )
+        logger.info(
+            f"⚙️  Ollama: {section['tokens_por_segundo']} tokens/s, "
+            f"{client.per_host_concurrency} petición(es) por host, chunks de {formatter.chunk_size} caracteres"
+        )
+        return section
+
+    def tune_analyzer(self, analyzer):
+        """Aplica el tamaño de chunk de análisis del perfil (si Ollama ya se midió)."""
+        section = self._section('ollama', f"{analyzer.model}@{','.join(analyzer.client.hosts)}")
+        if section:
+            analyzer.max_chunk_size = section['chunk_analisis']
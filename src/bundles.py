@@ -0,0 +1,395 @@
+"""
+Importación y exportación masiva de transcripciones en paquetes JSONL o tar.
+
+Permite formatear y analizar transcripciones hechas fuera de esta
+herramienta sin desempaquetarlas en archivos sueltos: el paquete de entrada
+se lee en streaming, cada transcripción pasa directo por el formateo y el
+análisis (como máximo `concurrency` en memoria a la vez) y el resultado se
+escribe, en el mismo orden, en un paquete de salida. También exporta la
+salida de una ejecución normal en el mismo formato.
+
+Formatos (según la extensión):
+- .jsonl / .jsonl.gz: un objeto por línea con 'audio', 'texto',
+  'segmentos' (opcional, como los de Whisper: start, end, text, speaker) y
+  'metadatos'; también se aceptan 'id', 'text', 'segments' y 'metadata'.
+  La salida agrega 'formateado', 'resumen', 'puntos_clave' y 'temas'.
+- .tar / .tar.gz / .tgz: una carpeta por audio con
+  <audio>_transcripcion.txt, <audio>_segmentos.jsonl, metadatos.json y los
+  resultados. En la entrada también vale <audio>.txt / .jsonl / .json; los
+  archivos de un mismo audio deben estar seguidos en el tar.
+
+Uso:
+    python src/bundles.py procesar entrada.jsonl salida.jsonl
+    python src/bundles.py exportar salida.tar.gz [--directorio output/]
+"""
+import argparse
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import tarfile
+import time
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+
+from archive import ArtifactArchive, archive_containing, segment_source
+from artifacts import atomic_stream, is_complete
+from log_setup import file_context, setup_logging
+from ollama_client import run_sync, stream_ordered
+from output_layout import FORMATTED_SUFFIX, TRANSCRIPT_SUFFIX, create_layout_from_env
+from preflight import read_durations
+
+logger = logging.getLogger(__name__)
+
+# Campo del registro -> sufijo del archivo de salida
+RESULT_SUFFIXES = {
+    'formateado': FORMATTED_SUFFIX,
+    'resumen': "_resumen.txt",
+    'puntos_clave': "_puntos_clave.txt",
+    'temas': "_temas.txt",
+}
+MEMBER_SUFFIXES = dict(
+    {suffix: field for field, suffix in RESULT_SUFFIXES.items()},
+    **{TRANSCRIPT_SUFFIX: 'texto', "_segmentos.jsonl": 'segmentos'}
+)
+# Extensiones genéricas de los tar hechos fuera de la herramienta
+GENERIC_EXTENSIONS = {'.txt': 'texto', '.jsonl': 'segmentos', '.json': 'metadatos'}
+METADATA_NAME = "metadatos.json"
+
+
+def bundle_format(path):
+    """Formato de un paquete según su extensión ('jsonl' o 'tar')."""
+    name = Path(path).name.lower()
+    if name.endswith(('.jsonl', '.jsonl.gz')):
+        return 'jsonl'
+    if name.endswith(('.tar', '.tar.gz', '.tgz')):
+        return 'tar'
+    raise ValueError(f"Formato de paquete no reconocido: {name} (.jsonl, .jsonl.gz, .tar, .tar.gz o .tgz)")
+
+
+def normalize_record(record, number):
+    """Registro con los campos de la herramienta (acepta también los nombres en inglés)."""
+    segments = record.get('segmentos') or record.get('segments') or None
+    if not isinstance(segments, list) or not all(isinstance(segment, dict) for segment in segments):
+        segments = None
+    text = record.get('texto') or record.get('text') or ""
+    if not isinstance(text, str):
+        text = str(text)
+    if not text and segments:
+        text = " ".join(str(segment.get('text', '')).strip() for segment in segments)
+    metadata = record.get('metadatos') or record.get('metadata') or {}
+    if not isinstance(metadata, dict):
+        # Se conserva el valor, pero el resto del proceso espera un objeto
+        metadata = {'original': metadata}
+    normalized = {
+        'audio': str(record.get('audio') or record.get('id') or f"registro{number:06d}"),
+        'texto': text,
+        'segmentos': segments,
+        'metadatos': metadata,
+    }
+    for field in RESULT_SUFFIXES:
+        if record.get(field):
+            normalized[field] = record[field]
+    return normalized
+
+
+def _read_jsonl(path):
+    opener = gzip.open if str(path).lower().endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                yield normalize_record(json.loads(line), number)
+
+
+def _member_field(name):
+    """(audio, campo) de un miembro del tar, o (None, None) si no se usa."""
+    path = PurePosixPath(name)
+    if path.name == METADATA_NAME and len(path.parts) > 1:
+        return path.parent.name, 'metadatos'
+    for suffix, field in MEMBER_SUFFIXES.items():
+        if path.name.endswith(suffix) and len(path.name) > len(suffix):
+            return path.name[:-len(suffix)], field
+    field = GENERIC_EXTENSIONS.get(path.suffix.lower())
+    if field:
+        return path.stem, field
+    return None, None
+
+
+def _record_from_members(audio, members, number):
+    record = {'audio': audio}
+    for field, data in members.items():
+        text = data.decode('utf-8')
+        if field == 'segmentos':
+            record[field] = [json.loads(line) for line in text.splitlines() if line.strip()]
+        elif field == 'metadatos':
+            record[field] = json.loads(text)
+        else:
+            record[field] = text
+    return normalize_record(record, number)
+
+
+def _read_tar(path):
+    # Modo streaming ('r|*'): el tar se lee una sola vez, sin saltos, y solo
+    # se guardan en memoria los archivos del audio actual
+    with tarfile.open(path, 'r|*') as tar:
+        current, members, number = None, {}, 0
+        for member in tar:
+            if not member.isfile():
+                continue
+            audio, field = _member_field(member.name)
+            if field is None:
+                continue
+            if audio != current and members:
+                number += 1
+                yield _record_from_members(current, members, number)
+                members = {}
+            current = audio
+            members[field] = tar.extractfile(member).read()
+        if members:
+            yield _record_from_members(current, members, number + 1)
+
+
+def read_bundle(path):
+    """
+    Lee un paquete de transcripciones en streaming.
+
+    Yields:
+        dict: Registro normalizado ('audio', 'texto', 'segmentos', 'metadatos', ...)
+    """
+    if bundle_format(path) == 'jsonl':
+        yield from _read_jsonl(path)
+    else:
+        yield from _read_tar(path)
+
+
+class BundleWriter:
+    """Escribe registros en un paquete JSONL o tar, de forma atómica al cerrar."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.format = bundle_format(self.path)
+        self.count = 0
+        self._stream = None
+        self._file = None
+        self._tar = None
+
+    def __enter__(self):
+        self._stream = atomic_stream(self.path)
+        raw = self._stream.__enter__()
+        compressed = self.path.name.lower().endswith(('.gz', '.tgz'))
+        if self.format == 'jsonl':
+            binary = gzip.GzipFile(fileobj=raw, mode='wb') if compressed else raw
+            self._file = io.TextIOWrapper(binary, encoding='utf-8')
+        else:
+            self._tar = tarfile.open(fileobj=raw, mode='w|gz' if compressed else 'w|')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file:
+            # Cerrar el gzip sin cerrar el archivo temporal de debajo
+            self._file.flush()
+            binary = self._file.detach()
+            if isinstance(binary, gzip.GzipFile):
+                binary.close()
+        if self._tar:
+            self._tar.close()
+        return self._stream.__exit__(exc_type, exc, tb)
+
+    def _add_member(self, name, text):
+        data = text.encode('utf-8')
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def write(self, record):
+        """Agrega un registro al paquete."""
+        self.count += 1
+        if self.format == 'jsonl':
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            return
+        audio = record['audio']
+        self._add_member(f"{audio}/{audio}{TRANSCRIPT_SUFFIX}", record.get('texto') or "")
+        if record.get('segmentos'):
+            self._add_member(
+                f"{audio}/{audio}_segmentos.jsonl",
+                "".join(json.dumps(segment, ensure_ascii=False) + "\n" for segment in record['segmentos'])
+            )
+        for field, suffix in RESULT_SUFFIXES.items():
+            if record.get(field):
+                self._add_member(f"{audio}/{audio}{suffix}", record[field])
+        self._add_member(f"{audio}/{METADATA_NAME}", json.dumps(record.get('metadatos') or {}, ensure_ascii=False))
+
+
+async def process_bundle_async(formatter, source, target, analyzer=None, summary=True, key_points=True, topics=True):
+    """
+    Formatea (y opcionalmente analiza) todas las transcripciones de un paquete.
+
+    Los registros se leen de forma perezosa y se procesan con hasta
+    `formatter.concurrency` en curso; los resultados se escriben en orden
+    apenas están listos, así la memoria no depende del tamaño del paquete.
+
+    Args:
+        formatter: Motor de formateo (FormatterEngine) ya preparado
+        source: Paquete de entrada
+        target: Paquete de salida
+        analyzer: TranscriptionAnalyzer opcional
+        summary, key_points, topics: Análisis a generar con `analyzer`
+
+    Returns:
+        tuple: (registros procesados, registros con error)
+    """
+    analyses = []
+    if analyzer:
+        analyses = [(field, generate) for enabled, field, generate in (
+            (summary, 'resumen', analyzer.generate_summary_async),
+            (key_points, 'puntos_clave', analyzer.generate_key_points_async),
+            (topics, 'temas', analyzer.generate_topics_async),
+        ) if enabled]
+
+    async def process(record):
+        with file_context(record['audio']):
+            if not record['texto'].strip():
+                return dict(record, error="transcripción vacía")
+            try:
+                segments = record['segmentos']
+                formatted = await formatter.format_transcript_async(
+                    record['texto'], (lambda: iter(segments)) if segments else None
+                )
+                if not formatted:
+                    return dict(record, error="no se pudo formatear")
+                results = await asyncio.gather(*(generate(formatted) for _, generate in analyses))
+                processed = dict(record, formateado=formatted)
+                processed['metadatos'] = dict(record['metadatos'], formateador=formatter.description,
+                                              procesado=datetime.now().isoformat(timespec='seconds'))
+                for (field, _), content in zip(analyses, results):
+                    if content:
+                        processed[field] = content
+                return processed
+            except Exception as e:
+                logger.error(f"✗ Error en {record['audio']}: {e}")
+                return dict(record, error=str(e))
+
+    await formatter.warm_up_async()
+    errors = 0
+    with BundleWriter(target) as writer:
+        async for record in stream_ordered(process, read_bundle(source), formatter.concurrency):
+            writer.write(record)
+            if record.get('error'):
+                errors += 1
+            if writer.count % 100 == 0:
+                logger.info(f"⏳ {writer.count} transcripción(es) procesadas...")
+    logger.info(f"✓ Paquete procesado: {writer.count} transcripción(es), {errors} con error → {target}")
+    formatter.report()
+    return writer.count, errors
+
+
+def process_bundle(formatter, source, target, analyzer=None, summary=True, key_points=True, topics=True):
+    """Versión síncrona de process_bundle_async()."""
+    return run_sync(process_bundle_async(formatter, source, target, analyzer, summary, key_points, topics))
+
+
+def _read_output(path):
+    """Contenido de un archivo de salida, sin comprimir o desde el archivo comprimido (None si no existe)."""
+    if is_complete(path):
+        return path.read_text(encoding='utf-8')
+    archive_path = archive_containing(path)
+    if archive_path:
+        with ArtifactArchive(archive_path) as archive:
+            return archive.read_text(path.name)
+    return None
+
+
+def export_output(output_dir, target):
+    """
+    Exporta la salida de la herramienta (plana, particionada o archivada) a un paquete.
+
+    Returns:
+        int: Transcripciones exportadas
+    """
+    output_dir = Path(output_dir)
+    durations = {Path(name).stem: seconds for name, seconds in read_durations(output_dir).items()}
+    with BundleWriter(target) as writer:
+        for transcript in create_layout_from_env(output_dir).files(TRANSCRIPT_SUFFIX):
+            audio = transcript.name[:-len(TRANSCRIPT_SUFFIX)]
+            segments = segment_source(transcript)
+            record = {
+                'audio': audio,
+                'texto': transcript.read_text(encoding='utf-8'),
+                'segmentos': list(segments()) if segments else None,
+                'metadatos': {'duracion': durations.get(audio)} if durations.get(audio) else {},
+            }
+            for field, suffix in RESULT_SUFFIXES.items():
+                content = _read_output(transcript.parent / f"{audio}{suffix}")
+                if content:
+                    record[field] = content
+            writer.write(record)
+    logger.info(f"✓ {writer.count} transcripción(es) exportadas a {target}")
+    return writer.count
+
+
+def _create_analyzer(formatter):
+    """Analizador con el cliente de Ollama del formateador, según ENABLE_SUMMARY/KEY_POINTS/TOPICS."""
+    flags = {name: os.environ.get(f'ENABLE_{name.upper()}', 'false').lower() == 'true'
+             for name in ('summary', 'key_points', 'topics')}
+    if formatter.name != 'ollama' or not any(flags.values()):
+        return None, flags
+    from analyze_ollama import TranscriptionAnalyzer
+
+    analyzer = TranscriptionAnalyzer(
+        ollama_url=formatter.ollama_hosts,
+        model=formatter.model_name,
+        client=formatter.client
+    )
+    return analyzer, flags
+
+
+def main():
+    """Función principal (CLI)."""
+    setup_logging('bundles')
+
+    parser = argparse.ArgumentParser(description="Importación y exportación masiva de transcripciones")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    procesar = subparsers.add_parser('procesar', help="Formatea y analiza un paquete de transcripciones")
+    procesar.add_argument('entrada')
+    procesar.add_argument('salida')
+    procesar.add_argument('--sin-analisis', action='store_true', help="Solo formatear")
+
+    exportar = subparsers.add_parser('exportar', help="Exporta la salida a un paquete")
+    exportar.add_argument('salida')
+    exportar.add_argument('--directorio', default=os.environ.get('OUTPUT_DIR', '/app/output'))
+
+    args = parser.parse_args()
+
+    if args.comando == 'exportar':
+        export_output(args.directorio, args.salida)
+        return 0
+
+    from format_engine import prepare_engine_from_env
+
+    fallback = os.environ.get('FORMATTER_FALLBACK', 'reglas').lower()
+    formatter = prepare_engine_from_env(
+        os.environ.get('FORMATTER', 'ollama').lower(),
+        None if fallback == 'none' else fallback
+    )
+    if formatter is None:
+        logger.error("Ningún formateador disponible.")
+        return 1
+    analyzer, flags = (None, {}) if args.sin_analisis else _create_analyzer(formatter)
+    try:
+        _, errors = process_bundle(
+            formatter, args.entrada, args.salida, analyzer,
+            flags.get('summary'), flags.get('key_points'), flags.get('topics')
+        )
+    finally:
+        formatter.release()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+Planificador de dispositivos para la transcripción.
+
+Si Whisper se queda sin memoria de GPU en un archivo, el archivo se
+reintenta con un modelo más pequeño o en CPU sin reiniciar el proceso; el
+siguiente archivo vuelve a intentarse primero en la GPU. Los modelos de
+respaldo se cargan la primera vez que se necesitan y quedan en caché.
+
+Con USE_GPU=simulado el modelo corre en CPU pero se comporta como una GPU
+con memoria limitada (falla con audios largos), para probar el respaldo y
+el modo híbrido en equipos sin GPU.
+"""
+import logging
+import os
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Orden de modelos para el respaldo "modelo más pequeño"
+MODEL_SIZES = ['tiny', 'base', 'small', 'medium', 'large']
+FALLBACK_STEPS = ('menor', 'cpu')
+
+
+class SimulatedOutOfMemoryError(RuntimeError):
+    """Falta de memoria de la GPU simulada."""
+
+
+def is_oom_error(error):
+    """Indica si una excepción es una falta de memoria de la GPU (real o simulada)."""
+    if isinstance(error, SimulatedOutOfMemoryError):
+        return True
+    try:
+        import torch
+
+        if isinstance(error, torch.cuda.OutOfMemoryError):
+            return True
+    except (ImportError, AttributeError):
+        pass
+    return "out of memory" in str(error).lower()
+
+
+def smaller_model(model_name):
+    """
+    Modelo de Whisper inmediatamente más pequeño (None si ya es el menor).
+
+    Acepta variantes como 'large-v3' o 'medium.en'.
+    """
+    base, dot, suffix = model_name.partition('.')
+    base = base.split('-')[0]
+    if base not in MODEL_SIZES or base == MODEL_SIZES[0]:
+        return None
+    smaller = MODEL_SIZES[MODEL_SIZES.index(base) - 1]
+    # Los modelos solo en inglés (.en) existen hasta medium
+    return f"{smaller}{dot}{suffix}" if suffix else smaller
+
+
+class SimulatedGpuModel:
+    """
+    Envuelve un modelo cargado en CPU y simula una GPU con memoria limitada.
+
+    Los audios más largos que max_seconds fallan con
+    SimulatedOutOfMemoryError, como lo haría una GPU con poca VRAM.
+    """
+
+    def __init__(self, model, max_seconds=600.0):
+        self._model = model
+        self.max_seconds = max_seconds
+
+    def transcribe(self, audio, **options):
+        seconds = len(audio) / SAMPLE_RATE
+        if seconds > self.max_seconds:
+            raise SimulatedOutOfMemoryError(
+                f"CUDA out of memory (simulado): {seconds:.0f}s de audio > {self.max_seconds:.0f}s"
+            )
+        return self._model.transcribe(audio, **options)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def load_whisper_model(model_name, device):
+    """Carga un modelo de Whisper (el dispositivo 'simulado' carga en CPU)."""
+    import whisper
+
+    if device == 'simulado':
+        max_seconds = float(os.environ.get('SIMULATED_GPU_MAX_SECONDS', '600'))
+        return SimulatedGpuModel(whisper.load_model(model_name, device='cpu'), max_seconds)
+    return whisper.load_model(model_name, device=device)
+
+
+@contextmanager
+def wrapped_decode(model, hook):
+    """
+    Reemplaza model.decode por hook(modelo, decode) durante el bloque.
+
+    Whisper llama a model.decode() una vez por ventana de 30 s, así que el
+    hook puede ajustar las opciones (p. ej. el prompt) de cada ventana.
+    """
+    if hook is None:
+        yield
+        return
+    inner = model._model if isinstance(model, SimulatedGpuModel) else model
+    inner.decode = hook(inner, inner.decode)
+    try:
+        yield
+    finally:
+        # Vuelve a quedar el método de la clase
+        del inner.decode
+
+
+class DeviceScheduler:
+    """Ejecuta cada transcripción en la GPU y recurre a los respaldos ante falta de memoria."""
+
+    def __init__(self, model, model_name, device, fallbacks=FALLBACK_STEPS, loader=load_whisper_model):
+        """
+        Args:
+            model: Modelo principal ya cargado
+            model_name: Nombre del modelo principal
+            device: Dispositivo del modelo principal ('cuda', 'cpu' o 'simulado')
+            fallbacks: Pasos de respaldo en orden: 'menor' (modelo más
+                pequeño en el mismo dispositivo) y/o 'cpu' (mismo modelo en CPU)
+            loader: Función (model_name, device) -> modelo
+        """
+        self.model_name = model_name
+        self.device = device
+        self.loader = loader
+        self._models = {(model_name, device): model}
+        # Modelos movidos a CPU para dejar la GPU a otro
+        self._offloaded = set()
+        self.attempts = self._plan(fallbacks) if device != 'cpu' else [(model_name, device)]
+        self.fallbacks_used = 0
+
+    @classmethod
+    def from_env(cls, model, model_name, device):
+        """Crea el planificador desde OOM_FALLBACK (ej: 'menor,cpu'; 'none' = sin respaldo)."""
+        value = os.environ.get('OOM_FALLBACK', ','.join(FALLBACK_STEPS)).lower()
+        steps = [] if value == 'none' else [step.strip() for step in value.split(',') if step.strip()]
+        unknown = set(steps) - set(FALLBACK_STEPS)
+        if unknown:
+            raise ValueError(f"OOM_FALLBACK inválido: {', '.join(sorted(unknown))}")
+        return cls(model, model_name, device, fallbacks=steps)
+
+    def _plan(self, fallbacks):
+        """Secuencia de (modelo, dispositivo) a intentar para cada archivo."""
+        attempts = [(self.model_name, self.device)]
+        for step in fallbacks:
+            if step == 'menor':
+                smaller = smaller_model(self.model_name)
+                if smaller:
+                    attempts.append((smaller, self.device))
+            elif step == 'cpu':
+                attempts.append((self.model_name, 'cpu'))
+        return attempts
+
+    def _model(self, model_name, device):
+        key = (model_name, device)
+        if device.startswith('cuda'):
+            self._make_room(key)
+        if key not in self._models:
+            logger.info(f"Cargando modelo de respaldo {model_name} en {device}...")
+            self._models[key] = self.loader(model_name, device)
+        model = self._models[key]
+        if key in self._offloaded:
+            logger.info(f"Devolviendo el modelo {model_name} a {device}...")
+            model.to(device)
+            self._offloaded.discard(key)
+        return model
+
+    def _make_room(self, key):
+        """
+        Mueve a CPU los demás modelos de la misma GPU.
+
+        empty_cache() no libera los pesos de un modelo en uso: sin esto, el
+        respaldo 'menor' se cargaría junto al modelo que ya se quedó sin
+        memoria. Se mueve en lugar de descartarlo porque el transcriptor
+        conserva una referencia al modelo principal.
+        """
+        for other, model in self._models.items():
+            if other != key and other[1] == key[1] and other not in self._offloaded:
+                logger.info(f"Moviendo el modelo {other[0]} a CPU para liberar {key[1]}")
+                model.to('cpu')
+                self._offloaded.add(other)
+                self._free_gpu()
+
+    @staticmethod
+    def _free_gpu():
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def transcribe(self, audio, decode_hook=None, **options):
+        """
+        Transcribe un audio, recorriendo los respaldos si falta memoria de GPU.
+
+        Args:
+            audio: Audio PCM 16 kHz (numpy float32)
+            decode_hook: Función opcional (modelo, decode) -> decode que
+                envuelve model.decode() durante la transcripción (ver
+                vocabulary.VocabularyPrompter)
+            **options: Opciones de model.transcribe()
+
+        Returns:
+            tuple: (resultado de Whisper, modelo usado, dispositivo usado)
+
+        Raises:
+            Exception: El último error si fallan todos los intentos; los
+                errores que no son de memoria se propagan de inmediato
+        """
+        for attempt, (model_name, device) in enumerate(self.attempts):
+            try:
+                model = self._model(model_name, device)
+                with wrapped_decode(model, decode_hook):
+                    result = model.transcribe(audio, **options)
+            except Exception as e:
+                if not is_oom_error(e) or attempt == len(self.attempts) - 1:
+                    raise
+                next_model, next_device = self.attempts[attempt + 1]
+                logger.warning(
+                    f"⚠️  Sin memoria de GPU con {model_name} en {device}; "
+                    f"reintentando con {next_model} en {next_device}"
+                )
+                self._free_gpu()
+                continue
+            if attempt:
+                self.fallbacks_used += 1
+            return result, model_name, device
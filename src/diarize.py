@@ -0,0 +1,193 @@
+"""
+Diarización de hablantes offline en CPU.
+Calcula MFCC vectorizados con numpy/scipy sobre el PCM decodificado, forma
+un embedding por segmento de Whisper y agrupa los segmentos por hablante con
+clustering jerárquico. No requiere GPU, red ni modelos adicionales.
+"""
+import logging
+
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.fft import dct
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000  # Whisper decodifica todo el audio a 16 kHz mono
+
+
+def _mel_filterbank(n_mels, n_fft, sample_rate, fmin=60.0, fmax=None):
+    """Construye un banco de filtros triangulares en escala mel."""
+    fmax = fmax or sample_rate / 2
+
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+    mel_points = np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mel_points) / sample_rate).astype(int)
+
+    filters = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            filters[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filters[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return filters
+
+
+def mfcc(audio, sample_rate=SAMPLE_RATE, n_mfcc=20, n_mels=40, frame_ms=25, hop_ms=10,
+         block_seconds=60):
+    """
+    Calcula MFCC de un audio completo de forma vectorizada.
+
+    El audio se procesa por bloques para acotar la memoria del espectrograma
+    en archivos de varias horas.
+
+    Args:
+        audio: np.ndarray float32 mono
+        sample_rate: Frecuencia de muestreo
+        n_mfcc: Coeficientes cepstrales a conservar
+        n_mels: Bandas mel
+        frame_ms: Largo de ventana en milisegundos
+        hop_ms: Salto entre ventanas en milisegundos
+        block_seconds: Tamaño del bloque de procesamiento
+
+    Returns:
+        np.ndarray: float32[n_frames, n_mfcc]
+    """
+    frame_len = int(sample_rate * frame_ms / 1000)
+    hop = int(sample_rate * hop_ms / 1000)
+    n_fft = 1 << (frame_len - 1).bit_length()
+    window = np.hamming(frame_len).astype(np.float32)
+    filters = _mel_filterbank(n_mels, n_fft, sample_rate)
+
+    if len(audio) < frame_len:
+        return np.zeros((0, n_mfcc), dtype=np.float32)
+
+    # Pre-énfasis
+    audio = np.append(audio[0], audio[1:] - 0.97 * audio[:-1]).astype(np.float32)
+
+    n_frames = 1 + (len(audio) - frame_len) // hop
+    frames_per_block = max(1, int(block_seconds * 1000 / hop_ms))
+    result = np.empty((n_frames, n_mfcc), dtype=np.float32)
+
+    for first in range(0, n_frames, frames_per_block):
+        last = min(first + frames_per_block, n_frames)
+        chunk = audio[first * hop:(last - 1) * hop + frame_len]
+        frames = np.lib.stride_tricks.sliding_window_view(chunk, frame_len)[::hop]
+        spectrum = np.abs(np.fft.rfft(frames * window, n=n_fft)) ** 2
+        mel = np.log(spectrum @ filters.T + 1e-10)
+        result[first:last] = dct(mel, type=2, axis=1, norm='ortho')[:, :n_mfcc]
+
+    return result
+
+
+class SpeakerDiarizer:
+    """Asigna una etiqueta de hablante a cada segmento de Whisper."""
+
+    def __init__(self, num_speakers=None, max_speakers=8, distance_threshold=0.35):
+        """
+        Inicializa el diarizador.
+
+        Args:
+            num_speakers: Número de hablantes conocido (None = detectar)
+            max_speakers: Máximo de hablantes a detectar automáticamente
+            distance_threshold: Distancia coseno para separar hablantes
+                cuando num_speakers no se indica
+        """
+        self.num_speakers = num_speakers
+        self.max_speakers = max_speakers
+        self.distance_threshold = distance_threshold
+
+    def _segment_embeddings(self, features, segments, hop_seconds):
+        """
+        Calcula media y desviación de los MFCC de cada segmento.
+
+        Usa sumas acumuladas para obtener todas las estadísticas en O(1)
+        por segmento.
+        """
+        n_frames = len(features)
+        cumsum = np.vstack([np.zeros((1, features.shape[1])), np.cumsum(features, axis=0, dtype=np.float64)])
+        cumsq = np.vstack([np.zeros((1, features.shape[1])), np.cumsum(features.astype(np.float64) ** 2, axis=0)])
+
+        starts = np.array([s.get('start', 0.0) for s in segments]) / hop_seconds
+        ends = np.array([s.get('end', 0.0) for s in segments]) / hop_seconds
+        lo = np.clip(starts.astype(int), 0, max(n_frames - 1, 0))
+        hi = np.clip(np.maximum(ends.astype(int), lo + 1), 1, n_frames)
+        counts = (hi - lo)[:, None]
+
+        mean = (cumsum[hi] - cumsum[lo]) / counts
+        var = np.maximum((cumsq[hi] - cumsq[lo]) / counts - mean ** 2, 0.0)
+        embeddings = np.hstack([mean, np.sqrt(var)])
+
+        # Normalizar cada dimensión y cada embedding
+        embeddings -= embeddings.mean(axis=0)
+        embeddings /= embeddings.std(axis=0) + 1e-8
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+        return embeddings
+
+    def diarize(self, audio, segments, sample_rate=SAMPLE_RATE):
+        """
+        Etiqueta los segmentos con el hablante estimado.
+
+        Añade la clave 'speaker' ("HABLANTE 1", "HABLANTE 2", ...) a cada
+        segmento, numerando por orden de aparición.
+
+        Args:
+            audio: PCM decodificado (np.ndarray float32 mono)
+            segments: Lista de segmentos de Whisper (se modifica in situ)
+            sample_rate: Frecuencia de muestreo del audio
+
+        Returns:
+            int: Número de hablantes detectados
+        """
+        if not segments:
+            return 0
+        if len(segments) == 1:
+            segments[0]['speaker'] = "HABLANTE 1"
+            return 1
+
+        hop_ms = 10
+        features = mfcc(audio, sample_rate=sample_rate, hop_ms=hop_ms)
+        if len(features) == 0:
+            return 0
+
+        # Normalización cepstral por archivo (CMVN)
+        features = (features - features.mean(axis=0)) / (features.std(axis=0) + 1e-8)
+        embeddings = self._segment_embeddings(features, segments, hop_ms / 1000)
+
+        # Segmentos sin información (silencio o audio constante): embedding
+        # nulo, con distancia coseno indefinida
+        valid = np.isfinite(embeddings).all(axis=1) & (np.linalg.norm(embeddings, axis=1) > 1e-6)
+        if valid.sum() < 2:
+            labels = np.ones(len(segments), dtype=int)
+        else:
+            tree = linkage(embeddings[valid], method='average', metric='cosine')
+            if self.num_speakers:
+                clusters = fcluster(tree, t=self.num_speakers, criterion='maxclust')
+            else:
+                clusters = fcluster(tree, t=self.distance_threshold, criterion='distance')
+                if clusters.max() > self.max_speakers:
+                    clusters = fcluster(tree, t=self.max_speakers, criterion='maxclust')
+            # Los segmentos sin información toman el hablante del segmento
+            # válido anterior (o del primero, si están al inicio)
+            labels = np.zeros(len(segments), dtype=int)
+            labels[valid] = clusters
+            previous = clusters[0]
+            for index in range(len(labels)):
+                if labels[index]:
+                    previous = labels[index]
+                else:
+                    labels[index] = previous
+
+        # Renumerar por orden de aparición
+        order = {}
+        for segment, label in zip(segments, labels):
+            order.setdefault(label, len(order) + 1)
+            segment['speaker'] = f"HABLANTE {order[label]}"
+
+        logger.info(f"Diarización: {len(order)} hablante(s) en {len(segments)} segmentos")
+        return len(order)
@@ -0,0 +1,366 @@
+"""
+Evaluación de modelos de Whisper sobre los audios propios.
+
+Toma una muestra de N audios de input/ (los primeros `segundos` de cada
+uno) y los transcribe con cada combinación de modelo y dispositivo, con la
+misma configuración que AudioTranscriber (idioma, variante regional, sin
+fp16). Cada combinación corre en un proceso aparte, así la memoria pico
+medida es solo la suya. Por combinación se informa:
+
+- RTF: segundos de cómputo por segundo de audio (< 1 es más rápido que
+  tiempo real) y horas de audio por hora de cómputo
+- memoria pico del proceso (RSS) y, en GPU, VRAM pico
+- WER contra el modelo de referencia (por defecto large): palabras
+  sustituidas, omitidas o agregadas sobre el total de la referencia
+
+La tabla comparativa queda en output/evaluacion_modelos.md (y los datos en
+output/.evaluacion_modelos.json), con el modelo más rápido cuyo WER no
+supera EVAL_MAX_WER.
+
+Uso:
+    python src/evaluate.py [--modelos tiny,base,small,medium] [--referencia large]
+                           [--dispositivos cpu,cuda] [--muestras 5] [--segundos 120]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from artifacts import atomic_write, write_artifact
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+REPORT_NAME = "evaluacion_modelos.md"
+DATA_NAME = ".evaluacion_modelos.json"
+
+_WORD = re.compile(r"\w+")
+
+
+def _words(text):
+    """Palabras en minúsculas, sin puntuación (Whisper puntúa distinto según el modelo)."""
+    return _WORD.findall(text.lower())
+
+
+def word_errors(reference, hypothesis):
+    """
+    Distancia de edición en palabras entre dos textos.
+
+    Programación dinámica vectorizada por filas: sustituciones y borrados
+    se calculan con operaciones sobre toda la fila, y las inserciones (que
+    dependen de la celda de la izquierda) con un mínimo acumulado.
+
+    Returns:
+        tuple: (errores, palabras de la referencia)
+    """
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref or not hyp:
+        return max(len(ref), len(hyp)), len(ref)
+    ids = {word: index for index, word in enumerate(set(ref) | set(hyp))}
+    rows = np.array([ids[word] for word in ref])
+    columns = np.array([ids[word] for word in hyp])
+    # La distancia es simétrica: se recorre la secuencia más corta
+    if len(rows) > len(columns):
+        rows, columns = columns, rows
+    offsets = np.arange(len(columns) + 1)
+    row = offsets.copy()
+    step = np.empty_like(row)
+    for token in rows:
+        step[0] = row[0] + 1
+        np.minimum(row[1:] + 1, row[:-1] + (columns != token), out=step[1:])
+        # row[j] = min(step[j], row[j-1] + 1) = j + min_{k<=j}(step[k] - k)
+        row = np.minimum.accumulate(step - offsets) + offsets
+    return int(row[-1]), len(ref)
+
+
+def sample_files(input_dir, count, seed=0):
+    """
+    N audios de input_dir elegidos al azar (siempre los mismos para la misma semilla).
+
+    Returns:
+        list: Rutas, ordenadas por nombre
+    """
+    from transcribe import AUDIO_EXTENSIONS
+
+    files = sorted(f for f in Path(input_dir).iterdir()
+                   if f.is_file() and f.suffix.lower() in AUDIO_EXTENSIONS)
+    if count and len(files) > count:
+        files = sorted(random.Random(seed).sample(files, count))
+    return files
+
+
+def measure(model_name, device, audio_files, seconds, language, dialect):
+    """
+    Transcribe los audios con un modelo y mide tiempos y memoria (en este proceso).
+
+    Returns:
+        dict: 'modelo', 'dispositivo', 'carga_s', 'archivos' (nombre,
+            segundos_audio, segundos, texto), 'memoria_mb' y 'vram_mb'
+    """
+    import torch
+    import whisper
+
+    from device_scheduler import load_whisper_model
+    from transcribe import AudioTranscriber
+
+    prompt = AudioTranscriber.DIALECT_PROMPTS.get(dialect, AudioTranscriber.DIALECT_PROMPTS['es'])
+    if device == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+
+    start = time.perf_counter()
+    model = load_whisper_model(model_name, device)
+    load_seconds = time.perf_counter() - start
+
+    files = []
+    for path in audio_files:
+        audio = whisper.load_audio(str(path))
+        if seconds:
+            audio = audio[:int(seconds * SAMPLE_RATE)]
+        start = time.perf_counter()
+        result = model.transcribe(
+            audio,
+            language=language,
+            fp16=False,
+            verbose=None,
+            initial_prompt=prompt
+        )
+        files.append({
+            'nombre': Path(path).name,
+            'segundos_audio': len(audio) / SAMPLE_RATE,
+            'segundos': time.perf_counter() - start,
+            'texto': result['text'],
+        })
+        logger.info(f"  {Path(path).name}: {files[-1]['segundos']:.1f}s")
+
+    return {
+        'modelo': model_name,
+        'dispositivo': device,
+        'carga_s': load_seconds,
+        'archivos': files,
+        # ru_maxrss está en KB en Linux
+        'memoria_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'vram_mb': torch.cuda.max_memory_allocated() / 2**20 if device == 'cuda' else None,
+    }
+
+
+def run_measurement(model_name, device, audio_files, seconds, language, dialect):
+    """
+    Ejecuta measure() en un proceso aparte.
+
+    Returns:
+        dict: Resultado de measure(), o {'error': ...} si el proceso falla
+            (p. ej. sin memoria para el modelo)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        result_path = Path(tmp) / "resultado.json"
+        command = [
+            sys.executable, str(Path(__file__).resolve()), 'medir', model_name, device,
+            '--resultado', str(result_path), '--segundos', str(seconds),
+            '--idioma', language, '--variante', dialect,
+            *[str(path) for path in audio_files]
+        ]
+        env = dict(os.environ, LOG_NAME=f"evaluacion-{model_name}-{device}", STATUS_FILE='none')
+        completed = subprocess.run(command, env=env)
+        if completed.returncode != 0 or not result_path.exists():
+            return {'modelo': model_name, 'dispositivo': device,
+                    'error': f"el proceso terminó con código {completed.returncode}"}
+        return json.loads(result_path.read_text(encoding='utf-8'))
+
+
+def summarize(run, reference=None):
+    """
+    Métricas de una combinación (RTF, memoria y WER contra la referencia).
+
+    Args:
+        run: Resultado de measure()
+        reference: Resultado de measure() del modelo de referencia
+    """
+    if 'error' in run:
+        return {'modelo': run['modelo'], 'dispositivo': run['dispositivo'], 'error': run['error']}
+    audio_seconds = sum(item['segundos_audio'] for item in run['archivos'])
+    compute_seconds = sum(item['segundos'] for item in run['archivos'])
+    rtf = compute_seconds / audio_seconds if audio_seconds else None
+    row = {
+        'modelo': run['modelo'],
+        'dispositivo': run['dispositivo'],
+        'rtf': rtf,
+        'horas_por_hora': 1 / rtf if rtf else None,
+        'carga_s': run['carga_s'],
+        'memoria_mb': run['memoria_mb'],
+        'vram_mb': run['vram_mb'],
+        'wer': None,
+    }
+    if reference and 'error' not in reference:
+        texts = {item['nombre']: item['texto'] for item in reference['archivos']}
+        errors = words = 0
+        for item in run['archivos']:
+            if item['nombre'] in texts:
+                file_errors, file_words = word_errors(texts[item['nombre']], item['texto'])
+                errors += file_errors
+                words += file_words
+        row['wer'] = errors / words if words else None
+    return row
+
+
+def recommend(rows, max_wer):
+    """Combinación más rápida con WER <= max_wer (None si ninguna cumple)."""
+    candidates = [row for row in rows if row.get('rtf') and row.get('wer') is not None and row['wer'] <= max_wer]
+    return min(candidates, key=lambda row: row['rtf']) if candidates else None
+
+
+def _cell(value, pattern):
+    return pattern.format(value) if value is not None else "-"
+
+
+def format_table(rows, reference_name, audio_files, seconds, max_wer):
+    """Tabla comparativa en Markdown."""
+    lines = [
+        "# Evaluación de modelos de Whisper",
+        "",
+        f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  ",
+        f"Audios: {len(audio_files)} ({', '.join(path.name for path in audio_files)})"
+        + (f", primeros {seconds:g} s de cada uno" if seconds else "") + "  ",
+        f"Referencia para el WER: {reference_name}",
+        "",
+        "| Modelo | Dispositivo | RTF | h de audio por h | Carga (s) | Memoria pico (MB) | VRAM pico (MB) | WER |",
+        "|--------|-------------|-----|------------------|-----------|-------------------|----------------|-----|",
+    ]
+    for row in rows:
+        if 'error' in row:
+            lines.append(f"| {row['modelo']} | {row['dispositivo']} | error: {row['error']} | | | | | |")
+            continue
+        lines.append(
+            f"| {row['modelo']} | {row['dispositivo']} | {_cell(row['rtf'], '{:.2f}')} "
+            f"| {_cell(row['horas_por_hora'], '{:.1f}')} | {_cell(row['carga_s'], '{:.1f}')} "
+            f"| {_cell(row['memoria_mb'], '{:.0f}')} | {_cell(row['vram_mb'], '{:.0f}')} "
+            f"| {_cell(row['wer'], '{:.1%}')} |"
+        )
+    best = recommend(rows, max_wer)
+    lines.append("")
+    if best:
+        lines.append(f"**Recomendado:** `WHISPER_MODEL={best['modelo']}` en {best['dispositivo']} "
+                     f"(el más rápido con WER ≤ {max_wer:.0%}).")
+    else:
+        lines.append(f"Ningún modelo alcanza un WER ≤ {max_wer:.0%} contra la referencia.")
+    return "\n".join(lines) + "\n"
+
+
+def _default_devices():
+    try:
+        import torch
+
+        if torch.cuda.is_available() and os.environ.get('USE_GPU', 'auto').lower() not in ('false', 'no', 'cpu'):
+            return ['cpu', 'cuda']
+    except ImportError:
+        pass
+    return ['cpu']
+
+
+def evaluate(input_dir, output_dir, models, devices, reference_name, count, seconds,
+             language='es', dialect='es', max_wer=0.1):
+    """
+    Evalúa los modelos y escribe la tabla comparativa.
+
+    Returns:
+        list: Filas de métricas (ver summarize)
+    """
+    audio_files = sample_files(input_dir, count)
+    if not audio_files:
+        logger.error(f"No hay audios en {input_dir} para evaluar")
+        return []
+    logger.info(f"📊 Evaluando {len(models)} modelo(s) en {', '.join(devices)} con {len(audio_files)} audio(s)")
+
+    runs = {}
+    # La referencia en el dispositivo más rápido disponible
+    reference_key = (reference_name, devices[-1])
+    for model_name, device in [reference_key] + [(m, d) for m in models for d in devices]:
+        if (model_name, device) in runs:
+            continue
+        logger.info(f"⏳ {model_name} en {device}...")
+        runs[(model_name, device)] = run_measurement(model_name, device, audio_files, seconds, language, dialect)
+        if 'error' in runs[(model_name, device)]:
+            logger.warning(f"⚠️  {model_name} en {device}: {runs[(model_name, device)]['error']}")
+
+    reference = runs[reference_key]
+    if 'error' in reference:
+        logger.warning("⚠️  Falló el modelo de referencia: la tabla no incluye el WER")
+    rows = [summarize(run, reference) for key, run in runs.items()
+            if key != reference_key or reference_name in models]
+
+    output_dir = Path(output_dir)
+    table = format_table(rows, f"{reference_name} ({reference_key[1]})", audio_files, seconds, max_wer)
+    write_artifact(output_dir / REPORT_NAME, table)
+    atomic_write(output_dir / DATA_NAME, json.dumps(
+        {'filas': rows, 'ejecuciones': list(runs.values())}, ensure_ascii=False, indent=2
+    ))
+    print(table)
+    logger.info(f"✓ Tabla comparativa guardada en: {output_dir / REPORT_NAME}")
+    return rows
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main():
+    """Función principal (CLI)."""
+    parser = argparse.ArgumentParser(description="Evaluación de modelos de Whisper sobre los audios propios")
+    subparsers = parser.add_subparsers(dest='comando')
+
+    medir = subparsers.add_parser('medir', help="Uso interno: mide un modelo en un proceso aparte")
+    medir.add_argument('modelo')
+    medir.add_argument('dispositivo')
+    medir.add_argument('audios', nargs='+')
+    medir.add_argument('--resultado', required=True)
+    medir.add_argument('--segundos', type=float, default=0)
+    medir.add_argument('--idioma', default='es')
+    medir.add_argument('--variante', default='es')
+
+    parser.add_argument('--modelos', default=os.environ.get('EVAL_MODELS', 'tiny,base,small,medium'))
+    parser.add_argument('--referencia', default=os.environ.get('EVAL_REFERENCE', 'large'))
+    parser.add_argument('--dispositivos', default=os.environ.get('EVAL_DEVICES', ''),
+                        help="Por defecto cpu, y cuda si hay GPU")
+    parser.add_argument('--muestras', type=int, default=int(os.environ.get('EVAL_SAMPLES', '5')))
+    parser.add_argument('--segundos', type=float, default=float(os.environ.get('EVAL_SECONDS', '120')),
+                        help="Segundos de cada audio (0 = completo)")
+    parser.add_argument('--directorio', default=os.environ.get('INPUT_DIR', '/app/input'))
+    parser.add_argument('--salida', default=os.environ.get('OUTPUT_DIR', '/app/output'))
+
+    args = parser.parse_args()
+
+    if args.comando == 'medir':
+        setup_logging(os.environ.get('LOG_NAME', 'evaluacion'))
+        result = measure(args.modelo, args.dispositivo, args.audios, args.segundos, args.idioma, args.variante)
+        Path(args.resultado).write_text(json.dumps(result, ensure_ascii=False), encoding='utf-8')
+        return 0
+
+    setup_logging('evaluacion')
+    rows = evaluate(
+        args.directorio,
+        args.salida,
+        models=_split(args.modelos),
+        devices=_split(args.dispositivos) or _default_devices(),
+        reference_name=args.referencia,
+        count=args.muestras,
+        seconds=args.segundos,
+        language=os.environ.get('AUDIO_LANGUAGE', 'es'),
+        dialect=os.environ.get('AUDIO_DIALECT', 'es'),
+        max_wer=float(os.environ.get('EVAL_MAX_WER', '0.1'))
+    )
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
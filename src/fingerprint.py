@@ -0,0 +1,510 @@
+"""
+Detección de audios duplicados por huella acústica, antes de transcribir.
+
+Un mismo audio exportado dos veces (p. ej. .m4a y .mp3, o con otra tasa
+de bits) tiene bytes distintos pero el mismo contenido espectral. Cada
+audio pendiente se decodifica a PCM mono de 8 kHz y se reduce a una huella
+compacta: por cada trama de 256 ms (cada 64 ms) 32 bits con el signo de la
+variación de energía entre bandas vecinas (300-2000 Hz) respecto de la
+trama anterior, que sobrevive a la recompresión. Un resumen de la huella
+(2048 bits sobre 64 tramos del audio) se divide en bandas de bits para un
+índice LSH en SQLite (output/.huellas.sqlite): solo los audios que
+comparten alguna banda se comparan completos, por la fracción de bits
+distintos.
+
+Un duplicado no pasa por Whisper: cuando su original está transcrito, sus
+archivos de salida (transcripción, segmentos, subtítulos y, si ya existen,
+texto formateado y análisis) se copian con el nombre del duplicado.
+
+Uso como CLI:
+    python src/fingerprint.py duplicados [directorio_entrada]
+    python src/fingerprint.py comparar audio1.m4a audio2.mp3
+"""
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from archive import ArtifactArchive, archive_containing
+from artifacts import is_complete, write_artifact
+from log_setup import setup_logging
+from output_layout import FORMATTED_SUFFIX, TRANSCRIPT_SUFFIX, create_layout_from_env
+from words import words_dir_for
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = ".huellas.sqlite"
+SAMPLE_RATE = 8000
+FRAME = 2048  # 256 ms
+HOP = 512     # 64 ms
+BANDS = 33    # 32 bits por trama
+LOW_HZ, HIGH_HZ = 300.0, 2000.0
+# Resumen para el índice LSH: 64 tramos x 32 bits
+SUMMARY_SLICES = 64
+SUMMARY_BITS = SUMMARY_SLICES * (BANDS - 1)
+LSH_BANDS = 24
+LSH_BITS = 16
+# Desfase máximo (tramas) entre dos versiones, p. ej. por el relleno inicial del códec
+MAX_SHIFT = 4
+BLOCK_SECONDS = 60
+# Archivos que se copian de un original a su duplicado, en este orden: la
+# transcripción va después de los archivos de Whisper (su marca indica el
+# audio completo) y antes del formateo y los análisis (que deben ser más
+# recientes que ella para no regenerarse)
+REUSED_SUFFIXES = (
+    "_transcripcion_detallada.txt",
+    "_segmentos.jsonl",
+    "_transcripcion.srt",
+    "_transcripcion.vtt",
+    TRANSCRIPT_SUFFIX,
+    FORMATTED_SUFFIX,
+    "_resumen.txt",
+    "_puntos_clave.txt",
+    "_temas.txt",
+)
+
+
+def _band_matrix():
+    """Matriz (bins de la FFT x bandas) que suma la potencia de cada banda logarítmica."""
+    freqs = np.fft.rfftfreq(FRAME, 1.0 / SAMPLE_RATE)
+    band = np.digitize(freqs, np.geomspace(LOW_HZ, HIGH_HZ, BANDS + 1)) - 1
+    valid = (band >= 0) & (band < BANDS)
+    matrix = np.zeros((len(freqs), BANDS), dtype=np.float32)
+    matrix[np.flatnonzero(valid), band[valid]] = 1.0
+    return matrix
+
+
+_BANDS = _band_matrix()
+_WINDOW = np.hanning(FRAME).astype(np.float32)
+# Posiciones de bits de cada banda LSH (fijas: las claves deben coincidir entre ejecuciones)
+_LSH_POSITIONS = np.random.default_rng(48).permutation(SUMMARY_BITS)[:LSH_BANDS * LSH_BITS].reshape(
+    LSH_BANDS, LSH_BITS)
+_LSH_WEIGHTS = np.left_shift(np.int64(1), np.arange(LSH_BITS, dtype=np.int64))
+
+
+def _pcm_blocks(path):
+    """
+    PCM mono de 8 kHz (float32) de un audio, en bloques de BLOCK_SECONDS.
+
+    Usa FFmpeg; sin FFmpeg solo se leen archivos WAV de 16 bits.
+
+    Raises:
+        RuntimeError: Si el audio no se puede decodificar
+    """
+    path = Path(path)
+    if shutil.which('ffmpeg'):
+        process = subprocess.Popen(
+            ['ffmpeg', '-nostdin', '-v', 'error', '-i', str(path),
+             '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        block_bytes = SAMPLE_RATE * BLOCK_SECONDS * 2
+        try:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                yield np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2').astype(np.float32) / 32768.0
+        finally:
+            process.stdout.close()
+            error = process.stderr.read().decode('utf-8', 'replace').strip()
+            if process.wait() != 0:
+                raise RuntimeError(error[:200] or f"ffmpeg terminó con código {process.returncode}")
+        return
+    if path.suffix.lower() != '.wav':
+        raise RuntimeError("ffmpeg no disponible")
+    with wave.open(str(path), 'rb') as audio:
+        if audio.getsampwidth() != 2:
+            raise RuntimeError("WAV que no es de 16 bits (se necesita ffmpeg)")
+        rate, channels = audio.getframerate(), audio.getnchannels()
+        while True:
+            raw = audio.readframes(rate * BLOCK_SECONDS)
+            if not raw:
+                break
+            samples = np.frombuffer(raw, dtype='<i2').reshape(-1, channels).mean(axis=1) / 32768.0
+            if rate != SAMPLE_RATE:
+                # Remuestreo lineal: basta para bandas de hasta 2 kHz
+                positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+                samples = np.interp(positions, np.arange(len(samples)), samples)
+            yield samples.astype(np.float32)
+
+
+def band_energies(blocks):
+    """
+    Log-energía por banda de cada trama.
+
+    Args:
+        blocks: Iterable de bloques de PCM (float32, 8 kHz)
+
+    Returns:
+        np.ndarray: (tramas, BANDS) float32
+    """
+    carry = np.zeros(0, dtype=np.float32)
+    energies = []
+    for block in blocks:
+        samples = np.concatenate([carry, block])
+        if len(samples) < FRAME:
+            carry = samples
+            continue
+        frames = sliding_window_view(samples, FRAME)[::HOP]
+        power = np.square(np.abs(np.fft.rfft(frames * _WINDOW, axis=1))).astype(np.float32)
+        energies.append(np.log(power @ _BANDS + 1e-10))
+        # La próxima trama empieza justo después de la última completa
+        carry = samples[len(frames) * HOP:]
+    if not energies:
+        return np.zeros((0, BANDS), dtype=np.float32)
+    return np.concatenate(energies)
+
+
+def _difference_bits(energies):
+    """Signo de la variación entre bandas vecinas respecto de la fila anterior: (filas-1, BANDS-1)."""
+    across = energies[:, :-1] - energies[:, 1:]
+    return (across[1:] - across[:-1]) > 0
+
+
+def compute_fingerprint(path):
+    """
+    Huella acústica de un audio.
+
+    Returns:
+        dict: 'huella' (uint32 por trama), 'resumen' (SUMMARY_BITS bits
+            empaquetados, o None si el audio es muy corto) y 'duracion'
+    """
+    energies = band_energies(_pcm_blocks(path))
+    frames = np.packbits(_difference_bits(energies), axis=1, bitorder='little').view('<u4').ravel()
+    summary = None
+    if len(energies) > SUMMARY_SLICES:
+        # Energía media de cada tramo: estable aunque cambie el códec
+        slices = np.stack([part.mean(axis=0) for part in np.array_split(energies, SUMMARY_SLICES + 1)])
+        summary = np.packbits(_difference_bits(slices).ravel())
+    return {
+        'huella': frames,
+        'resumen': summary,
+        'duracion': (len(energies) * HOP + FRAME) / SAMPLE_RATE if len(energies) else 0.0,
+    }
+
+
+def lsh_keys(summary):
+    """Clave de cada banda LSH de un resumen empaquetado."""
+    bits = np.unpackbits(summary).astype(np.int64)
+    return (bits[_LSH_POSITIONS] * _LSH_WEIGHTS).sum(axis=1)
+
+
+def distance(a, b, max_shift=MAX_SHIFT):
+    """
+    Fracción de bits distintos entre dos huellas, con el mejor desfase.
+
+    Returns:
+        float: 0.0 (idénticas) a ~0.5 (audios sin relación); 1.0 si no se
+            pueden comparar
+    """
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        x = a[max(shift, 0):]
+        y = b[max(-shift, 0):]
+        n = min(len(x), len(y))
+        if n == 0:
+            continue
+        errors = np.unpackbits(np.bitwise_xor(x[:n], y[:n]).view(np.uint8)).sum()
+        best = min(best, errors / (32.0 * n))
+    return best
+
+
+class AudioDeduplicator:
+    """Índice de huellas de los audios de entrada y registro de duplicados."""
+
+    def __init__(self, index_path, max_distance=0.3, workers=4):
+        """
+        Args:
+            index_path: Base SQLite con las huellas, el índice LSH y los duplicados
+            max_distance: Fracción máxima de bits distintos para considerar
+                dos audios iguales (los audios sin relación rondan 0.5)
+            workers: Audios decodificados en paralelo
+        """
+        self.index_path = Path(index_path)
+        self.max_distance = max_distance
+        self.workers = workers
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS huellas (nombre TEXT PRIMARY KEY, tamano INTEGER, "
+                "mtime REAL, duracion REAL, huella BLOB)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS bandas (banda INTEGER, clave INTEGER, nombre TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS bandas_clave ON bandas (banda, clave)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS duplicados (nombre TEXT PRIMARY KEY, original TEXT, "
+                "distancia REAL, fecha TEXT)"
+            )
+
+    @classmethod
+    def from_env(cls, output_dir):
+        """Crea el deduplicador desde DEDUPE_AUDIO y DEDUPE_MAX_DISTANCE (None si DEDUPE_AUDIO=false)."""
+        if os.environ.get('DEDUPE_AUDIO', 'true').lower() != 'true':
+            return None
+        return cls(
+            Path(output_dir) / INDEX_NAME,
+            max_distance=float(os.environ.get('DEDUPE_MAX_DISTANCE', '0.3'))
+        )
+
+    def _connect(self):
+        # Una conexión por operación: varios workers comparten el índice
+        return closing(sqlite3.connect(self.index_path, timeout=30, isolation_level=None))
+
+    def _cached(self, path):
+        stat = path.stat()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM huellas WHERE nombre = ? AND tamano = ? AND mtime = ?",
+                (path.name, stat.st_size, stat.st_mtime)
+            ).fetchone()
+        return row is not None
+
+    def add(self, path):
+        """
+        Calcula la huella de un audio y la registra en el índice (si cambió).
+
+        Returns:
+            bool: True si el audio tiene huella en el índice
+        """
+        path = Path(path)
+        if self._cached(path):
+            return True
+        stat = path.stat()
+        try:
+            result = compute_fingerprint(path)
+        except Exception as e:
+            logger.warning(f"⚠️  No se pudo calcular la huella de {path.name}: {e}")
+            return False
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM bandas WHERE nombre = ?", (path.name,))
+            conn.execute(
+                "INSERT OR REPLACE INTO huellas (nombre, tamano, mtime, duracion, huella) VALUES (?, ?, ?, ?, ?)",
+                (path.name, stat.st_size, stat.st_mtime, result['duracion'], result['huella'].tobytes())
+            )
+            if result['resumen'] is not None:
+                conn.executemany(
+                    "INSERT INTO bandas (banda, clave, nombre) VALUES (?, ?, ?)",
+                    [(band, int(key), path.name) for band, key in enumerate(lsh_keys(result['resumen']))]
+                )
+            conn.execute("COMMIT")
+        return True
+
+    def _load(self, conn, name):
+        row = conn.execute("SELECT duracion, huella FROM huellas WHERE nombre = ?", (name,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], np.frombuffer(row[1], dtype='<u4')
+
+    def find_original(self, name, eligible):
+        """
+        Busca un audio ya indexado con el mismo contenido.
+
+        Args:
+            name: Nombre del audio
+            eligible: Función que indica si un candidato puede ser el original
+
+        Returns:
+            tuple: (nombre del original, distancia) o (None, None)
+        """
+        with self._connect() as conn:
+            candidates = [row[0] for row in conn.execute(
+                "SELECT DISTINCT b.nombre FROM bandas a JOIN bandas b "
+                "ON a.banda = b.banda AND a.clave = b.clave "
+                "WHERE a.nombre = ? AND b.nombre != ? ORDER BY b.nombre",
+                (name, name)
+            )]
+            candidates = [candidate for candidate in candidates if eligible(candidate)]
+            if not candidates:
+                return None, None
+            duration, fingerprint = self._load(conn, name)
+            best = (None, None)
+            for candidate in candidates:
+                other_duration, other = self._load(conn, candidate)
+                # Las versiones de un mismo audio duran lo mismo (salvo el relleno del códec)
+                if abs(other_duration - duration) > max(2.0, 0.01 * duration):
+                    continue
+                value = distance(fingerprint, other)
+                if value <= self.max_distance and (best[1] is None or value < best[1]):
+                    best = (candidate, value)
+        return best
+
+    def run(self, audio_files, is_done):
+        """
+        Separa los duplicados de una lista de audios pendientes.
+
+        Cada audio se compara con los ya transcritos y con los anteriores de
+        la lista que se van a transcribir; el primero de cada grupo se
+        transcribe y los demás reutilizan su salida.
+
+        Args:
+            audio_files: Audios pendientes, en orden de procesamiento
+            is_done: Función que indica si un audio (nombre) ya está transcrito
+
+        Returns:
+            list: Audios a transcribir (sin los duplicados), en el mismo orden
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            indexed = list(executor.map(self.add, audio_files))
+
+        kept = []
+        kept_names = set()
+        duplicates = 0
+        copies = {}
+        for name, original, _ in self.duplicates():
+            copies.setdefault(original, set()).add(name)
+        for path, has_fingerprint in zip(audio_files, indexed):
+            original = None
+            if has_fingerprint:
+                # Una copia de este mismo audio no puede ser su original
+                own_copies = copies.get(path.name, set())
+                original, value = self.find_original(
+                    path.name, lambda name: name not in own_copies and (name in kept_names or is_done(name))
+                )
+            if original is None:
+                kept.append(path)
+                kept_names.add(path.name)
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM duplicados WHERE nombre = ?", (path.name,))
+                continue
+            duplicates += 1
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO duplicados (nombre, original, distancia, fecha) VALUES (?, ?, ?, ?)",
+                    (path.name, original, round(float(value), 4), datetime.now().isoformat(timespec='seconds'))
+                )
+            logger.info(f"♻️  {path.name} es el mismo audio que {original} (distancia {value:.3f}); "
+                        f"se reutiliza su transcripción")
+        if duplicates:
+            logger.info(f"✓ Huellas acústicas: {duplicates} duplicado(s) no se transcribirán")
+        return kept
+
+    def duplicates(self):
+        """Pares (duplicado, original, distancia) registrados."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT nombre, original, distancia FROM duplicados ORDER BY original, nombre"
+            ).fetchall()
+
+    def reuse(self, layout):
+        """
+        Copia la salida de cada original transcrito a sus duplicados.
+
+        Solo se copian los archivos que el duplicado aún no tiene; se puede
+        llamar después de cada etapa para llevar también el formateo y los
+        análisis.
+
+        Returns:
+            int: Archivos copiados
+        """
+        copied = 0
+        for name, original, _ in self.duplicates():
+            source_base, target_base = Path(original).stem, Path(name).stem
+            if source_base == target_base or not is_complete(layout.path(source_base, TRANSCRIPT_SUFFIX)):
+                continue
+            layout.register(target_base)
+            for suffix in REUSED_SUFFIXES:
+                if suffix == TRANSCRIPT_SUFFIX:
+                    copied += _copy_words(layout, source_base, target_base)
+                target = layout.path(target_base, suffix)
+                if is_complete(target) or archive_containing(target):
+                    continue
+                data = _read_output(layout.path(source_base, suffix))
+                if data is not None:
+                    write_artifact(target, data)
+                    copied += 1
+        if copied:
+            logger.info(f"✓ {copied} archivo(s) de salida copiados a audios duplicados")
+        return copied
+
+
+def _read_output(path):
+    """Bytes de un archivo de salida, sin comprimir o desde el archivo comprimido (None si no existe)."""
+    if is_complete(path):
+        return path.read_bytes()
+    archive_path = archive_containing(path)
+    if archive_path:
+        with ArtifactArchive(archive_path) as archive:
+            return archive.read_member(path.name)
+    return None
+
+
+def _copy_words(layout, source_base, target_base):
+    """Copia la tabla de timestamps por palabra, si existe."""
+    source = words_dir_for(layout.audio_dir(source_base), source_base)
+    target = words_dir_for(layout.audio_dir(target_base), target_base)
+    if not source.is_dir():
+        return 0
+    copied = 0
+    for path in sorted(source.iterdir()):
+        if path.name.startswith('.') or not is_complete(path) or is_complete(target / path.name):
+            continue
+        write_artifact(target / path.name, path.read_bytes())
+        copied += 1
+    return copied
+
+
+def reuse_duplicates_from_env(output_dir):
+    """Copia la salida de los originales a sus duplicados (sin efecto con DEDUPE_AUDIO=false)."""
+    deduplicator = AudioDeduplicator.from_env(output_dir)
+    if deduplicator is None:
+        return 0
+    return deduplicator.reuse(create_layout_from_env(output_dir))
+
+
+def main():
+    """Función principal (CLI)."""
+    setup_logging('fingerprint')
+
+    parser = argparse.ArgumentParser(description="Huellas acústicas y audios duplicados")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    duplicados = subparsers.add_parser('duplicados', help="Lista los grupos de audios iguales de una carpeta")
+    duplicados.add_argument('directorio', nargs='?', default=os.environ.get('INPUT_DIR', '/app/input'))
+
+    comparar = subparsers.add_parser('comparar', help="Distancia entre las huellas de dos audios")
+    comparar.add_argument('audio1')
+    comparar.add_argument('audio2')
+
+    args = parser.parse_args()
+
+    if args.comando == 'comparar':
+        a, b = compute_fingerprint(args.audio1), compute_fingerprint(args.audio2)
+        print(f"Duración: {a['duracion']:.1f}s / {b['duracion']:.1f}s")
+        print(f"Distancia: {distance(a['huella'], b['huella']):.3f} (iguales por debajo de "
+              f"{float(os.environ.get('DEDUPE_MAX_DISTANCE', '0.3')):.2f})")
+        return 0
+
+    from transcribe import AUDIO_EXTENSIONS
+
+    output_dir = Path(os.environ.get('OUTPUT_DIR', '/app/output'))
+    deduplicator = AudioDeduplicator(
+        output_dir / INDEX_NAME,
+        max_distance=float(os.environ.get('DEDUPE_MAX_DISTANCE', '0.3'))
+    )
+    audio_files = sorted(f for f in Path(args.directorio).iterdir()
+                         if f.is_file() and f.suffix.lower() in AUDIO_EXTENSIONS)
+    deduplicator.run(audio_files, is_done=lambda name: False)
+    names = {path.name for path in audio_files}
+    pairs = [pair for pair in deduplicator.duplicates() if pair[0] in names]
+    for name, original, value in pairs:
+        print(f"{name} = {original} (distancia {value:.3f})")
+    if not pairs:
+        print("No hay audios duplicados.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,38 +1,76 @@
 """
 Script para formatear transcripciones usando Google Gemini API.
 Toma transcripciones crudas y las formatea para mejorar legibilidad.
+Motor 'gemini' de format_engine.
 """
+import asyncio
 import google.generativeai as genai
 import os
 import sys
 from pathlib import Path
 import logging
-from datetime import datetime
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/app/logs/formatting.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from format_engine import FormatterEngine, FormatterError
+from log_setup import setup_logging
+from ollama_client import run_sync
+
 logger = logging.getLogger(__name__)
 
 
-class TranscriptionFormatter:
-    def __init__(self, api_key, model_name='gemini-1.5-pro-latest'):
+# Prompt por defecto ({texto_crudo} se reemplaza por el fragmento)
+DEFAULT_PROMPT = """Por favor, toma la siguiente transcripción de audio y formatéala para mejorar significativamente su legibilidad. Realiza las siguientes acciones:
+1. Divide el texto en párrafos coherentes donde haya cambios de tema, de hablante (si es discernible) o pausas largas implícitas. Usa doble salto de línea entre párrafos.
+2. Corrige y añade la puntuación necesaria (comas, puntos, mayúsculas iniciales, signos de interrogación/exclamación donde corresponda).
+3. Asegúrate de que las frases estén bien estructuradas gramaticalmente.
+4. No añadas contenido, información o resúmenes que no estén en el texto original. Solo formatea el texto existente.
+5. Mantén el idioma original de la transcripción.
+6. Si el texto trae líneas 'HABLANTE N:', conserva la etiqueta e inicia un párrafo nuevo en cada turno.
+
+Aquí está la transcripción cruda:
+
+{texto_crudo}"""
+
+
+class TranscriptionFormatter(FormatterEngine):
+    """Formateador usando la API de Google Gemini (motor 'gemini')."""
+    
+    name = 'gemini'
+    # El contexto de Gemini admite fragmentos mucho más largos que Ollama
+    chunk_size = 100000
+    
+    def __init__(self, api_key, model_name='gemini-1.5-pro-latest', prompt_template=None):
         """
         Inicializa el formateador de transcripciones.
         
         Args:
             api_key: Clave API de Google Gemini
             model_name: Nombre del modelo de Gemini a usar
+            prompt_template: Prompt personalizado con {texto_crudo} (opcional)
         """
         self.api_key = api_key
         self.model_name = model_name
+        self.prompt_template = prompt_template or DEFAULT_PROMPT
         self.model = None
+    
+    @classmethod
+    def from_env(cls):
+        """Crea el formateador desde GOOGLE_API_KEY y GEMINI_MODEL."""
+        return cls(
+            api_key=os.environ.get('GOOGLE_API_KEY'),
+            model_name=os.environ.get('GEMINI_MODEL', 'gemini-1.5-pro-latest')
+        )
+    
+    @property
+    def description(self):
+        return self.model_name
+    
+    def prepare(self):
+        """Configura la API (requiere GOOGLE_API_KEY)."""
+        if not self.api_key:
+            logger.warning("No se proporcionó GOOGLE_API_KEY. Configúrala en el archivo .env")
+            logger.warning("Puedes obtener una clave API en: https://makersuite.google.com/app/apikey")
+            return False
+        return self.configure_api()
         
     def configure_api(self):
         """Configura la API de Google Gemini."""
@@ -48,175 +86,84 @@ class TranscriptionFormatter:
             logger.error(f"Error al configurar la API: {e}")
             return False
     
-    def format_text(self, raw_text, custom_prompt=None):
+    async def format_chunk_async(self, text, part=None, strict=False):
         """
-        Formatea un texto crudo usando Gemini.
+        Formatea un fragmento usando Gemini.
         
         Args:
-            raw_text: Texto crudo a formatear
-            custom_prompt: Prompt personalizado (opcional)
+            text: Texto crudo a formatear
+            part: Número de parte ('i/n'), o None si es la transcripción completa
+            strict: Exige conservar todas las palabras (tras una salida con deriva)
         
         Returns:
             str: Texto formateado
+        
+        Raises:
+            FormatterError: Si la API falla o no está configurada
         """
         if not self.model:
-            logger.error("Modelo no configurado. Llama a configure_api() primero.")
-            return None
-        
-        # Prompt por defecto
-        if not custom_prompt:
-            custom_prompt = """Por favor, toma la siguiente transcripción de audio y formatéala para mejorar significativamente su legibilidad. Realiza las siguientes acciones:
-1. Divide el texto en párrafos coherentes donde haya cambios de tema, de hablante (si es discernible) o pausas largas implícitas. Usa doble salto de línea entre párrafos.
-2. Corrige y añade la puntuación necesaria (comas, puntos, mayúsculas iniciales, signos de interrogación/exclamación donde corresponda).
-3. Asegúrate de que las frases estén bien estructuradas gramaticalmente.
-4. No añadas contenido, información o resúmenes que no estén en el texto original. Solo formatea el texto existente.
-5. Mantén el idioma original de la transcripción.
-
-Aquí está la transcripción cruda:
-
-{texto_crudo}"""
+            raise FormatterError("Modelo no configurado. Llama a configure_api() primero.")
         
-        # Preparar el prompt
-        prompt = custom_prompt.format(texto_crudo=raw_text)
+        prompt = self.prompt_template.format(texto_crudo=text)
+        if part:
+            prompt = f"(Parte {part} de una transcripción más larga)\n\n{prompt}"
+        if strict:
+            prompt = (
+                "IMPORTANTE: conserva TODAS las palabras del texto original, en el mismo orden. "
+                "No omitas, resumas ni agregues nada.\n\n" + prompt
+            )
         
-        logger.info(f"Enviando texto a Gemini para formateo ({len(raw_text)} caracteres)...")
+        logger.info(f"Enviando texto a Gemini para formateo ({len(text)} caracteres)...")
         
         try:
-            response = self.model.generate_content(prompt)
-            formatted_text = response.text
-            logger.info(f"Texto formateado recibido ({len(formatted_text)} caracteres)")
-            return formatted_text
+            # El SDK es síncrono: se ejecuta en un hilo para no bloquear el loop
+            response = await asyncio.to_thread(self.model.generate_content, prompt)
+            return response.text
         except Exception as e:
-            logger.error(f"Error al formatear el texto: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return None
+            raise FormatterError(str(e)) from e
     
-    def format_file(self, input_path, output_path=None):
+    async def format_text_async(self, raw_text, custom_prompt=None, *, checkpoint=None):
         """
-        Formatea un archivo de transcripción.
+        Formatea un texto crudo usando Gemini.
         
         Args:
-            input_path: Ruta al archivo de transcripción cruda
-            output_path: Ruta donde guardar el texto formateado (opcional)
+            raw_text: Texto crudo de la transcripción
+            custom_prompt: Prompt personalizado con {texto_crudo} para esta
+                llamada (None = self.prompt_template)
+            checkpoint: ChunkCheckpoint opcional (reintenta solo lo que falló)
         
         Returns:
-            bool: True si se formateó exitosamente
+            str: Texto formateado
         """
-        input_path = Path(input_path)
-        
-        # Verificar que el archivo existe
-        if not input_path.exists():
-            logger.error(f"El archivo no existe: {input_path}")
-            return False
-        
-        logger.info(f"Leyendo archivo: {input_path.name}")
-        
-        try:
-            # Leer el contenido del archivo
-            with open(input_path, 'r', encoding='utf-8') as f:
-                raw_text = f.read()
-            
-            if not raw_text.strip():
-                logger.warning(f"El archivo está vacío: {input_path}")
-                return False
-            
-            logger.info(f"Texto leído ({len(raw_text)} caracteres)")
-            
-            # Formatear el texto
-            formatted_text = self.format_text(raw_text)
-            
-            if not formatted_text:
-                logger.error("No se pudo formatear el texto")
-                return False
-            
-            # Determinar ruta de salida
-            if output_path:
-                output_path = Path(output_path)
-            else:
-                # Crear nombre de archivo de salida basado en el de entrada
-                output_path = Path("/app/output") / f"{input_path.stem}_formateado.txt"
-            
-            # Asegurar que el directorio de salida existe
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # Guardar el archivo formateado
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(f"Transcripción formateada de: {input_path.name}\n")
-                f.write(f"Fecha de formateo: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Modelo usado: {self.model_name}\n")
-                f.write("="*80 + "\n\n")
-                f.write(formatted_text)
-            
-            logger.info(f"Texto formateado guardado en: {output_path}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error al procesar el archivo: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return False
+        engine = self._overridden(prompt_template=custom_prompt)
+        return await FormatterEngine.format_text_async(engine, raw_text, checkpoint=checkpoint)
     
-    def process_directory(self, input_dir, output_dir=None):
-        """
-        Procesa todos los archivos de texto en un directorio.
-        
-        Args:
-            input_dir: Directorio con archivos de transcripción
-            output_dir: Directorio donde guardar los textos formateados
-        """
-        input_dir = Path(input_dir)
-        output_dir = Path(output_dir) if output_dir else Path("/app/output")
-        
-        # Buscar archivos de texto que parezcan transcripciones (sin "_formateado")
-        text_files = [f for f in input_dir.iterdir() 
-                     if f.is_file() and f.suffix == '.txt' and '_formateado' not in f.name]
-        
-        if not text_files:
-            logger.warning(f"No se encontraron archivos de texto para formatear en: {input_dir}")
-            return
-        
-        logger.info(f"Encontrados {len(text_files)} archivo(s) de texto para formatear")
-        
-        success_count = 0
-        for idx, text_file in enumerate(text_files, 1):
-            logger.info(f"\n{'='*80}")
-            logger.info(f"Procesando archivo {idx}/{len(text_files)}: {text_file.name}")
-            logger.info(f"{'='*80}\n")
-            
-            output_path = output_dir / f"{text_file.stem}_formateado.txt"
-            if self.format_file(text_file, output_path):
-                success_count += 1
-        
-        logger.info(f"\nArchivos formateados exitosamente: {success_count}/{len(text_files)}")
+    def format_text(self, raw_text, custom_prompt=None, *, checkpoint=None):
+        """Versión síncrona de format_text_async()."""
+        return run_sync(self.format_text_async(raw_text, custom_prompt, checkpoint=checkpoint))
 
 
 def main():
     """Función principal."""
+    setup_logging('formatting')
+    
     # Configuración desde variables de entorno
-    api_key = os.environ.get('GOOGLE_API_KEY')
-    model_name = os.environ.get('GEMINI_MODEL', 'gemini-1.5-pro-latest')
     input_dir = Path(os.environ.get('INPUT_DIR', '/app/output'))  # Por defecto busca en output
     output_dir = Path(os.environ.get('OUTPUT_DIR', '/app/output'))
     
+    # Crear formateador
+    formatter = TranscriptionFormatter.from_env()
+    
     logger.info("="*80)
     logger.info("SERVICIO DE FORMATEO DE TRANSCRIPCIONES CON GEMINI")
     logger.info("="*80)
-    logger.info(f"Modelo: {model_name}")
+    logger.info(f"Modelo: {formatter.model_name}")
     logger.info(f"Directorio de entrada: {input_dir}")
     logger.info(f"Directorio de salida: {output_dir}")
     logger.info("="*80 + "\n")
     
-    if not api_key:
-        logger.error("No se proporcionó GOOGLE_API_KEY. Configúrala en el archivo .env")
-        logger.error("Puedes obtener una clave API en: https://makersuite.google.com/app/apikey")
-        sys.exit(1)
-    
-    # Crear formateador
-    formatter = TranscriptionFormatter(api_key=api_key, model_name=model_name)
-    
     # Configurar API
-    if not formatter.configure_api():
+    if not formatter.prepare():
         logger.error("No se pudo configurar la API de Gemini. Terminando.")
         sys.exit(1)
     
@@ -0,0 +1,182 @@
+"""
+Detección de deriva en la salida del LLM.
+Alinea el texto formateado contra el fragmento original palabra por palabra
+(ignorando puntuación, mayúsculas y tildes) para medir qué parte del
+original se conservó (cobertura) y cuánto texto nuevo apareció (inserción).
+La alineación avanza en un solo recorrido y resincroniza con índices de
+posiciones, en tiempo casi lineal, para poder validar todos los chunks de
+transcripciones de varias horas.
+"""
+import logging
+import os
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r'\w+')
+
+
+def normalize_tokens(text):
+    """Palabras en minúsculas y sin tildes (se descarta la puntuación)."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return WORD.findall(text)
+
+
+def _positions(keys):
+    index = defaultdict(list)
+    for position, key in enumerate(keys):
+        index[key].append(position)
+    return index
+
+
+def _ngrams(tokens, size):
+    return zip(*(tokens[k:] for k in range(size)))
+
+
+def _next_position(positions, start, limit=None):
+    """Primera posición >= start (y < limit) de una lista ordenada (o None)."""
+    k = bisect_left(positions, start)
+    if k < len(positions) and (limit is None or positions[k] < limit):
+        return positions[k]
+    return None
+
+
+def align_tokens(source, output, window=50, lost_after=4):
+    """
+    Cuenta las palabras del original que aparecen, en orden, en la salida.
+
+    Recorre ambas secuencias a la vez; ante una diferencia busca la
+    próxima aparición del par de palabras actual en la otra secuencia
+    (dentro de `window` palabras) y salta por el lado más cercano,
+    tratándolo como omisión o inserción. Usar pares evita resincronizar
+    en falso con palabras frecuentes ('de', 'que'). Tras varias diferencias
+    seguidas (un bloque omitido o inventado más largo que la ventana)
+    resincroniza con la próxima secuencia de tres palabras común, a
+    cualquier distancia. Coste O((n + m) log n).
+
+    Args:
+        source: Palabras normalizadas del original
+        output: Palabras normalizadas de la salida
+        window: Máximo de palabras que se saltan al resincronizar por pares
+        lost_after: Diferencias seguidas antes de buscar anclas de 3 palabras
+
+    Returns:
+        int: Palabras alineadas
+    """
+    source_pairs = _positions(_ngrams(source, 2))
+    output_pairs = _positions(_ngrams(output, 2))
+    source_anchors = _positions(_ngrams(source, 3))
+    output_anchors = _positions(_ngrams(output, 3))
+    i = j = matched = lost = 0
+    n, m = len(source), len(output)
+
+    while i < n and j < m:
+        if source[i] == output[j]:
+            matched += 1
+            lost = 0
+            i += 1
+            j += 1
+            continue
+
+        if lost >= lost_after:
+            next_i = _next_position(source_anchors.get(tuple(output[j:j + 3]), ()), i)
+            next_j = _next_position(output_anchors.get(tuple(source[i:i + 3]), ()), j)
+        else:
+            next_i = _next_position(source_pairs.get(tuple(output[j:j + 2]), ()), i, i + window)
+            next_j = _next_position(output_pairs.get(tuple(source[i:i + 2]), ()), j, j + window)
+
+        if next_i is None and next_j is None:
+            # Sustitución (ej: corrección gramatical de una palabra)
+            lost += 1
+            i += 1
+            j += 1
+        elif next_j is None or (next_i is not None and next_i - i <= next_j - j):
+            i = next_i  # Palabras del original omitidas
+        else:
+            j = next_j  # Palabras nuevas en la salida
+    return matched
+
+
+def measure_drift(source_text, output_text):
+    """
+    Mide la deriva de una salida del LLM respecto del original.
+
+    Returns:
+        dict: 'cobertura' (fracción del original conservada) e 'insercion'
+            (fracción de la salida que no está en el original)
+    """
+    source = normalize_tokens(source_text)
+    output = normalize_tokens(output_text)
+    matched = align_tokens(source, output)
+    return {
+        'cobertura': matched / len(source) if source else 1.0,
+        'insercion': (len(output) - matched) / len(output) if output else 0.0,
+    }
+
+
+class DriftGuard:
+    """Valida cada chunk formateado y lleva la cuenta de reintentos y rechazos."""
+
+    def __init__(self, min_coverage=0.9, max_insertion=0.15):
+        """
+        Args:
+            min_coverage: Cobertura mínima del original aceptada
+            max_insertion: Fracción máxima de palabras nuevas aceptada
+        """
+        self.min_coverage = min_coverage
+        self.max_insertion = max_insertion
+        self.checked = 0
+        self.retried = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Crea el validador desde FORMAT_DRIFT_CHECK, FORMAT_MIN_COVERAGE y FORMAT_MAX_INSERTION."""
+        if os.environ.get('FORMAT_DRIFT_CHECK', 'true').lower() != 'true':
+            return None
+        return cls(
+            min_coverage=float(os.environ.get('FORMAT_MIN_COVERAGE', '0.9')),
+            max_insertion=float(os.environ.get('FORMAT_MAX_INSERTION', '0.15'))
+        )
+
+    def check(self, source_text, output_text):
+        """
+        Valida una salida del LLM.
+
+        Returns:
+            tuple: (aceptada, métricas de measure_drift)
+        """
+        drift = measure_drift(source_text, output_text)
+        with self._lock:
+            self.checked += 1
+        ok = drift['cobertura'] >= self.min_coverage and drift['insercion'] <= self.max_insertion
+        return ok, drift
+
+    def record_retry(self):
+        with self._lock:
+            self.retried += 1
+
+    def record_rejection(self):
+        with self._lock:
+            self.rejected += 1
+
+    def report(self):
+        """
+        Registra en el log los chunks reintentados y rechazados por deriva.
+
+        Returns:
+            dict: 'validados', 'reintentados', 'rechazados'
+        """
+        if self.checked:
+            logger.info(
+                f"📊 Validación de deriva: {self.checked} chunks validados, "
+                f"{self.retried} reintentados con prompt estricto, "
+                f"{self.rejected} conservados sin formatear"
+            )
+        return {'validados': self.checked, 'reintentados': self.retried, 'rechazados': self.rejected}
@@ -0,0 +1,564 @@
+"""
+Interfaz común de los motores de formateo y registro de motores.
+Cada motor (Ollama, Gemini, reglas locales) solo implementa cómo formatear
+un fragmento; el troceo en chunks, la caché de chunks ya formateados, la
+concurrencia, el modo worker y la escritura de la salida son compartidos.
+"""
+import asyncio
+import copy
+import importlib
+import logging
+from datetime import datetime
+from pathlib import Path
+
+from archive import archive_containing, segment_source
+from artifacts import adopt_existing, is_complete, write_artifact
+from format_drift import DriftGuard
+from format_quality import QualityGate
+from log_setup import file_context
+from ollama_client import ChunkCheckpoint, map_ordered, run_sync
+from output_layout import TRANSCRIPT_SUFFIX, create_layout_from_env
+from progress import StageProgress, StatusFile
+from segments import chunk_segments, has_speakers, segments_to_text
+
+logger = logging.getLogger(__name__)
+
+# Motores disponibles: nombre -> (módulo, clase). Se importan al usarse, así
+# un motor no exige las dependencias de los demás (ej: google-generativeai)
+ENGINES = {
+    'ollama': ('format_ollama', 'OllamaFormatter'),
+    'gemini': ('format', 'TranscriptionFormatter'),
+    'reglas': ('format_rules', 'RuleFormatter'),
+}
+
+
+class FormatterError(Exception):
+    """Error al formatear un fragmento (se conserva el texto original)."""
+
+
+def register_engine(name, module, class_name):
+    """Registra un motor de formateo adicional."""
+    ENGINES[name] = (module, class_name)
+
+
+def get_engine_class(name):
+    """
+    Devuelve la clase de un motor registrado.
+
+    Raises:
+        ValueError: Si el motor no está registrado
+    """
+    if name not in ENGINES:
+        raise ValueError(f"Formateador desconocido: {name} (disponibles: {', '.join(sorted(ENGINES))})")
+    module, class_name = ENGINES[name]
+    return getattr(importlib.import_module(module), class_name)
+
+
+def create_engine_from_env(name):
+    """Crea un motor configurado desde variables de entorno."""
+    engine = get_engine_class(name).from_env()
+    if engine.uses_llm:
+        engine.quality_gate = QualityGate.from_env()
+        engine.drift_guard = DriftGuard.from_env()
+    return engine
+
+
+def prepare_engine_from_env(name, fallback=None):
+    """
+    Crea y prepara el motor pedido; si no está disponible, usa el de respaldo.
+
+    Args:
+        name: Motor preferido (ej: 'ollama')
+        fallback: Motor a usar si el preferido no está disponible (None = ninguno)
+
+    Returns:
+        FormatterEngine: Motor listo para usar, o None
+    """
+    for candidate in dict.fromkeys(n for n in (name, fallback) if n):
+        try:
+            engine = create_engine_from_env(candidate)
+        except ValueError as e:
+            logger.warning(str(e))
+            continue
+        except ImportError as e:
+            logger.error(f"No se pudo cargar el formateador {candidate}: {e}")
+            continue
+        if engine.prepare():
+            if candidate != name:
+                logger.warning(f"⚠️  Formateador {name} no disponible, usando {candidate} como respaldo")
+            return engine
+        logger.error(f"El formateador {candidate} no está disponible.")
+    return None
+
+
+class FormatterEngine:
+    """
+    Base de los motores de formateo.
+
+    Las subclases definen `name`, `description` y format_chunk_async();
+    opcionalmente prepare(), warm_up_async(), release() y report().
+
+    Si el motor usa un LLM y tiene `quality_gate`, los fragmentos que ya
+    vienen bien puntuados de Whisper no se envían al LLM: se normalizan con
+    el formateador de reglas. Con `drift_guard`, cada salida del LLM se
+    valida contra el original antes de aceptarla.
+    """
+
+    name = None
+    chunk_size = 25000
+    concurrency = 1
+    # Si True, se formatea desde los segmentos de Whisper siempre que existan
+    prefers_segments = False
+    uses_llm = True
+    quality_gate = None
+    drift_guard = None
+    _normalizer = None
+
+    @classmethod
+    def from_env(cls):
+        """Crea el motor configurado desde variables de entorno."""
+        return cls()
+
+    @property
+    def description(self):
+        """Texto de 'Modelo usado' en la cabecera de la salida."""
+        return self.name
+
+    @property
+    def long_text_threshold(self):
+        """Tamaño a partir del cual el texto se procesa en chunks."""
+        return int(self.chunk_size * 1.2)
+
+    def prepare(self):
+        """Verifica que el motor esté disponible y listo (ej: API, modelo)."""
+        return True
+
+    async def warm_up_async(self):
+        """Preparación previa a un lote de archivos."""
+        return True
+
+    def release(self):
+        """Libera los recursos del motor al terminar el lote."""
+
+    def report(self):
+        """Registra las métricas acumuladas del lote."""
+        if self.quality_gate:
+            self.quality_gate.report()
+        if self.drift_guard:
+            self.drift_guard.report()
+
+    def _local_normalizer(self):
+        """Formateador de reglas usado para normalizar los fragmentos que saltan el LLM."""
+        if self._normalizer is None:
+            from format_rules import RuleFormatter
+            self._normalizer = RuleFormatter()
+        return self._normalizer
+
+    async def format_chunk_async(self, text, part=None, strict=False):
+        """
+        Formatea un fragmento de texto.
+
+        Args:
+            text: Texto crudo del fragmento
+            part: 'i/n' o 'i' si el texto es parte de una transcripción
+                larga, None si es la transcripción completa
+            strict: Reintento tras una salida con deriva: el motor debe
+                conservar todas las palabras del original
+
+        Returns:
+            str: Texto formateado
+
+        Raises:
+            FormatterError: Si el fragmento no se pudo formatear
+        """
+        raise NotImplementedError
+
+    async def format_segment_chunk_async(self, segments, part=None, strict=False):
+        """
+        Formatea un grupo de segmentos de Whisper.
+
+        Por defecto los convierte a texto (con los turnos de hablante);
+        los motores que aprovechan los tiempos lo sobrescriben.
+        """
+        return await self.format_chunk_async(segments_to_text(segments), part, strict)
+
+    async def _format_cached(self, key, part, formatter, checkpoint, normalize=None):
+        """
+        Formatea un chunk reutilizando/registrando el resultado en el checkpoint.
+
+        Args:
+            key: Texto crudo del chunk (clave de caché)
+            part: Número de parte o None
+            formatter: Función (strict) que devuelve la corrutina de formateo
+            checkpoint: ChunkCheckpoint opcional
+            normalize: Función de normalización local, usada en lugar del
+                motor si el filtro de calidad acepta el chunk
+        """
+        label = f"Chunk {part}" if part else "Texto"
+        if normalize and self.quality_gate and self.quality_gate.accepts(key):
+            logger.info(f"  ⏭️  {label} ya bien puntuado, normalizado sin LLM")
+            return normalize()
+
+        if checkpoint:
+            previous = checkpoint.get(key)
+            if previous is not None:
+                logger.info(f"  ⏭️  {label} ya formateado en una ejecución anterior")
+                return previous
+
+        logger.info(f"  Procesando {label.lower()} ({len(key)} chars)...")
+        try:
+            formatted = await self._validated(key, label, formatter)
+            logger.info(f"  ✓ {label} formateado ({len(formatted)} chars)")
+            if checkpoint:
+                checkpoint.record_success(key, formatted)
+            return formatted
+        except FormatterError as e:
+            logger.error(f"  Error al formatear {label.lower()}, usando texto original: {e}")
+            if checkpoint:
+                checkpoint.record_failure(key)
+            return key
+
+    async def _validated(self, key, label, formatter):
+        """
+        Ejecuta el motor y valida que no omita ni invente contenido.
+
+        Si la salida deriva del original, se reintenta una vez con el prompt
+        estricto; si vuelve a derivar, se conserva el texto original.
+        """
+        formatted = await formatter(False)
+        if not self.drift_guard:
+            return formatted
+
+        ok, drift = self.drift_guard.check(key, formatted)
+        if ok:
+            return formatted
+        logger.warning(
+            f"  ⚠️  {label}: salida con deriva (cobertura {drift['cobertura']:.0%}, "
+            f"inserción {drift['insercion']:.0%}), reintentando con prompt estricto"
+        )
+        self.drift_guard.record_retry()
+
+        formatted = await formatter(True)
+        ok, drift = self.drift_guard.check(key, formatted)
+        if ok:
+            return formatted
+        logger.warning(
+            f"  ⚠️  {label}: la salida sigue derivando (cobertura {drift['cobertura']:.0%}, "
+            f"inserción {drift['insercion']:.0%}), se conserva el texto original"
+        )
+        self.drift_guard.record_rejection()
+        return key
+
+    def _overridden(self, **attributes):
+        """
+        Copia del motor con algunos atributos reemplazados (los None se ignoran).
+
+        Para parámetros de una sola llamada (max_tokens, prompt): la copia
+        comparte cliente y métricas, y no altera las llamadas concurrentes.
+        """
+        attributes = {name: value for name, value in attributes.items() if value is not None}
+        if not attributes:
+            return self
+        engine = copy.copy(self)
+        engine.__dict__.update(attributes)
+        return engine
+
+    def _split_text(self, raw_text):
+        """Divide un texto en chunks de hasta chunk_size, cortando en un espacio."""
+        chunks = []
+        start = 0
+        while start < len(raw_text):
+            end = min(start + self.chunk_size, len(raw_text))
+            if end < len(raw_text):
+                cut = raw_text.rfind(' ', start + self.chunk_size // 2, end)
+                end = cut + 1 if cut > 0 else end
+            chunks.append(raw_text[start:end])
+            start = end
+        return chunks
+
+    async def format_text_async(self, raw_text, *, checkpoint=None):
+        """
+        Formatea un texto, dividiéndolo en chunks si es largo.
+
+        Args:
+            raw_text: Texto crudo a formatear
+            checkpoint: ChunkCheckpoint opcional (reintenta solo lo que falló)
+
+        Returns:
+            str: Texto formateado
+        """
+        if not raw_text.strip():
+            logger.warning("Texto vacío, saltando formateo")
+            return raw_text
+
+        if len(raw_text) <= self.long_text_threshold:
+            return await self._format_cached(
+                raw_text, None, lambda strict: self.format_chunk_async(raw_text, strict=strict), checkpoint,
+                normalize=lambda: self._local_normalizer().format_plain_text(raw_text)
+            )
+
+        chunks = self._split_text(raw_text)
+        logger.info(f"Texto muy largo ({len(raw_text)} chars), dividido en {len(chunks)} chunks")
+        formatted_chunks = await map_ordered(
+            lambda item: self._format_cached(
+                item[1], f"{item[0]}/{len(chunks)}",
+                lambda strict: self.format_chunk_async(item[1], f"{item[0]}/{len(chunks)}", strict),
+                checkpoint,
+                normalize=lambda: self._local_normalizer().format_plain_text(item[1])
+            ),
+            enumerate(chunks, 1),
+            self.concurrency
+        )
+        final_text = "\n\n".join(formatted_chunks)
+        logger.info(f"✓ Texto largo formateado: {len(final_text)} caracteres totales")
+        return final_text
+
+    def format_text(self, raw_text, *, checkpoint=None):
+        """Versión síncrona de format_text_async()."""
+        return run_sync(self.format_text_async(raw_text, checkpoint=checkpoint))
+
+    async def format_segments_async(self, segments, checkpoint=None):
+        """
+        Formatea una transcripción a partir de sus segmentos de Whisper.
+
+        Los segmentos se consumen de forma perezosa y se agrupan en chunks
+        que respetan los límites de segmento, sin cortar frases a la mitad.
+
+        Args:
+            segments: Iterable de segmentos (ej: iter_segments(ruta_jsonl))
+            checkpoint: ChunkCheckpoint opcional
+
+        Returns:
+            str: Texto formateado completo
+        """
+        async def format_group(item):
+            idx, group = item
+            # La clave de caché es el texto del grupo (igual para todos los motores)
+            return await self._format_cached(
+                segments_to_text(group), f"{idx}",
+                lambda strict: self.format_segment_chunk_async(group, f"{idx}", strict),
+                checkpoint,
+                normalize=lambda: self._local_normalizer().format_segments_text(group)
+            )
+
+        formatted_chunks = await map_ordered(
+            format_group,
+            ((idx, group) for idx, group in enumerate(chunk_segments(segments, self.chunk_size), 1)
+             if any(s.get('text', '').strip() for s in group)),
+            self.concurrency
+        )
+        final_text = "\n\n".join(formatted_chunks)
+        logger.info(f"✓ Segmentos formateados: {len(final_text)} caracteres totales")
+        return final_text
+
+    def format_segments(self, segments, checkpoint=None):
+        """Versión síncrona de format_segments_async()."""
+        return run_sync(self.format_segments_async(segments, checkpoint))
+
+    async def format_transcript_async(self, raw_text, segments=None, checkpoint=None):
+        """
+        Formatea una transcripción por segmentos o como texto, según convenga.
+
+        Si hay segmentos estructurados y el texto es largo, tiene hablantes o
+        el motor usa los tiempos, se formatea por segmentos.
+
+        Args:
+            raw_text: Texto crudo de la transcripción
+            segments: Función sin argumentos que devuelve un iterador nuevo
+                de segmentos (ver archive.segment_source), o None
+            checkpoint: ChunkCheckpoint opcional
+
+        Returns:
+            str: Texto formateado
+        """
+        if segments and (
+            self.prefers_segments
+            or len(raw_text) > self.long_text_threshold
+            or has_speakers(segments())
+        ):
+            logger.info("Procesando por segmentos...")
+            return await self.format_segments_async(segments(), checkpoint=checkpoint)
+        return await self.format_text_async(raw_text, checkpoint=checkpoint)
+
+    def _write_output(self, input_path, output_path, formatted_text):
+        write_artifact(
+            output_path,
+            f"Transcripción formateada de: {input_path.name}\n"
+            f"Fecha de formateo: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Modelo usado: {self.description}\n"
+            + "="*80 + "\n\n"
+            + formatted_text
+        )
+
+    async def format_file_async(self, input_path, output_path=None):
+        """
+        Formatea un archivo de transcripción.
+
+        Args:
+            input_path: Ruta al archivo de transcripción cruda
+            output_path: Ruta donde guardar el texto formateado
+
+        Returns:
+            bool: True si se formateó exitosamente
+        """
+        input_path = Path(input_path)
+
+        if not input_path.exists():
+            logger.error(f"El archivo no existe: {input_path}")
+            return False
+
+        logger.info(f"Procesando archivo: {input_path.name}")
+
+        try:
+            # La E/S de archivos va en hilos: el loop es compartido con los
+            # demás archivos y análisis en curso
+            raw_text = await asyncio.to_thread(input_path.read_text, encoding='utf-8')
+
+            if not raw_text.strip():
+                logger.warning(f"El archivo está vacío: {input_path}")
+                return False
+
+            logger.info(f"Texto leído ({len(raw_text)} caracteres)")
+
+            if output_path:
+                output_path = Path(output_path)
+            else:
+                output_path = Path("/app/output") / f"{input_path.stem}_formateado.txt"
+
+            # Chunks ya formateados / fallidos en ejecuciones anteriores
+            checkpoint = await asyncio.to_thread(ChunkCheckpoint.for_output, output_path)
+
+            # Segmentos estructurados, en JSONL o en el archivo comprimido del audio
+            formatted_text = await self.format_transcript_async(
+                raw_text, segment_source(input_path), checkpoint=checkpoint
+            )
+
+            if not formatted_text:
+                logger.error("No se pudo formatear el texto")
+                return False
+
+            pending = await asyncio.to_thread(checkpoint.save)
+            if pending:
+                logger.warning(
+                    f"⚠️  {pending} chunk(s) quedaron sin formatear; "
+                    f"se reintentarán en la próxima ejecución"
+                )
+
+            await asyncio.to_thread(self._write_output, input_path, output_path, formatted_text)
+            logger.info(f"✓ Texto formateado guardado en: {output_path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al procesar el archivo: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return False
+
+    def format_file(self, input_path, output_path=None):
+        """Versión síncrona de format_file_async()."""
+        return run_sync(self.format_file_async(input_path, output_path))
+
+    @staticmethod
+    def _is_up_to_date(text_file, output_path):
+        """Indica si la salida formateada es más reciente que la transcripción y está completa."""
+        # La salida puede estar ya guardada en el archivo comprimido del audio
+        stored = output_path if is_complete(output_path) else archive_containing(output_path)
+        return (
+            stored is not None
+            and stored.stat().st_mtime >= text_file.stat().st_mtime
+            and not ChunkCheckpoint.for_output(output_path).path.exists()
+        )
+
+    async def _process_file(self, idx, total, text_file, output_path, lease_queue, progress=None):
+        """Formatea un archivo del directorio, reclamándolo antes en modo worker."""
+        lease = None
+        if lease_queue:
+            if self._is_up_to_date(text_file, output_path):
+                logger.info(f"⏭️  Saltando {text_file.name} (ya formateado)")
+                return False
+            lease = lease_queue.claim(f"formato-{text_file.name}")
+            if lease is None:
+                logger.info(f"⏳ {text_file.name} en proceso por otro worker")
+                return False
+
+        logger.info(f"\n{'='*80}")
+        logger.info(f"Procesando archivo {idx}/{total}: {text_file.name}")
+        logger.info(f"{'='*80}\n")
+
+        ok = False
+        if progress:
+            progress.start_item(text_file.name)
+        try:
+            with file_context(text_file.name):
+                ok = await self.format_file_async(text_file, output_path)
+            return ok
+        finally:
+            if progress:
+                progress.complete(text_file.name, ok=ok)
+            if lease:
+                lease.release()
+
+    async def process_directory_async(self, input_dir, output_dir=None, only_pending=False, lease_queue=None):
+        """
+        Procesa todos los archivos de texto en un directorio.
+
+        Los archivos se formatean concurrentemente (hasta `concurrency` a la vez).
+
+        Args:
+            input_dir: Directorio con archivos de transcripción
+            output_dir: Directorio donde guardar los textos formateados
+            only_pending: Si True, solo reintenta los archivos con chunks
+                fallidos en una ejecución anterior
+            lease_queue: LeaseQueue opcional (modo worker): cada archivo se
+                reclama con un lease y se saltan los ya formateados al día
+        """
+        input_dir = Path(input_dir)
+        output_dir = Path(output_dir) if output_dir else Path("/app/output")
+        adopt_existing(output_dir)
+        layout = create_layout_from_env(output_dir)
+
+        if layout.name != 'plano' and input_dir == output_dir:
+            # Salida particionada: las transcripciones se buscan en el índice
+            # y el texto formateado queda en la carpeta de cada audio
+            outputs = {f: f.with_name(f"{f.stem}_formateado.txt") for f in layout.files(TRANSCRIPT_SUFFIX)}
+        else:
+            # Buscar archivos de transcripción (sin "_formateado")
+            outputs = {f: output_dir / f"{f.stem}_formateado.txt" for f in input_dir.iterdir()
+                       if f.is_file() and f.suffix == '.txt'
+                       and '_formateado' not in f.name
+                       and '_detallada' not in f.name}
+
+        if only_pending:
+            outputs = {f: path for f, path in outputs.items() if ChunkCheckpoint.for_output(path).path.exists()}
+        text_files = list(outputs)
+
+        if not text_files:
+            logger.warning(f"No se encontraron archivos para formatear en: {input_dir}")
+            return
+
+        logger.info(f"Encontrados {len(text_files)} archivo(s) para formatear ({self.description})")
+
+        await self.warm_up_async()
+
+        progress = StageProgress(
+            'formateo',
+            {f.name: f.stat().st_size for f in text_files},
+            unit='bytes',
+            status=StatusFile.from_env(output_dir)
+        )
+        results = await map_ordered(
+            lambda item: self._process_file(
+                item[0], len(text_files), item[1], outputs[item[1]], lease_queue, progress
+            ),
+            enumerate(text_files, 1),
+            self.concurrency
+        )
+        progress.finish()
+        success_count = sum(1 for ok in results if ok)
+
+        logger.info(f"\n✓ Archivos formateados exitosamente: {success_count}/{len(text_files)}")
+        self.report()
+
+    def process_directory(self, input_dir, output_dir=None, only_pending=False, lease_queue=None):
+        """Versión síncrona de process_directory_async()."""
+        run_sync(self.process_directory_async(input_dir, output_dir, only_pending, lease_queue))
@@ -1,61 +1,134 @@
 """
 Formateador de transcripciones usando Ollama (modelo local).
 Alternativa 100% local y gratuita a Gemini.
+
+Motor 'ollama' de format_engine: los chunks y los archivos se formatean
+concurrentemente en el event loop compartido del cliente de Ollama.
 """
 import os
 import sys
 from pathlib import Path
 import logging
-import subprocess
 import json
 import requests
-from datetime import datetime
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/app/logs/formatting.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from format_engine import FormatterEngine, FormatterError
+from log_setup import setup_logging
+from ollama_client import OllamaClient, OllamaError, parse_hosts, run_sync
+from work_queue import create_lease_queue_from_env
+
 logger = logging.getLogger(__name__)
 
 
-class OllamaFormatter:
+# Reglas de formateo enviadas como system prompt: al ser un prefijo idéntico
+# en todas las peticiones, Ollama lo evalúa una vez y lo reutiliza
+FORMAT_SYSTEM_PROMPT = """Eres un asistente que formatea transcripciones de audio para mejorar su legibilidad.
+
+REGLAS:
+1. Divide el texto en párrafos coherentes
+2. Añade puntuación correcta (puntos, comas, mayúsculas)
+3. Corrige errores gramaticales obvios
+4. NO resumas, mantén todo el contenido
+5. NO añadas información nueva
+6. Usa doble salto de línea entre párrafos
+7. Si el texto trae líneas 'HABLANTE N:', cada una es un turno de habla: inicia un párrafo nuevo en cada turno y conserva la etiqueta del hablante
+
+Responde solo con el texto formateado."""
+
+# Se antepone al prompt al reintentar un chunk cuya salida omitió o inventó contenido
+STRICT_INSTRUCTION = """IMPORTANTE: conserva TODAS las palabras del texto original, en el mismo orden. No omitas, resumas ni agregues nada; solo cambia puntuación, mayúsculas y párrafos.
+
+"""
+
+
+class OllamaFormatter(FormatterEngine):
     """Formateador usando Ollama con modelos locales."""
     
-    def __init__(self, model_name='llama3.2:3b', ollama_host='http://ollama:11434'):
+    name = 'ollama'
+    
+    def __init__(self, model_name='llama3.2:3b', ollama_host='http://ollama:11434', client=None,
+                 keep_alive='30m', concurrency=None, per_host_concurrency=2, max_tokens=4000):
         """
         Inicializa el formateador con Ollama.
         
         Args:
             model_name: Modelo de Ollama a usar (llama3.2:3b es ligero y eficiente)
-            ollama_host: URL del servidor Ollama
+            ollama_host: URL del servidor Ollama, o lista de URLs para repartir
+                los chunks entre varios servidores
+            client: OllamaClient compartido (se crea uno si no se indica)
+            keep_alive: Tiempo que el modelo permanece cargado entre peticiones
+            concurrency: Archivos y chunks por archivo en curso a la vez
+                (None = capacidad total del cliente)
+            per_host_concurrency: Peticiones simultáneas por host de Ollama
+            max_tokens: Tokens máximos a generar por chunk
         """
         self.model_name = model_name
-        self.ollama_host = ollama_host
-        self.api_url = f"{ollama_host}/api/generate"
-        
+        self.ollama_hosts = parse_hosts(ollama_host)
+        self.ollama_host = self.ollama_hosts[0]
+        self.api_url = f"{self.ollama_host}/api/generate"
+        self.chunk_size = 25000  # Procesamos en chunks de 25k caracteres
+        self.client = client or OllamaClient(
+            self.ollama_hosts,
+            keep_alive=keep_alive,
+            per_host_concurrency=per_host_concurrency
+        )
+        self.concurrency = concurrency or self.client.max_in_flight
+        self.max_tokens = max_tokens
+    
+    @classmethod
+    def from_env(cls):
+        """Crea el formateador desde OLLAMA_MODEL, OLLAMA_HOSTS/OLLAMA_HOST, OLLAMA_KEEP_ALIVE y OLLAMA_CONCURRENCY."""
+        return cls(
+            model_name=os.environ.get('OLLAMA_MODEL', 'llama3.2:3b'),
+            # OLLAMA_HOSTS (lista separada por comas) reparte la carga entre varios servidores
+            ollama_host=os.environ.get('OLLAMA_HOSTS') or os.environ.get('OLLAMA_HOST', 'http://ollama:11434'),
+            keep_alive=os.environ.get('OLLAMA_KEEP_ALIVE', '30m'),
+            per_host_concurrency=int(os.environ.get('OLLAMA_CONCURRENCY') or '2')
+        )
+    
+    @property
+    def description(self):
+        return f"Ollama - {self.model_name}"
+    
+    def prepare(self):
+        """Verifica que Ollama responda y que el modelo esté descargado."""
+        if not self.check_ollama_available():
+            logger.error("Ollama no está disponible. Asegúrate de que el contenedor esté corriendo.")
+            return False
+        if not self.ensure_model_available():
+            logger.error("No se pudo preparar el modelo de Ollama.")
+            return False
+        return True
+    
     def check_ollama_available(self):
-        """Verifica si Ollama está disponible y corriendo."""
-        try:
-            response = requests.get(f"{self.ollama_host}/api/tags", timeout=5)
-            if response.status_code == 200:
-                logger.info("✓ Ollama está disponible")
-                return True
-        except Exception as e:
-            logger.warning(f"Ollama no está disponible: {e}")
-        return False
+        """Verifica si Ollama está disponible y corriendo (en al menos un host)."""
+        available = 0
+        for host in self.ollama_hosts:
+            try:
+                response = requests.get(f"{host}/api/tags", timeout=5)
+                if response.status_code == 200:
+                    logger.info(f"✓ Ollama está disponible ({host})")
+                    available += 1
+                    continue
+            except Exception as e:
+                logger.warning(f"Ollama no está disponible en {host}: {e}")
+        return available > 0
     
     def ensure_model_available(self):
-        """Asegura que el modelo esté descargado."""
+        """Asegura que el modelo esté descargado en cada host disponible."""
+        ready = 0
+        for host in self.ollama_hosts:
+            if self._ensure_model_on_host(host):
+                ready += 1
+        return ready > 0
+    
+    def _ensure_model_on_host(self, host):
+        """Asegura que el modelo esté descargado en un host."""
         try:
-            logger.info(f"Verificando modelo {self.model_name}...")
+            logger.info(f"Verificando modelo {self.model_name} en {host}...")
             
             # Verificar si el modelo ya está descargado
-            response = requests.get(f"{self.ollama_host}/api/tags")
+            response = requests.get(f"{host}/api/tags", timeout=10)
             if response.status_code == 200:
                 models = response.json().get('models', [])
                 model_names = [m.get('name', '') for m in models]
@@ -68,7 +141,7 @@ class OllamaFormatter:
             logger.info(f"Descargando modelo {self.model_name}... (esto puede tardar)")
             pull_data = {"name": self.model_name}
             response = requests.post(
-                f"{self.ollama_host}/api/pull",
+                f"{host}/api/pull",
                 json=pull_data,
                 stream=True,
                 timeout=600
@@ -87,283 +160,130 @@ class OllamaFormatter:
             return True
             
         except Exception as e:
-            logger.error(f"Error al preparar el modelo: {e}")
+            logger.error(f"Error al preparar el modelo en {host}: {e}")
             return False
     
-    def _format_long_text(self, raw_text, max_tokens):
+    async def warm_up_async(self):
         """
-        Formatea texto largo dividiéndolo en chunks.
-        
-        Args:
-            raw_text: Texto completo
-            max_tokens: Tokens máximos por chunk
-        
-        Returns:
-            str: Texto formateado completo
+        Carga el modelo y precalienta el system prompt antes de la cola
+        (evita la carga en frío en el primer archivo).
         """
-        chunk_size = 25000  # Procesamos en chunks de 25k caracteres
-        chunks = []
-        
-        # Dividir en chunks
-        for i in range(0, len(raw_text), chunk_size):
-            chunks.append(raw_text[i:i + chunk_size])
-        
-        logger.info(f"  Dividido en {len(chunks)} chunks para procesar")
-        
-        # Formatear cada chunk
-        formatted_chunks = []
-        for idx, chunk in enumerate(chunks, 1):
-            logger.info(f"  Procesando chunk {idx}/{len(chunks)} ({len(chunk)} chars)...")
-            
-            prompt = f"""Por favor, formatea la siguiente parte de una transcripción de audio:
-
-REGLAS:
-1. Divide el texto en párrafos coherentes
-2. Añade puntuación correcta (puntos, comas, mayúsculas)
-3. Corrige errores gramaticales obvios
-4. NO resumas, mantén todo el contenido
-5. NO añadas información nueva
-6. Usa doble salto de línea entre párrafos
-
-TRANSCRIPCIÓN PARTE {idx}/{len(chunks)}:
-{chunk}
-
-TEXTO FORMATEADO:"""
-            
-            try:
-                payload = {
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,
-                        "num_predict": max_tokens
-                    }
-                }
-                
-                response = requests.post(
-                    self.api_url,
-                    json=payload,
-                    timeout=300
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    formatted_chunk = result.get('response', '').strip()
-                    formatted_chunks.append(formatted_chunk)
-                    logger.info(f"  ✓ Chunk {idx} formateado ({len(formatted_chunk)} chars)")
-                else:
-                    logger.warning(f"  Error en chunk {idx}, usando texto original")
-                    formatted_chunks.append(chunk)
-                    
-            except Exception as e:
-                logger.error(f"  Error al formatear chunk {idx}: {e}")
-                formatted_chunks.append(chunk)
+        return await self.client.warm_up_async(self.model_name, system=FORMAT_SYSTEM_PROMPT)
+    
+    def warm_up(self):
+        """Versión síncrona de warm_up_async()."""
+        return run_sync(self.warm_up_async())
+    
+    def release(self):
+        """Devuelve el modelo al keep_alive normal de Ollama al terminar el lote."""
+        self.client.release(self.model_name)
+    
+    def report(self):
+        """Registra el filtro de calidad y el tiempo de evaluación de prompt del lote."""
+        super().report()
+        self.client.stats.report(self.model_name, systems=[FORMAT_SYSTEM_PROMPT])
+    
+    async def _generate(self, prompt, max_tokens, temperature=0.1):
+        """
+        Envía un prompt de formateo a Ollama.
         
-        # Unir todos los chunks
-        final_text = "\n\n".join(formatted_chunks)
-        logger.info(f"✓ Texto largo formateado: {len(final_text)} caracteres totales")
-        return final_text
+        Raises:
+            OllamaError: Si Ollama no responde tras los reintentos
+        """
+        result = await self.client.generate_async(
+            prompt,
+            model=self.model_name,
+            system=FORMAT_SYSTEM_PROMPT,
+            options={
+                "temperature": temperature,
+                "num_predict": max_tokens
+            }
+        )
+        return result.get('response', '').strip()
     
-    def format_text(self, raw_text, max_tokens=4000):
+    async def format_chunk_async(self, text, part=None, strict=False):
         """
-        Formatea un texto usando Ollama.
+        Formatea un fragmento con Ollama.
         
         Args:
-            raw_text: Texto crudo a formatear
-            max_tokens: Número máximo de tokens a generar
+            text: Texto crudo del fragmento
+            part: Número de parte ('i/n'), o None si es la transcripción completa
+            strict: Añade la instrucción estricta (tras una salida con deriva)
         
         Returns:
             str: Texto formateado
-        """
-        if not raw_text.strip():
-            logger.warning("Texto vacío, saltando formateo")
-            return raw_text
         
-        # Si el texto es muy largo (>30k chars), dividirlo en chunks
-        if len(raw_text) > 30000:
-            logger.info(f"Texto muy largo ({len(raw_text)} chars), procesando en chunks...")
-            return self._format_long_text(raw_text, max_tokens)
-        
-        prompt = f"""Por favor, formatea la siguiente transcripción de audio para mejorar su legibilidad:
-
-REGLAS:
-1. Divide el texto en párrafos coherentes
-2. Añade puntuación correcta (puntos, comas, mayúsculas)
-3. Corrige errores gramaticales obvios
-4. NO resumas, mantén todo el contenido
-5. NO añadas información nueva
-6. Usa doble salto de línea entre párrafos
-
-TRANSCRIPCIÓN:
-{raw_text}
+        Raises:
+            FormatterError: Si Ollama no responde tras los reintentos
+        """
+        title = f"TRANSCRIPCIÓN PARTE {part}" if part else "TRANSCRIPCIÓN"
+        # La instrucción estricta va en el prompt, no en el system, para no
+        # invalidar el prefijo precalentado
+        prompt = f"""{STRICT_INSTRUCTION if strict else ''}{title}:
+{text}
 
 TEXTO FORMATEADO:"""
-
+        
         try:
-            logger.info(f"Enviando texto a Ollama ({len(raw_text)} caracteres)...")
-            
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,
-                    "num_predict": max_tokens
-                }
-            }
-            
-            response = requests.post(
-                self.api_url,
-                json=payload,
-                timeout=300  # 5 minutos timeout
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                formatted_text = result.get('response', '').strip()
-                logger.info(f"✓ Texto formateado ({len(formatted_text)} caracteres)")
-                return formatted_text
-            else:
-                logger.error(f"Error de Ollama: {response.status_code}")
-                return raw_text
-                
-        except Exception as e:
-            logger.error(f"Error al formatear: {e}")
-            return raw_text
-    
-    def format_file(self, input_path, output_path=None):
+            return await self._generate(prompt, self.max_tokens, temperature=0.0 if strict else 0.1)
+        except OllamaError as e:
+            raise FormatterError(str(e)) from e
+
+    async def format_text_async(self, raw_text, max_tokens=None, *, checkpoint=None):
         """
-        Formatea un archivo de transcripción.
+        Formatea un texto usando Ollama.
         
         Args:
-            input_path: Ruta al archivo de transcripción cruda
-            output_path: Ruta donde guardar el texto formateado
+            raw_text: Texto crudo a formatear
+            max_tokens: Tokens máximos por chunk en esta llamada (None = self.max_tokens)
+            checkpoint: ChunkCheckpoint opcional (reintenta solo lo que falló)
         
         Returns:
-            bool: True si se formateó exitosamente
+            str: Texto formateado
         """
-        input_path = Path(input_path)
-        
-        if not input_path.exists():
-            logger.error(f"El archivo no existe: {input_path}")
-            return False
-        
-        logger.info(f"Procesando archivo: {input_path.name}")
-        
-        try:
-            # Leer el contenido
-            with open(input_path, 'r', encoding='utf-8') as f:
-                raw_text = f.read()
-            
-            if not raw_text.strip():
-                logger.warning(f"El archivo está vacío: {input_path}")
-                return False
-            
-            logger.info(f"Texto leído ({len(raw_text)} caracteres)")
-            
-            # Formatear el texto
-            formatted_text = self.format_text(raw_text)
-            
-            if not formatted_text:
-                logger.error("No se pudo formatear el texto")
-                return False
-            
-            # Determinar ruta de salida
-            if output_path:
-                output_path = Path(output_path)
-            else:
-                output_path = Path("/app/output") / f"{input_path.stem}_formateado.txt"
-            
-            # Guardar el archivo formateado
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(f"Transcripción formateada de: {input_path.name}\n")
-                f.write(f"Fecha de formateo: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Modelo usado: Ollama - {self.model_name}\n")
-                f.write("="*80 + "\n\n")
-                f.write(formatted_text)
-            
-            logger.info(f"✓ Texto formateado guardado en: {output_path}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error al procesar el archivo: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return False
+        engine = self._overridden(max_tokens=max_tokens)
+        return await FormatterEngine.format_text_async(engine, raw_text, checkpoint=checkpoint)
     
-    def process_directory(self, input_dir, output_dir=None):
-        """
-        Procesa todos los archivos de texto en un directorio.
-        
-        Args:
-            input_dir: Directorio con archivos de transcripción
-            output_dir: Directorio donde guardar los textos formateados
-        """
-        input_dir = Path(input_dir)
-        output_dir = Path(output_dir) if output_dir else Path("/app/output")
-        
-        # Buscar archivos de transcripción (sin "_formateado")
-        text_files = [f for f in input_dir.iterdir() 
-                     if f.is_file() and f.suffix == '.txt' 
-                     and '_formateado' not in f.name
-                     and '_detallada' not in f.name]
-        
-        if not text_files:
-            logger.warning(f"No se encontraron archivos para formatear en: {input_dir}")
-            return
-        
-        logger.info(f"Encontrados {len(text_files)} archivo(s) para formatear")
-        
-        success_count = 0
-        for idx, text_file in enumerate(text_files, 1):
-            logger.info(f"\n{'='*80}")
-            logger.info(f"Procesando archivo {idx}/{len(text_files)}: {text_file.name}")
-            logger.info(f"{'='*80}\n")
-            
-            output_path = output_dir / f"{text_file.stem}_formateado.txt"
-            if self.format_file(text_file, output_path):
-                success_count += 1
-        
-        logger.info(f"\n✓ Archivos formateados exitosamente: {success_count}/{len(text_files)}")
+    def format_text(self, raw_text, max_tokens=None, *, checkpoint=None):
+        """Versión síncrona de format_text_async()."""
+        return run_sync(self.format_text_async(raw_text, max_tokens, checkpoint=checkpoint))
 
 
 def main():
     """Función principal."""
+    setup_logging('formatting')
+    
     # Configuración desde variables de entorno
-    model_name = os.environ.get('OLLAMA_MODEL', 'llama3.2:3b')
-    ollama_host = os.environ.get('OLLAMA_HOST', 'http://ollama:11434')
     input_dir = Path(os.environ.get('INPUT_DIR', '/app/output'))
     output_dir = Path(os.environ.get('OUTPUT_DIR', '/app/output'))
+    only_pending = os.environ.get('FORMAT_ONLY_PENDING', 'false').lower() == 'true'
+    
+    # Crear formateador
+    formatter = OllamaFormatter.from_env()
     
     logger.info("="*80)
     logger.info("SERVICIO DE FORMATEO CON OLLAMA (100% LOCAL)")
     logger.info("="*80)
-    logger.info(f"Modelo: {model_name}")
-    logger.info(f"Ollama: {ollama_host}")
+    logger.info(f"Modelo: {formatter.model_name}")
+    logger.info(f"Ollama: {', '.join(formatter.ollama_hosts)}")
     logger.info(f"Directorio de entrada: {input_dir}")
     logger.info(f"Directorio de salida: {output_dir}")
     logger.info("="*80 + "\n")
     
-    # Crear formateador
-    formatter = OllamaFormatter(model_name=model_name, ollama_host=ollama_host)
-    
-    # Verificar Ollama
-    if not formatter.check_ollama_available():
-        logger.error("Ollama no está disponible. Asegúrate de que el contenedor esté corriendo.")
+    # Verificar Ollama y asegurar que el modelo esté disponible
+    if not formatter.prepare():
         logger.info("Para usar Ollama, ejecuta: docker-compose up -d ollama")
         sys.exit(1)
     
-    # Asegurar que el modelo esté disponible
-    if not formatter.ensure_model_available():
-        logger.error("No se pudo preparar el modelo de Ollama.")
-        sys.exit(1)
-    
     # Procesar archivos
     if input_dir.exists():
-        formatter.process_directory(input_dir, output_dir)
+        formatter.process_directory(
+            input_dir,
+            output_dir,
+            only_pending=only_pending,
+            lease_queue=create_lease_queue_from_env(output_dir)
+        )
+        formatter.release()
     else:
         logger.error(f"El directorio de entrada no existe: {input_dir}")
         sys.exit(1)
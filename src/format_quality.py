@@ -0,0 +1,133 @@
+"""
+Pre-evaluación de la calidad de puntuación de un fragmento de transcripción.
+Whisper suele entregar texto ya bien puntuado: estos fragmentos no necesitan
+pasar por el LLM y basta con normalizarlos localmente. El puntaje combina
+densidad de puntuación, mayúsculas al inicio de oración y estadísticas de
+largo de oración, y cuesta microsegundos por fragmento.
+"""
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.?!…])\s+')
+SENTENCE_END = re.compile(r'[.?!…]')
+SOFT_PUNCTUATION = re.compile(r'[,;:]')
+SPEAKER_LABEL = re.compile(r'^HABLANTE \d+:\s*', re.MULTILINE)
+
+# Estimación de caracteres por token para contar tokens evitados
+CHARS_PER_TOKEN = 4
+
+
+def chunk_quality(text):
+    """
+    Calcula métricas de puntuación de un fragmento.
+
+    Args:
+        text: Texto crudo del fragmento
+
+    Returns:
+        dict: 'palabras', 'oraciones', 'largo_medio', 'largo_max',
+            'mayusculas' (fracción de oraciones que empiezan en mayúscula),
+            'comas_por_oracion' y 'puntaje' (0 a 1)
+    """
+    text = SPEAKER_LABEL.sub('', text)
+    words = text.split()
+    if not words:
+        return {'palabras': 0, 'oraciones': 0, 'largo_medio': 0.0, 'largo_max': 0,
+                'mayusculas': 0.0, 'comas_por_oracion': 0.0, 'puntaje': 0.0}
+
+    sentences = [s for s in SENTENCE_SPLIT.split(' '.join(words)) if s]
+    lengths = [len(s.split()) for s in sentences]
+    capitalized = sum(1 for s in sentences if s.lstrip('¿¡"\'(«')[:1].isupper())
+    ends = len(SENTENCE_END.findall(text))
+    commas = len(SOFT_PUNCTUATION.findall(text))
+
+    mean_length = len(words) / max(len(sentences), 1)
+    max_length = max(lengths)
+    capital_ratio = capitalized / len(sentences)
+
+    # Oraciones de 5-30 palabras son lo normal en habla transcrita; más
+    # largas indican puntuación faltante (texto corrido)
+    length_score = 1.0 if mean_length <= 30 else max(0.0, 1.0 - (mean_length - 30) / 30)
+    run_on_score = 1.0 if max_length <= 60 else max(0.0, 1.0 - (max_length - 60) / 60)
+    # Oraciones muy largas sin ninguna coma tampoco están bien puntuadas
+    comma_score = 1.0 if mean_length <= 15 or commas else 0.5
+    density_score = min(1.0, ends * 40 / len(words))
+
+    return {
+        'palabras': len(words),
+        'oraciones': len(sentences),
+        'largo_medio': mean_length,
+        'largo_max': max_length,
+        'mayusculas': capital_ratio,
+        'comas_por_oracion': commas / len(sentences),
+        'puntaje': capital_ratio * length_score * run_on_score * comma_score * density_score,
+    }
+
+
+class QualityGate:
+    """
+    Decide qué fragmentos necesitan el LLM y lleva la cuenta de los que no.
+
+    Los fragmentos con puntaje >= threshold se normalizan localmente; el
+    resto se envía al LLM.
+    """
+
+    def __init__(self, threshold=0.85, min_words=20):
+        """
+        Args:
+            threshold: Puntaje mínimo para saltar el LLM
+            min_words: Fragmentos más cortos siempre van al LLM (poca evidencia)
+        """
+        self.threshold = threshold
+        self.min_words = min_words
+        self.checked = 0
+        self.skipped = 0
+        self.skipped_chars = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Crea el filtro desde FORMAT_QUALITY_GATE y FORMAT_QUALITY_THRESHOLD (None si está desactivado)."""
+        if os.environ.get('FORMAT_QUALITY_GATE', 'true').lower() != 'true':
+            return None
+        return cls(threshold=float(os.environ.get('FORMAT_QUALITY_THRESHOLD', '0.85')))
+
+    def accepts(self, text):
+        """
+        Indica si el fragmento ya está bien puntuado (no necesita el LLM).
+
+        Args:
+            text: Texto crudo del fragmento
+
+        Returns:
+            bool: True si se puede saltar el LLM
+        """
+        quality = chunk_quality(text)
+        ok = quality['palabras'] >= self.min_words and quality['puntaje'] >= self.threshold
+        with self._lock:
+            self.checked += 1
+            if ok:
+                self.skipped += 1
+                self.skipped_chars += len(text)
+        logger.debug(f"Calidad del fragmento: {quality}")
+        return ok
+
+    def report(self):
+        """
+        Registra en el log los fragmentos y tokens de LLM evitados.
+
+        Returns:
+            dict: 'evaluados', 'sin_llm', 'tokens_evitados'
+        """
+        # Se evitan tanto los tokens del prompt como los de la respuesta
+        avoided_tokens = 2 * self.skipped_chars // CHARS_PER_TOKEN
+        if self.checked:
+            logger.info(
+                f"📊 Filtro de calidad: {self.skipped}/{self.checked} fragmentos ya bien puntuados "
+                f"sin LLM (~{avoided_tokens} tokens de LLM evitados)"
+            )
+        return {'evaluados': self.checked, 'sin_llm': self.skipped, 'tokens_evitados': avoided_tokens}
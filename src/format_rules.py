@@ -0,0 +1,154 @@
+"""
+Formateador local basado en reglas (motor 'reglas'), sin LLM.
+Puntúa y divide en párrafos usando los límites de los segmentos de Whisper
+y la duración de las pausas entre ellos. Es órdenes de magnitud más rápido
+que un LLM y sirve de respaldo cuando Ollama no está disponible.
+"""
+import logging
+import os
+import re
+
+from format_engine import FormatterEngine
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_END = ('.', '?', '!', '…')
+SOFT_PUNCTUATION = (',', ';', ':')
+# Fin de oración seguido de espacio (para el texto plano sin tiempos)
+SENTENCE_SPLIT = re.compile(r'(?<=[.?!…])\s+')
+
+
+def _capitalize(text):
+    """Pone en mayúscula la primera letra (saltando ¿, ¡, comillas, etc.)."""
+    for i, char in enumerate(text):
+        if char.isalpha():
+            return text[:i] + char.upper() + text[i + 1:]
+        if char.isdigit():
+            return text
+    return text
+
+
+def _end_sentence(text):
+    """Cierra una oración con punto si no termina ya en puntuación final."""
+    if text.endswith(SENTENCE_END):
+        return text
+    if text.endswith(SOFT_PUNCTUATION):
+        return text[:-1] + '.'
+    return text + '.'
+
+
+class RuleFormatter(FormatterEngine):
+    """Puntuación y párrafos a partir de los tiempos de los segmentos de Whisper."""
+
+    name = 'reglas'
+    description = "Reglas locales (pausas de Whisper, sin LLM)"
+    # Sin límite práctico de contexto: se formatea cada archivo de una vez
+    chunk_size = 1_000_000
+    prefers_segments = True
+    uses_llm = False
+
+    def __init__(self, comma_pause=0.3, sentence_pause=0.8, paragraph_pause=2.0, max_paragraph_chars=900):
+        """
+        Inicializa el formateador.
+
+        Args:
+            comma_pause: Pausa (segundos) entre segmentos que se marca con coma
+            sentence_pause: Pausa que cierra la oración
+            paragraph_pause: Pausa que inicia un párrafo nuevo
+            max_paragraph_chars: Largo a partir del cual se inicia un párrafo
+                nuevo en el siguiente fin de oración
+        """
+        self.comma_pause = comma_pause
+        self.sentence_pause = sentence_pause
+        self.paragraph_pause = paragraph_pause
+        self.max_paragraph_chars = max_paragraph_chars
+
+    @classmethod
+    def from_env(cls):
+        """Crea el formateador desde RULES_SENTENCE_PAUSE y RULES_PARAGRAPH_PAUSE."""
+        return cls(
+            sentence_pause=float(os.environ.get('RULES_SENTENCE_PAUSE', '0.8')),
+            paragraph_pause=float(os.environ.get('RULES_PARAGRAPH_PAUSE', '2.0'))
+        )
+
+    def format_segments_text(self, segments):
+        """
+        Construye el texto formateado a partir de segmentos con tiempos.
+
+        Args:
+            segments: Iterable de segmentos ('start', 'end', 'text' y
+                opcionalmente 'speaker')
+
+        Returns:
+            str: Párrafos separados por doble salto de línea
+        """
+        paragraphs = []
+        current = []
+        length = 0
+        prev_end = None
+        prev_speaker = None
+
+        for segment in segments:
+            text = ' '.join(segment.get('text', '').split())
+            if not text:
+                continue
+            speaker = segment.get('speaker')
+            gap = segment.get('start', 0.0) - prev_end if prev_end is not None else 0.0
+
+            if current:
+                new_paragraph = (
+                    speaker != prev_speaker
+                    or gap >= self.paragraph_pause
+                    or (length >= self.max_paragraph_chars
+                        and (gap >= self.sentence_pause or current[-1].endswith(SENTENCE_END)))
+                )
+                if new_paragraph:
+                    current[-1] = _end_sentence(current[-1])
+                    paragraphs.append(' '.join(current))
+                    current, length = [], 0
+                elif gap >= self.sentence_pause:
+                    current[-1] = _end_sentence(current[-1])
+                elif gap >= self.comma_pause and not current[-1].endswith(SENTENCE_END + SOFT_PUNCTUATION):
+                    current[-1] += ','
+
+            if not current or current[-1].endswith(SENTENCE_END):
+                text = _capitalize(text)
+            if not current and speaker:
+                text = f"{speaker}: {text}"
+
+            current.append(text)
+            length += len(text) + 1
+            prev_end = segment.get('end', segment.get('start', 0.0))
+            prev_speaker = speaker
+
+        if current:
+            current[-1] = _end_sentence(current[-1])
+            paragraphs.append(' '.join(current))
+        return "\n\n".join(paragraphs)
+
+    def format_plain_text(self, text):
+        """
+        Formatea texto sin tiempos: capitaliza cada oración y agrupa las
+        oraciones en párrafos de hasta max_paragraph_chars.
+        """
+        paragraphs = []
+        current = []
+        length = 0
+        for sentence in SENTENCE_SPLIT.split(' '.join(text.split())):
+            if not sentence:
+                continue
+            current.append(_capitalize(sentence))
+            length += len(sentence) + 1
+            if length >= self.max_paragraph_chars:
+                paragraphs.append(' '.join(current))
+                current, length = [], 0
+        if current:
+            current[-1] = _end_sentence(current[-1])
+            paragraphs.append(' '.join(current))
+        return "\n\n".join(paragraphs)
+
+    async def format_segment_chunk_async(self, segments, part=None, strict=False):
+        return self.format_segments_text(segments)
+
+    async def format_chunk_async(self, text, part=None, strict=False):
+        return self.format_plain_text(text)
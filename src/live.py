@@ -0,0 +1,601 @@
+"""
+Transcripción en vivo (micrófono, tubería con nombre o stream de red).
+
+El audio llega como PCM mientras se graba y se transcribe en una ventana
+deslizante: cada `step` segundos se decodifica el audio acumulado, los
+segmentos que terminan antes de los últimos `overlap` segundos se dan por
+finales y se emiten, y el resto (la cola, que Whisper aún puede corregir
+con el audio que sigue) se vuelve a decodificar en el paso siguiente. La
+ventana nunca supera `window` segundos (como máximo 30, una sola pasada del
+codificador de Whisper), así que la latencia queda acotada por
+step + overlap + el tiempo de decodificar una ventana.
+
+Los segmentos finales se guardan periódicamente en los archivos de
+siempre (<nombre>_segmentos.jsonl, .srt, .vtt) y, si se pide, se envían en
+grupos al formateador mientras sigue la grabación. Al terminar (fin del
+stream o Ctrl+C) se escriben la versión detallada y, al final,
+<nombre>_transcripcion.txt con su marca de completitud: desde ese momento
+la grabación es un audio más para el formateo, el análisis y la búsqueda.
+
+Fuentes:
+- '-': PCM s16le mono 16 kHz por la entrada estándar
+- una ruta: archivo o tubería con nombre (mkfifo) con el mismo PCM
+- una URL (http://, rtp://, udp://, rtsp://...): se decodifica con FFmpeg
+- simular <audio>: reproduce un archivo a velocidad real (prueba local)
+
+Uso:
+    arecord -f S16_LE -r 16000 -c 1 | python src/live.py escuchar - --nombre clase
+    python src/live.py escuchar http://localhost:8000/radio.mp3 --formatear
+    python src/live.py simular input/clase1.wav --velocidad 2
+"""
+import argparse
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+import wave
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from artifacts import write_artifact
+from log_setup import file_context, setup_logging
+from output_layout import FORMATTED_SUFFIX, TRANSCRIPT_SUFFIX, create_layout_from_env
+from segments import SegmentWriter, segments_to_text
+from vocabulary import Vocabulary, VocabularyPrompter
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+# Duración máxima que Whisper decodifica en una sola pasada
+WHISPER_WINDOW = 30.0
+# Caracteres de texto final que se pasan como contexto al paso siguiente
+PROMPT_CHARS = 200
+
+
+def _format_clock(seconds):
+    """Segundos a 'HH:MM:SS.d'."""
+    minutes, secs = divmod(max(seconds, 0.0), 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours:02d}:{minutes:02d}:{secs:04.1f}"
+
+
+def _pcm_to_float(data):
+    """PCM s16le a muestras float32 en [-1, 1] (como whisper.load_audio)."""
+    usable = len(data) - len(data) % 2
+    return np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768.0
+
+
+def _ffmpeg_process(source):
+    """Lanza FFmpeg decodificando `source` a PCM s16le mono 16 kHz por stdout."""
+    command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', source, '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-']
+    return subprocess.Popen(command, stdout=subprocess.PIPE)
+
+
+class PcmSource:
+    """
+    Fuente de PCM en vivo leída en bloques de `chunk_seconds`.
+
+    Un hilo lee la fuente sin pausa y deja los bloques en una cola: si la
+    decodificación se atrasa, el productor (arecord, FFmpeg, el servidor)
+    no queda bloqueado y el paso siguiente toma todo lo acumulado.
+    """
+
+    def __init__(self, spec, chunk_seconds=0.5, decode=None):
+        """
+        Args:
+            spec: '-', ruta de archivo o tubería, o URL
+            chunk_seconds: Tamaño de cada lectura
+            decode: True para decodificar con FFmpeg (por defecto solo las URL)
+        """
+        self.spec = spec
+        self.chunk_bytes = int(chunk_seconds * SAMPLE_RATE) * 2
+        self.decode = ('://' in spec) if decode is None else decode
+        self.received = 0.0
+        self._queue = queue.Queue()
+        self._process = None
+        self._thread = None
+
+    def _open(self):
+        if self.decode:
+            self._process = _ffmpeg_process(self.spec)
+            return self._process.stdout
+        if self.spec == '-':
+            # Sin buffer de Python: un hilo bloqueado leyendo no traba el cierre del intérprete
+            return open(sys.stdin.fileno(), 'rb', buffering=0, closefd=False)
+        # Una tubería con nombre bloquea aquí hasta que se conecta el escritor
+        return open(self.spec, 'rb')
+
+    def _read_blocks(self, stream):
+        """Bloques de PCM completos (lee de nuevo tras las lecturas cortas de las tuberías)."""
+        pending = b''
+        while True:
+            data = stream.read(self.chunk_bytes - len(pending))
+            if not data:
+                break
+            pending += data
+            if len(pending) >= self.chunk_bytes:
+                yield pending
+                pending = b''
+        if pending:
+            yield pending
+
+    def _reader(self):
+        stream = None
+        try:
+            stream = self._open()
+            for block in self._read_blocks(stream):
+                self._queue.put(_pcm_to_float(block))
+        except Exception as e:
+            logger.error(f"Error leyendo la fuente de audio {self.spec}: {e}")
+        finally:
+            if stream is not None:
+                stream.close()
+            self._queue.put(None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._reader, name="audio-en-vivo", daemon=True)
+        self._thread.start()
+        return self
+
+    def take(self, timeout=None):
+        """
+        Espera el próximo bloque y devuelve todo el audio disponible.
+
+        Returns:
+            tuple: (muestras float32, fin_del_stream)
+        """
+        chunks = []
+        ended = False
+        try:
+            chunks.append(self._queue.get(timeout=timeout))
+            while True:
+                chunks.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        if any(chunk is None for chunk in chunks):
+            ended = True
+            chunks = [chunk for chunk in chunks if chunk is not None]
+        audio = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+        self.received += len(audio) / SAMPLE_RATE
+        return audio, ended
+
+    def close(self):
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+
+
+class SimulatedSource(PcmSource):
+    """
+    Reproduce un archivo de audio a velocidad real, como si fuera un stream.
+
+    Los WAV PCM 16 kHz mono se leen directamente; el resto se decodifica
+    con FFmpeg. `speed` acelera (2 = el doble de rápido) o, con 0, entrega
+    todo sin esperas.
+    """
+
+    def __init__(self, path, chunk_seconds=0.5, speed=1.0):
+        super().__init__(str(path), chunk_seconds, decode=False)
+        self.path = Path(path)
+        self.speed = speed
+
+    def _open(self):
+        if self.path.suffix.lower() == '.wav':
+            reader = wave.open(str(self.path), 'rb')
+            if (reader.getframerate(), reader.getnchannels(), reader.getsampwidth()) == (SAMPLE_RATE, 1, 2):
+                return _WaveStream(reader)
+            reader.close()
+        self._process = _ffmpeg_process(str(self.path))
+        return self._process.stdout
+
+    def _read_blocks(self, stream):
+        started = time.monotonic()
+        sent = 0.0
+        for block in super()._read_blocks(stream):
+            sent += len(block) / 2 / SAMPLE_RATE
+            if self.speed > 0:
+                time.sleep(max(0.0, started + sent / self.speed - time.monotonic()))
+            yield block
+
+
+class _WaveStream:
+    """Adapta wave.Wave_read a read(bytes)/close()."""
+
+    def __init__(self, reader):
+        self._reader = reader
+
+    def read(self, size):
+        return self._reader.readframes(size // 2)
+
+    def close(self):
+        self._reader.close()
+
+
+class LiveTranscriber:
+    """Transcripción incremental sobre una ventana deslizante con solapamiento."""
+
+    def __init__(self, transcriber, window=20.0, step=2.0, overlap=2.0, on_segment=None, prompter=None):
+        """
+        Args:
+            transcriber: AudioTranscriber con el modelo cargado
+            window: Segundos máximos de audio por decodificación (<= 30)
+            step: Segundos de audio nuevo entre decodificaciones
+            overlap: Segundos finales de cada ventana que se vuelven a
+                decodificar antes de dar sus segmentos por finales
+            on_segment: Función llamada con cada segmento final
+            prompter: VocabularyPrompter opcional (términos en el prompt)
+        """
+        self.transcriber = transcriber
+        self.window = min(window, WHISPER_WINDOW)
+        self.step = step
+        self.overlap = min(overlap, self.window / 2)
+        self.on_segment = on_segment
+        self.prompter = prompter
+        self.segments = []
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._offset = 0.0  # Posición (s) del inicio del buffer en el stream
+        self._decode_seconds = 0.0
+        self._audio_seconds = 0.0
+        self._delays = []
+
+    @classmethod
+    def from_env(cls, transcriber, on_segment=None, prompter=None):
+        """Crea el transcriptor con LIVE_WINDOW_SECONDS, LIVE_STEP_SECONDS y LIVE_OVERLAP_SECONDS."""
+        return cls(
+            transcriber,
+            window=float(os.environ.get('LIVE_WINDOW_SECONDS') or 20),
+            step=float(os.environ.get('LIVE_STEP_SECONDS') or 2),
+            overlap=float(os.environ.get('LIVE_OVERLAP_SECONDS') or 2),
+            on_segment=on_segment,
+            prompter=prompter
+        )
+
+    def _prompt(self):
+        # El final del texto ya emitido da continuidad entre ventanas;
+        # al inicio se usa el contexto de la variante regional
+        if not self.segments:
+            return self.transcriber.initial_prompt
+        return segments_to_text(self.segments[-8:])[-PROMPT_CHARS:]
+
+    def _decode(self):
+        started = time.monotonic()
+        result, _, _ = self.transcriber.scheduler.transcribe(
+            self._buffer,
+            decode_hook=self.prompter,
+            language=self.transcriber.language,
+            fp16=False,
+            verbose=None,
+            initial_prompt=self._prompt(),
+            condition_on_previous_text=False
+        )
+        elapsed = time.monotonic() - started
+        self._decode_seconds += elapsed
+        return [s for s in result.get('segments', []) if s['end'] > s['start']], elapsed
+
+    def _emit(self, segment, received):
+        start = self._offset + float(segment['start'])
+        end = self._offset + float(segment['end'])
+        text = segment.get('text', '').strip()
+        if not text:
+            return
+        final = {
+            'id': len(self.segments),
+            'start': round(start, 3),
+            'end': round(end, 3),
+            'text': text,
+        }
+        for field in ('avg_logprob', 'no_speech_prob'):
+            if field in segment:
+                final[field] = segment[field]
+        self.segments.append(final)
+        # Latencia (con una fuente en tiempo real): audio recibido después del
+        # fin del segmento más lo que tardó la decodificación
+        self._delays.append(max(0.0, received - end))
+        if self.on_segment:
+            self.on_segment(final)
+
+    def _advance(self, received, final=False):
+        """Decodifica la ventana, emite los segmentos finales y recorta el buffer."""
+        if not len(self._buffer):
+            return
+        length = len(self._buffer) / SAMPLE_RATE
+        segments, elapsed = self._decode()
+        received += elapsed
+        if final:
+            ready = segments
+        else:
+            ready = [s for s in segments if s['end'] <= length - self.overlap]
+            if not ready and length >= self.window:
+                # La ventana está llena sin una pausa: se cierra todo salvo el último segmento
+                ready = segments[:-1] if len(segments) > 1 else segments
+        for segment in ready:
+            self._emit(segment, received)
+        if ready:
+            cut = float(ready[-1]['end'])
+        elif not segments:
+            # Silencio: solo se conserva el solapamiento
+            cut = max(0.0, length - self.overlap)
+        else:
+            cut = 0.0
+        if final:
+            cut = length
+        cut_samples = min(len(self._buffer), int(cut * SAMPLE_RATE))
+        self._buffer = self._buffer[cut_samples:]
+        self._offset += cut_samples / SAMPLE_RATE
+
+    def run(self, source):
+        """
+        Transcribe una fuente hasta que termina o se interrumpe.
+
+        Args:
+            source: PcmSource (sin iniciar)
+
+        Returns:
+            list: Segmentos finales, con tiempos desde el inicio del stream
+        """
+        source.start()
+        pending = 0.0
+        try:
+            while True:
+                audio, ended = source.take()
+                self._buffer = np.concatenate([self._buffer, audio])
+                self._audio_seconds += len(audio) / SAMPLE_RATE
+                pending += len(audio) / SAMPLE_RATE
+                if ended:
+                    break
+                if pending >= self.step:
+                    pending = 0.0
+                    self._advance(source.received)
+        except KeyboardInterrupt:
+            logger.info("⏹️  Transcripción en vivo detenida; cerrando la ventana pendiente...")
+            # Audio recibido que aún no se tomó de la cola
+            audio, _ = source.take(timeout=0)
+            self._buffer = np.concatenate([self._buffer, audio])
+            self._audio_seconds += len(audio) / SAMPLE_RATE
+        finally:
+            source.close()
+        self._advance(source.received, final=True)
+        self.report()
+        return self.segments
+
+    def report(self):
+        """Registra el factor de tiempo real y la latencia de los segmentos."""
+        if not self._audio_seconds:
+            return
+        rtf = self._decode_seconds / self._audio_seconds
+        message = f"📊 En vivo: {self._audio_seconds:.1f}s de audio, RTF {rtf:.2f}"
+        if self._delays:
+            message += (f", latencia media {sum(self._delays) / len(self._delays):.1f}s "
+                        f"(máx {max(self._delays):.1f}s)")
+        logger.info(message)
+        if rtf >= 1:
+            logger.warning("⚠️  La decodificación no alcanza el tiempo real: usa un modelo menor "
+                           "o aumenta LIVE_STEP_SECONDS")
+
+
+class LiveOutput:
+    """
+    Archivos de salida de una sesión en vivo.
+
+    Los segmentos (JSONL, SRT y VTT) se reescriben de forma atómica cada
+    `flush_seconds`; la transcripción, que marca el audio como terminado,
+    solo se escribe en close().
+    """
+
+    def __init__(self, output_dir, base_name, transcriber, flush_seconds=30.0, formatter=None,
+                 format_chars=3000):
+        self.layout = create_layout_from_env(output_dir)
+        self.base_name = base_name
+        self.transcript_path = self.layout.path(base_name, TRANSCRIPT_SUFFIX)
+        self.transcriber = transcriber
+        self.flush_seconds = flush_seconds
+        self.started = datetime.now()
+        self.segments = []
+        self._flushed = 0
+        self._last_flush = time.monotonic()
+        self._formatter = LiveFormatter(formatter, format_chars) if formatter else None
+        self.layout.register(base_name)
+
+    def add(self, segment):
+        """Recibe un segmento final (callback de LiveTranscriber)."""
+        self.segments.append(segment)
+        logger.info(f"🎙️  [{_format_clock(segment['start'])}] {segment['text']}")
+        if self._formatter:
+            self._formatter.add(segment)
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def _write_segments(self, formats, detailed_header=None):
+        with SegmentWriter(self.transcript_path.parent, self.base_name,
+                           formats=formats, detailed_header=detailed_header) as writer:
+            writer.write_all(self.segments)
+
+    def flush(self):
+        """Reescribe los archivos de segmentos con lo recibido hasta ahora."""
+        self._last_flush = time.monotonic()
+        if len(self.segments) == self._flushed:
+            return
+        self._write_segments(('jsonl', 'srt', 'vtt'))
+        self._flushed = len(self.segments)
+
+    def close(self):
+        """
+        Escribe la salida completa de la sesión.
+
+        Returns:
+            Path: Ruta de la transcripción (None si no hubo voz)
+        """
+        if not self.segments:
+            logger.warning("⚠️  La sesión en vivo no produjo texto; no se guardan archivos")
+            if self._formatter:
+                self._formatter.close()
+            return None
+        text = segments_to_text(self.segments)
+        detailed_header = (
+            f"Transcripción en vivo: {self.base_name}\n"
+            f"Fecha: {self.started.strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Modelo: {self.transcriber.model_name}\n"
+            f"Idioma: {self.transcriber.language}\n"
+            + "="*80 + "\n\n"
+            + "TRANSCRIPCIÓN COMPLETA:\n\n"
+            + text
+            + "\n\n" + "="*80 + "\n\n"
+        )
+        self._write_segments(('detallada', 'jsonl', 'srt', 'vtt'), detailed_header)
+        # La transcripción va al final: su marca indica que el audio está completo
+        write_artifact(self.transcript_path, text)
+        logger.info(f"✓ Transcripción en vivo guardada en: {self.transcript_path}")
+        if self._formatter:
+            formatted = self._formatter.close()
+            if formatted:
+                output_path = self.layout.path(self.base_name, FORMATTED_SUFFIX)
+                self._formatter.engine._write_output(self.transcript_path, output_path, formatted)
+                logger.info(f"✓ Texto formateado guardado en: {output_path}")
+        return self.transcript_path
+
+
+class LiveFormatter:
+    """
+    Formatea los segmentos finales en grupos mientras sigue la grabación.
+
+    Cada grupo de ~`group_chars` caracteres se envía al motor de formateo
+    en un hilo propio, sin frenar la transcripción; al cerrar se formatea
+    el resto y se devuelven las partes en orden.
+    """
+
+    def __init__(self, engine, group_chars=3000):
+        self.engine = engine
+        self.group_chars = group_chars
+        self.parts = []
+        self._group = []
+        self._chars = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name="formateo-en-vivo", daemon=True)
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            group = self._queue.get()
+            if group is None:
+                return
+            try:
+                part = self.engine.format_segments(group)
+            except Exception as e:
+                # Un grupo fallido queda crudo; el formateo normal puede rehacerlo
+                logger.error(f"Error formateando en vivo: {e}")
+                part = segments_to_text(group)
+            self.parts.append(part)
+            logger.info(f"✓ Grupo {len(self.parts)} formateado en vivo ({len(part)} caracteres)")
+
+    def add(self, segment):
+        self._group.append(segment)
+        self._chars += len(segment['text']) + 1
+        if self._chars >= self.group_chars:
+            self._queue.put(self._group)
+            self._group = []
+            self._chars = 0
+
+    def close(self):
+        """Formatea el último grupo y espera al hilo. Devuelve el texto formateado."""
+        if self._group:
+            self._queue.put(self._group)
+            self._group = []
+        self._queue.put(None)
+        self._thread.join()
+        return "\n\n".join(part for part in self.parts if part)
+
+
+def _create_formatter():
+    """Motor de formateo de FORMATTER (con FORMATTER_FALLBACK), o None si no hay ninguno."""
+    from format_engine import prepare_engine_from_env
+
+    fallback = os.environ.get('FORMATTER_FALLBACK', 'reglas').lower()
+    return prepare_engine_from_env(
+        os.environ.get('FORMATTER', 'ollama').lower(),
+        None if fallback == 'none' else fallback
+    )
+
+
+def _stop_on_sigterm(signum, frame):
+    # docker stop: cerrar la sesión igual que con Ctrl+C
+    raise KeyboardInterrupt
+
+
+def main():
+    """Función principal (CLI)."""
+    setup_logging('live')
+
+    parser = argparse.ArgumentParser(description="Transcripción en vivo con Whisper")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    escuchar = subparsers.add_parser('escuchar', help="Transcribe PCM de stdin, una tubería o una URL")
+    escuchar.add_argument('fuente', help="'-' (stdin), ruta de archivo/tubería o URL")
+    escuchar.add_argument('--ffmpeg', action='store_true',
+                          help="Decodificar la fuente con FFmpeg aunque no sea una URL")
+
+    simular = subparsers.add_parser('simular', help="Reproduce un audio a velocidad real como stream")
+    simular.add_argument('audio')
+    simular.add_argument('--velocidad', type=float, default=1.0, help="1 = tiempo real, 0 = sin esperas")
+
+    for sub in (escuchar, simular):
+        sub.add_argument('--nombre', help="Nombre base de la salida (por defecto en_vivo_<fecha>)")
+        sub.add_argument('--directorio', default=os.environ.get('OUTPUT_DIR', '/app/output'))
+        sub.add_argument('--formatear', action='store_true',
+                         help="Formatear los segmentos en grupos durante la grabación")
+        sub.add_argument('--vocabulario', help="Archivo de términos (uno por línea, ver vocabulary.py)")
+
+    args = parser.parse_args()
+
+    if args.comando == 'simular':
+        source = SimulatedSource(args.audio, speed=args.velocidad)
+        base_name = args.nombre or Path(args.audio).stem
+    else:
+        source = PcmSource(args.fuente, decode=True if args.ffmpeg else None)
+        base_name = args.nombre or f"en_vivo_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    from transcribe import AudioTranscriber
+
+    transcriber = AudioTranscriber(
+        model_name=os.environ.get('LIVE_WHISPER_MODEL') or os.environ.get('WHISPER_MODEL', 'base'),
+        language=os.environ.get('AUDIO_LANGUAGE', 'es'),
+        dialect=os.environ.get('AUDIO_DIALECT', 'es')
+    )
+    if not transcriber.load_model():
+        logger.error("No se pudo cargar el modelo. Terminando.")
+        return 1
+
+    formatter = None
+    if args.formatear:
+        formatter = _create_formatter()
+        if formatter is None:
+            logger.warning("⚠️  Ningún formateador disponible; solo se transcribe")
+
+    output = LiveOutput(
+        args.directorio, base_name, transcriber,
+        flush_seconds=float(os.environ.get('LIVE_FLUSH_SECONDS') or 30),
+        formatter=formatter,
+        format_chars=int(os.environ.get('LIVE_FORMAT_CHARS') or 3000)
+    )
+    prompter = None
+    if args.vocabulario:
+        prompter = VocabularyPrompter.from_env(Vocabulary.load([args.vocabulario]), transcriber.language)
+    live = LiveTranscriber.from_env(transcriber, on_segment=output.add, prompter=prompter)
+    signal.signal(signal.SIGTERM, _stop_on_sigterm)
+    logger.info(f"🎙️  Transcribiendo en vivo '{base_name}' (Ctrl+C para terminar)")
+    try:
+        with file_context(base_name):
+            live.run(source)
+            output.close()
+    finally:
+        if formatter:
+            formatter.release()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
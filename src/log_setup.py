@@ -0,0 +1,190 @@
+"""
+Configuración central de logging.
+
+Los módulos solo obtienen su logger (logging.getLogger(__name__)); cada
+punto de entrada llama una vez a setup_logging(). Los registros pasan por
+una cola (QueueHandler) y un hilo aparte (QueueListener) los escribe en
+consola y en /app/logs/<nombre>.log, así las etapas nunca esperan al disco.
+
+El archivo guarda un JSON por línea con el id de la ejecución (run_id), el
+archivo en proceso (file_id) y la etapa. Rota por tamaño y por día, y al
+iniciar cada ejecución, para no mezclar ejecuciones en un mismo archivo.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Etapa de cada módulo (para el nivel por etapa y el campo 'stage')
+STAGES = {
+    'transcripcion': ('transcribe', 'device_scheduler', 'preflight', 'autotune', 'diarize', 'words', 'segments',
+                      'live'),
+    'formateo': ('format_engine', 'format_ollama', 'format', 'format_rules', 'format_quality',
+                 'format_drift', 'ollama_client'),
+    'analisis': ('analyze_ollama',),
+}
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_current_file = contextvars.ContextVar('file_id', default=None)
+_listener = None
+_run_id = None
+
+
+def _stage_of(logger_name):
+    module = logger_name.split('.')[0]
+    for stage, modules in STAGES.items():
+        if module in modules:
+            return stage
+    return 'general'
+
+
+def run_id():
+    """Identificador de la ejecución (RUN_ID o fecha-hora + pid)."""
+    global _run_id
+    if _run_id is None:
+        _run_id = os.environ.get('RUN_ID') or f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    return _run_id
+
+
+@contextmanager
+def file_context(file_id):
+    """
+    Asocia los registros emitidos dentro del bloque a un archivo.
+
+    Usa una variable de contexto: cada tarea asyncio y cada hilo conserva
+    su propio archivo, aunque se procesen varios a la vez.
+    """
+    token = _current_file.set(str(file_id))
+    try:
+        yield
+    finally:
+        _current_file.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Agrega run_id, file_id y stage a cada registro (en el hilo que lo emite)."""
+
+    def filter(self, record):
+        record.run_id = run_id()
+        record.file_id = _current_file.get()
+        record.stage = _stage_of(record.name)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'stage': getattr(record, 'stage', None),
+            'run_id': getattr(record, 'run_id', None),
+            'file_id': getattr(record, 'file_id', None),
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SizedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Rota por tiempo (when/interval) o al superar max_bytes, lo que ocurra primero."""
+
+    def __init__(self, filename, max_bytes=0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            self.stream.seek(0, 2)
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+        return False
+
+    def rotation_filename(self, default_name):
+        # Varias rotaciones en el mismo periodo (por tamaño o por ejecución)
+        # no deben pisarse: se agrega un contador al nombre
+        name, counter = default_name, 1
+        while os.path.exists(name):
+            name = f"{default_name}.{counter}"
+            counter += 1
+        return name
+
+
+def _level(name, default):
+    return getattr(logging, os.environ.get(name, default).upper(), logging.INFO)
+
+
+def setup_logging(name):
+    """
+    Configura el logging del proceso (una sola vez; las llamadas siguientes no hacen nada).
+
+    Variables de entorno: LOG_DIR (por defecto /app/logs), LOG_NAME (nombre
+    del archivo, por defecto `name`), LOG_LEVEL y LOG_LEVEL_<ETAPA>
+    (TRANSCRIPCION, FORMATEO, ANALISIS), LOG_MAX_MB, LOG_ROTATE_WHEN y
+    LOG_BACKUPS.
+
+    Args:
+        name: Nombre del archivo de log del punto de entrada (ej: 'main')
+
+    Returns:
+        str: run_id de la ejecución
+    """
+    global _listener
+    if _listener is not None:
+        return run_id()
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    handlers = [console]
+
+    log_dir = Path(os.environ.get('LOG_DIR', '/app/logs'))
+    try:
+        log_dir.mkdir(parents=True, exist_ok=True)
+        log_path = log_dir / f"{os.environ.get('LOG_NAME', name)}.log"
+        file_handler = SizedTimedRotatingFileHandler(
+            log_path,
+            max_bytes=int(float(os.environ.get('LOG_MAX_MB', '20')) * 1024 * 1024),
+            when=os.environ.get('LOG_ROTATE_WHEN', 'midnight'),
+            backupCount=int(os.environ.get('LOG_BACKUPS', '10')),
+            encoding='utf-8',
+            delay=True
+        )
+        file_handler.setFormatter(JsonFormatter())
+        # Cada ejecución empieza en un archivo nuevo
+        if log_path.exists() and log_path.stat().st_size > 0:
+            file_handler.doRollover()
+        handlers.append(file_handler)
+    except OSError as e:
+        print(f"No se pudo abrir el log en {log_dir}: {e}", file=sys.stderr)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(_level('LOG_LEVEL', 'INFO'))
+    for stage, modules in STAGES.items():
+        level_var = f"LOG_LEVEL_{stage.upper()}"
+        if os.environ.get(level_var):
+            for module in modules:
+                logging.getLogger(module).setLevel(_level(level_var, 'INFO'))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    logging.getLogger(__name__).debug(f"Logging configurado (run_id={run_id()})")
+    return run_id()
@@ -0,0 +1,692 @@
+"""
+Cliente compartido para las llamadas a Ollama.
+Centraliza timeouts adaptativos (según tamaño del prompt y num_predict),
+reintentos con backoff exponencial y jitter, y un circuit breaker por host
+que pausa los envíos mientras Ollama está sobrecargado. Con varios hosts,
+reparte las peticiones por menor carga y retira/re-admite hosts caídos.
+También precalienta el modelo, lo fija en memoria con keep_alive y mide la
+evaluación de prompt.
+
+Las peticiones son asíncronas (httpx) y corren en un único event loop
+compartido, con semáforos global y por host; los métodos síncronos son
+envoltorios sobre ese loop.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import httpx
+import requests
+
+from artifacts import atomic_write
+
+logger = logging.getLogger(__name__)
+# httpx registra cada petición en INFO; con cientos de chunks satura el log
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Códigos HTTP que indican sobrecarga o falla transitoria (se reintentan)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class OllamaError(Exception):
+    """Error al llamar a Ollama tras agotar los reintentos."""
+
+
+class OllamaUnavailableError(OllamaError):
+    """Ollama sigue sobrecargado: el circuit breaker no permite más envíos."""
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _shared_loop():
+    """Event loop compartido del proceso (corre en un hilo daemon)."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="ollama-loop", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro):
+    """
+    Ejecuta una corrutina en el event loop compartido y espera su resultado.
+
+    Permite ofrecer métodos síncronos sobre la implementación asíncrona sin
+    crear un event loop (ni un cliente HTTP) por llamada.
+
+    Raises:
+        RuntimeError: Si se llama desde una corrutina del propio loop (usar await)
+    """
+    loop = _shared_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_sync() no puede llamarse desde el event loop compartido; usa await")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def parse_hosts(value):
+    """
+    Convierte una lista de endpoints de Ollama en una lista de URLs.
+
+    Args:
+        value: URL, lista de URLs o texto separado por comas/espacios
+
+    Returns:
+        list: URLs sin barra final
+    """
+    if isinstance(value, str):
+        value = value.replace(',', ' ').split()
+    return [url.rstrip('/') for url in value if url]
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de un host con tres estados: cerrado, abierto y semiabierto.
+
+    Tras `failure_threshold` fallos consecutivos se abre y el host deja de
+    recibir peticiones durante `cooldown` segundos; después se vuelve a
+    admitir (semiabierto) si su chequeo de salud responde.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0):
+        """
+        Args:
+            failure_threshold: Fallos consecutivos para abrir el circuito
+            cooldown: Segundos de pausa con el circuito abierto
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'cerrado'
+        self._failures = 0
+        self.opened_at = 0.0
+
+    @property
+    def retry_at(self):
+        """Instante (monotonic) a partir del cual se puede volver a probar."""
+        return self.opened_at + self.cooldown
+
+    def record_success(self):
+        self.state = 'cerrado'
+        self._failures = 0
+
+    def record_failure(self):
+        """
+        Registra un fallo.
+
+        Returns:
+            bool: True si el circuito acaba de abrirse
+        """
+        self._failures += 1
+        if self.state == 'semiabierto' or self._failures >= self.failure_threshold:
+            just_opened = self.state != 'abierto'
+            self.state = 'abierto'
+            self.opened_at = time.monotonic()
+            return just_opened
+        return False
+
+
+class OllamaHost:
+    """Estado de un endpoint de Ollama dentro del pool."""
+
+    def __init__(self, url, breaker):
+        self.url = url
+        self.breaker = breaker
+        self.outstanding = 0
+        self.checking = False
+
+    @property
+    def healthy(self):
+        return self.breaker.state != 'abierto'
+
+
+class OllamaHostPool:
+    """
+    Pool de endpoints de Ollama con balanceo por menor número de peticiones
+    en curso, chequeos de salud contra /api/tags y retiro/re-admisión
+    automática de hosts caídos o sobrecargados.
+
+    Si todos los hosts están abiertos, los envíos se pausan hasta que alguno
+    sea re-admitido (o hasta `max_wait`). El estado se protege con un lock
+    que nunca se mantiene durante un await, así que el pool puede usarse
+    desde el event loop y desde los hilos de chequeo de salud.
+    """
+
+    def __init__(self, urls, failure_threshold=3, cooldown=30.0, max_wait=300.0, session=None):
+        """
+        Args:
+            urls: Lista de URLs de Ollama
+            failure_threshold: Fallos consecutivos para retirar un host
+            cooldown: Segundos antes de volver a chequear un host retirado
+            max_wait: Máximo de segundos que un envío espera si no hay hosts sanos
+            session: requests.Session para los chequeos de salud
+        """
+        urls = parse_hosts(urls)
+        if not urls:
+            raise ValueError("Se requiere al menos un host de Ollama")
+        self.hosts = [OllamaHost(url, CircuitBreaker(failure_threshold, cooldown)) for url in urls]
+        self.max_wait = max_wait
+        self.session = session or requests.Session()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def check_health(self, host):
+        """Consulta /api/tags de un host."""
+        try:
+            return self.session.get(f"{host.url}/api/tags", timeout=5).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _readmit(self, host):
+        """Chequeo de salud en segundo plano de un host retirado."""
+        ok = self.check_health(host)
+        with self._lock:
+            host.checking = False
+            if ok:
+                host.breaker.state = 'semiabierto'
+                logger.info(f"✓ Ollama {host.url} respondió al chequeo de salud, re-admitido")
+            else:
+                host.breaker.opened_at = time.monotonic()
+
+    def _schedule_checks(self, now):
+        """Lanza chequeos de salud de los hosts retirados cuyo cooldown venció."""
+        for host in self.hosts:
+            if not host.healthy and not host.checking and now >= host.breaker.retry_at:
+                host.checking = True
+                threading.Thread(target=self._readmit, args=(host,), daemon=True).start()
+
+    async def acquire(self, avoid=()):
+        """
+        Elige el host sano con menos peticiones en curso.
+
+        Args:
+            avoid: URLs que ya fallaron para esta petición; se evitan si
+                queda otro host sano
+
+        Returns:
+            OllamaHost: Host reservado (liberar con release())
+
+        Raises:
+            OllamaUnavailableError: Si ningún host vuelve a estar sano en max_wait
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._schedule_checks(now)
+                healthy = [h for h in self.hosts if h.healthy]
+                healthy = [h for h in healthy if h.url not in avoid] or healthy
+                if healthy:
+                    host = min(healthy, key=lambda h: h.outstanding)
+                    host.outstanding += 1
+                    return host
+                next_retry = min(h.breaker.retry_at for h in self.hosts)
+            if now >= deadline:
+                raise OllamaUnavailableError(
+                    f"Ollama sobrecargado: ningún host disponible por más de {self.max_wait:.0f}s"
+                )
+            await asyncio.sleep(min(max(min(deadline, next_retry) - now, 0.1), 0.5))
+
+    def release(self, host, ok):
+        """
+        Libera un host reservado y registra el resultado de la petición.
+
+        Args:
+            host: Host devuelto por acquire()
+            ok: True si la petición tuvo éxito (o falló por un error del cliente)
+        """
+        with self._lock:
+            host.outstanding -= 1
+            if ok:
+                host.breaker.record_success()
+            elif host.breaker.record_failure():
+                healthy = sum(1 for h in self.hosts if h.healthy)
+                logger.warning(
+                    f"⚠️  Ollama {host.url} sobrecargado o caído, retirado por "
+                    f"{host.breaker.cooldown:.0f}s ({healthy}/{len(self.hosts)} hosts sanos)"
+                )
+
+
+class OllamaClient:
+    """Cliente HTTP de Ollama con timeouts adaptativos, reintentos y balanceo entre hosts."""
+
+    def __init__(self, ollama_host='http://ollama:11434', max_retries=3, backoff_base=2.0,
+                 backoff_max=60.0, base_timeout=30.0, prompt_chars_per_second=200.0,
+                 tokens_per_second=5.0, pool=None, keep_alive=None, per_host_concurrency=2,
+                 max_in_flight=None):
+        """
+        Inicializa el cliente.
+
+        Args:
+            ollama_host: URL de Ollama o lista de URLs (también 'url1,url2')
+            max_retries: Reintentos tras el primer intento fallido
+            backoff_base: Espera base (segundos) del backoff exponencial
+            backoff_max: Espera máxima entre reintentos
+            base_timeout: Timeout fijo mínimo de lectura (segundos)
+            prompt_chars_per_second: Velocidad estimada de evaluación del prompt
+            tokens_per_second: Velocidad estimada de generación (peor caso CPU)
+            pool: OllamaHostPool compartido (se crea uno si no se indica)
+            keep_alive: Tiempo que Ollama mantiene el modelo cargado tras cada
+                petición (ej: '30m'); None usa el valor por defecto de Ollama
+            per_host_concurrency: Peticiones simultáneas por host (con 2, Ollama
+                tiene siempre la siguiente petición en cola al terminar una)
+            max_in_flight: Peticiones simultáneas en total (None = por host × hosts)
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.base_timeout = base_timeout
+        self.prompt_chars_per_second = prompt_chars_per_second
+        self.tokens_per_second = tokens_per_second
+        self.session = requests.Session()
+        self.pool = pool or OllamaHostPool(ollama_host, session=self.session)
+        self.keep_alive = keep_alive
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        self.max_in_flight = max_in_flight or self.per_host_concurrency * len(self.pool)
+        self.stats = PromptEvalStats()
+        self._loop_state = None
+
+    @property
+    def hosts(self):
+        """URLs de todos los hosts del pool."""
+        return [host.url for host in self.pool.hosts]
+
+    def _state(self):
+        """
+        Cliente httpx y semáforos del event loop en curso.
+
+        Se crean dentro del loop que los usa (y se recrean si cambia), porque
+        ambos quedan ligados a ese loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop_state is None or self._loop_state[0] is not loop:
+            http = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.max_in_flight,
+                max_keepalive_connections=self.max_in_flight
+            ))
+            slots = asyncio.Semaphore(self.max_in_flight)
+            host_slots = {url: asyncio.Semaphore(self.per_host_concurrency) for url in self.hosts}
+            self._loop_state = (loop, http, slots, host_slots)
+        return self._loop_state[1:]
+
+    def set_concurrency(self, per_host_concurrency):
+        """
+        Cambia las peticiones simultáneas por host (y el total en curso).
+
+        Los semáforos y el cliente httpx se recrean en la próxima petición.
+        """
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        self.max_in_flight = self.per_host_concurrency * len(self.pool)
+        if self._loop_state is not None:
+            loop, http = self._loop_state[:2]
+            self._loop_state = None
+            if loop is _shared_loop():
+                run_sync(http.aclose())
+
+    def compute_timeout(self, prompt, num_predict):
+        """
+        Calcula el timeout (conexión, lectura) según el tamaño de la petición.
+
+        Args:
+            prompt: Texto del prompt
+            num_predict: Tokens máximos a generar (None = estimación de 1024)
+
+        Returns:
+            tuple: (timeout de conexión, timeout de lectura) en segundos
+        """
+        read_timeout = (
+            self.base_timeout
+            + len(prompt) / self.prompt_chars_per_second
+            + (num_predict or 1024) / self.tokens_per_second
+        )
+        return (10.0, read_timeout)
+
+    def _backoff(self, attempt):
+        """Espera exponencial con jitter completo."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    async def _post(self, host, payload, timeout):
+        """
+        Envía una petición a un host concreto, respetando su semáforo.
+
+        Returns:
+            tuple: (respuesta JSON o None, error o None, reintentable)
+        """
+        http, _, host_slots = self._state()
+        connect_timeout, read_timeout = timeout
+        try:
+            async with host_slots[host.url]:
+                response = await http.post(
+                    f"{host.url}/api/generate",
+                    json=payload,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                )
+            if response.status_code == 200:
+                return response.json(), None, False
+            error = OllamaError(f"{host.url} HTTP {response.status_code}: {response.text[:200]}")
+            return None, error, response.status_code in RETRYABLE_STATUS
+        except (httpx.HTTPError, ValueError) as e:
+            # Conexión rechazada, timeout o respuesta truncada/no JSON
+            return None, e, True
+
+    async def generate_async(self, prompt, model, options=None, timeout=None, host=None,
+                             record_stats=True, **extra):
+        """
+        Llama a /api/generate (sin streaming) con reintentos.
+
+        Args:
+            prompt: Prompt a enviar
+            model: Modelo de Ollama
+            options: Opciones del modelo (temperature, num_predict, ...)
+            timeout: Timeout (conexión, lectura) fijo; None lo calcula según la petición
+            host: OllamaHost concreto (None = el que elija el balanceador)
+            record_stats: Contar la llamada en self.stats (False en mediciones)
+            **extra: Campos adicionales del payload (system, keep_alive, ...)
+
+        Returns:
+            dict: Respuesta JSON de Ollama
+
+        Raises:
+            OllamaError: Si todos los intentos fallan
+        """
+        options = options or {}
+        payload = {"model": model, "prompt": prompt, "stream": False, "options": options, **extra}
+        if self.keep_alive is not None:
+            payload.setdefault("keep_alive", self.keep_alive)
+        timeout = timeout or self.compute_timeout(prompt, options.get('num_predict'))
+        _, slots, _ = self._state()
+        last_error = None
+        failed_hosts = set()
+
+        for attempt in range(self.max_retries + 1):
+            async with slots:
+                if host is None:
+                    target = await self.pool.acquire(avoid=failed_hosts)
+                    result, retryable = None, True
+                    try:
+                        result, last_error, retryable = await self._post(target, payload, timeout)
+                    finally:
+                        # Un error del cliente (ej: modelo inexistente) no indica un host caído
+                        self.pool.release(target, ok=result is not None or not retryable)
+                    if result is None:
+                        failed_hosts.add(target.url)
+                else:
+                    target = host
+                    result, last_error, retryable = await self._post(host, payload, timeout)
+
+            if result is not None:
+                if record_stats:
+                    self.stats.record(result, model, extra.get('system'), target.url)
+                return result
+            if not retryable:
+                raise last_error
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                logger.warning(
+                    f"  Ollama falló ({last_error}), reintento {attempt + 1}/{self.max_retries} "
+                    f"en {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+        raise OllamaError(f"Ollama falló tras {self.max_retries + 1} intentos: {last_error}")
+
+    def generate(self, prompt, model, options=None, timeout=None, host=None, record_stats=True, **extra):
+        """Versión síncrona de generate_async()."""
+        return run_sync(self.generate_async(prompt, model, options, timeout, host, record_stats, **extra))
+
+    async def _warm_up_host(self, host, model, system):
+        start = time.monotonic()
+        extra = {"system": system} if system else {}
+        try:
+            # La primera petición incluye la carga del modelo en memoria
+            result = await self.generate_async(".", model=model, options={"num_predict": 1},
+                                               timeout=(10.0, 600.0), host=host, **extra)
+        except OllamaError as e:
+            logger.warning(f"No se pudo precalentar el modelo {model} en {host.url}: {e}")
+            return False
+        if system:
+            self.stats.set_prefix(result, model, system, host.url)
+        logger.info(f"✓ Modelo {model} cargado y fijado en memoria en {host.url} "
+                    f"(keep_alive={self.keep_alive or 'por defecto'}, {time.monotonic() - start:.1f}s)")
+        return True
+
+    async def warm_up_async(self, model, system=None):
+        """
+        Carga el modelo en cada host antes de empezar la cola y precalienta el prefijo.
+
+        Con un system prompt, Ollama evalúa ese prefijo una vez y lo reutiliza
+        (caché KV) en las peticiones siguientes que comparten el mismo prefijo.
+        Los hosts se precalientan en paralelo.
+
+        Args:
+            model: Modelo de Ollama
+            system: System prompt compartido por las peticiones del lote
+
+        Returns:
+            bool: True si el modelo quedó cargado en al menos un host
+        """
+        loaded = await asyncio.gather(*(self._warm_up_host(host, model, system) for host in self.pool.hosts))
+        return any(loaded)
+
+    def warm_up(self, model, system=None):
+        """Versión síncrona de warm_up_async()."""
+        return run_sync(self.warm_up_async(model, system))
+
+    async def release_async(self, model, keep_alive='5m'):
+        """
+        Devuelve el modelo al keep_alive normal al terminar el lote.
+
+        Args:
+            model: Modelo de Ollama
+            keep_alive: Nuevo tiempo de permanencia ('0' lo descarga ya)
+        """
+        http, _, _ = self._state()
+
+        async def release_host(host):
+            try:
+                await http.post(
+                    f"{host.url}/api/generate",
+                    json={"model": model, "prompt": "", "keep_alive": keep_alive},
+                    timeout=httpx.Timeout(60.0, connect=10.0)
+                )
+            except httpx.HTTPError as e:
+                logger.debug(f"No se pudo liberar el modelo {model} en {host.url}: {e}")
+
+        await asyncio.gather(*(release_host(host) for host in self.pool.hosts))
+
+    def release(self, model, keep_alive='5m'):
+        """Versión síncrona de release_async()."""
+        run_sync(self.release_async(model, keep_alive))
+
+
+async def stream_ordered(fn, items, limit):
+    """
+    Aplica la corrutina `fn` a cada elemento con hasta `limit` en curso y
+    entrega los resultados a medida que terminan, en el orden de entrada.
+
+    Consume `items` de forma perezosa: en memoria hay como máximo `limit`
+    elementos pendientes, así sirve para flujos de tamaño arbitrario. La
+    concurrencia real hacia Ollama la acotan además los semáforos del cliente.
+
+    Yields:
+        Resultado de fn(item) para cada elemento, en orden
+    """
+    limit = max(1, limit)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(fn(item)))
+            if len(pending) >= limit:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def map_ordered(fn, items, limit):
+    """
+    Como stream_ordered(), pero devuelve todos los resultados en una lista.
+
+    Returns:
+        list: Resultado de fn(item) para cada elemento, en orden
+    """
+    return [result async for result in stream_ordered(fn, items, limit)]
+
+
+class PromptEvalStats:
+    """
+    Acumula las métricas de evaluación de prompt que devuelve Ollama
+    (prompt_eval_count / prompt_eval_duration) por modelo y system prompt, y
+    estima el ahorro por reutilizar el prefijo precalentado.
+
+    Solo cuentan como ahorro las llamadas con el mismo modelo y system
+    prompt, en el mismo host, que un precalentamiento anterior.
+    """
+
+    def __init__(self):
+        # (modelo, system) -> métricas acumuladas
+        self._prompts = {}
+        # (modelo, system, host) -> (tokens del prefijo, segundos por token)
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def record(self, result, model, system=None, host=None):
+        """Registra una llamada servida por `host` (URL)."""
+        system = system or ''
+        with self._lock:
+            entry = self._prompts.setdefault((model, system), {
+                'llamadas': 0, 'tokens_prompt': 0, 'segundos_prompt': 0.0,
+                'tokens_ahorrados': 0, 'segundos_ahorrados': 0.0,
+            })
+            entry['llamadas'] += 1
+            entry['tokens_prompt'] += result.get('prompt_eval_count', 0)
+            entry['segundos_prompt'] += result.get('prompt_eval_duration', 0) / 1e9
+            prefix = self._prefixes.get((model, system, host))
+            if prefix:
+                entry['tokens_ahorrados'] += prefix[0]
+                entry['segundos_ahorrados'] += prefix[0] * prefix[1]
+
+    def set_prefix(self, result, model, system, host):
+        """Registra el tamaño del prefijo medido en el precalentamiento de un host."""
+        count = result.get('prompt_eval_count', 0)
+        if count:
+            with self._lock:
+                self._prefixes[(model, system or '', host)] = (
+                    count, result.get('prompt_eval_duration', 0) / 1e9 / count
+                )
+
+    def report(self, model=None, systems=None):
+        """
+        Registra en el log el tiempo de evaluación de prompt y el ahorro estimado.
+
+        Las llamadas informadas se descartan: con un cliente compartido
+        (formateo y análisis), cada etapa informa solo las suyas.
+
+        Args:
+            model: Solo las llamadas a este modelo (None = todas)
+            systems: Solo las llamadas con estos system prompts (None = todas)
+
+        Returns:
+            dict: Métricas acumuladas
+        """
+        totals = {'llamadas': 0, 'tokens_prompt': 0, 'segundos_prompt': 0.0,
+                  'tokens_ahorrados': 0, 'segundos_ahorrados': 0.0}
+        with self._lock:
+            keys = [
+                key for key in self._prompts
+                if (model is None or key[0] == model)
+                and (systems is None or key[1] in {system or '' for system in systems})
+            ]
+            for key in keys:
+                for name, value in self._prompts.pop(key).items():
+                    totals[name] += value
+        if not totals['llamadas']:
+            return totals
+        logger.info(
+            f"📊 Evaluación de prompt: {totals['tokens_prompt']} tokens en {totals['segundos_prompt']:.1f}s "
+            f"({totals['llamadas']} llamadas)"
+        )
+        if totals['tokens_ahorrados']:
+            logger.info(
+                f"📊 Prefijo reutilizado: ~{totals['tokens_ahorrados']} tokens y "
+                f"~{totals['segundos_ahorrados']:.1f}s de evaluación ahorrados"
+            )
+        return totals
+
+
+class ChunkCheckpoint:
+    """
+    Registro de chunks formateados y fallidos de un archivo.
+
+    Se guarda junto a la salida para que una ejecución posterior reutilice
+    los chunks ya formateados y reintente solo los que fallaron.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Ruta del archivo de checkpoint (JSON)
+        """
+        self.path = Path(path)
+        self.done = {}
+        self.failed = set()
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding='utf-8'))
+                self.done = data.get('formateados', {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Checkpoint ilegible, se ignora ({self.path.name}): {e}")
+
+    @staticmethod
+    def for_output(output_path):
+        """Checkpoint asociado a un archivo de salida."""
+        output_path = Path(output_path)
+        return ChunkCheckpoint(output_path.parent / f".{output_path.name}.pendiente.json")
+
+    @staticmethod
+    def key(chunk):
+        return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+    def get(self, chunk):
+        """Devuelve el chunk ya formateado en una ejecución previa (o None)."""
+        return self.done.get(self.key(chunk))
+
+    def record_success(self, chunk, formatted):
+        self.done[self.key(chunk)] = formatted
+
+    def record_failure(self, chunk):
+        self.failed.add(self.key(chunk))
+
+    def save(self):
+        """
+        Persiste el checkpoint si quedaron chunks fallidos; si no, lo elimina.
+
+        Returns:
+            int: Número de chunks fallidos pendientes
+        """
+        if not self.failed:
+            self.path.unlink(missing_ok=True)
+            return 0
+        atomic_write(
+            self.path,
+            json.dumps({'formateados': self.done, 'fallidos': sorted(self.failed)}, ensure_ascii=False)
+        )
+        return len(self.failed)
@@ -0,0 +1,250 @@
+"""
+Organización de los archivos de salida.
+
+- plano (por defecto): todos los archivos en output/, como siempre.
+- particionado: cada audio tiene su carpeta output/<xx>/<nombre>/, donde
+  <xx> son los dos primeros caracteres hexadecimales del SHA-1 del nombre
+  (256 grupos). Con decenas de miles de audios ningún directorio crece
+  demasiado, y las etapas encuentran los archivos a través de un índice
+  SQLite (output/.indice_salida.sqlite) en lugar de listar el directorio.
+
+Uso como CLI:
+    python src/output_layout.py migrar [directorio]     # plano -> particionado
+    python src/output_layout.py reindexar [directorio]  # reconstruye el índice
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+from artifacts import adopt_existing, marker_path
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = ".indice_salida.sqlite"
+TRANSCRIPT_SUFFIX = "_transcripcion.txt"
+FORMATTED_SUFFIX = "_transcripcion_formateado.txt"
+ARCHIVE_SUFFIX = "_archivo.zip"
+CHECKPOINT_SUFFIX = ".pendiente.json"
+# Sufijos de los archivos de cada audio (el más largo primero, para deducir
+# el nombre base sin ambigüedad)
+ARTIFACT_SUFFIXES = sorted((
+    TRANSCRIPT_SUFFIX,
+    FORMATTED_SUFFIX,
+    "_transcripcion_detallada.txt",
+    "_transcripcion.srt",
+    "_transcripcion.vtt",
+    "_segmentos.jsonl",
+    "_resumen.txt",
+    "_puntos_clave.txt",
+    "_temas.txt",
+    "_palabras",
+    ARCHIVE_SUFFIX,
+), key=len, reverse=True)
+
+
+def base_name_of(name):
+    """Nombre base del audio de un archivo de salida (None si no es un artefacto conocido)."""
+    for suffix in ARTIFACT_SUFFIXES:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+class FlatLayout:
+    """Todos los archivos de salida en el mismo directorio."""
+
+    name = 'plano'
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+
+    def audio_dir(self, base_name):
+        """Directorio de los archivos de salida de un audio."""
+        return self.output_dir
+
+    def path(self, base_name, suffix):
+        """Ruta de un archivo de salida (ej: path('clase1', '_resumen.txt'))."""
+        return self.audio_dir(base_name) / f"{base_name}{suffix}"
+
+    def register(self, base_name):
+        """Registra un audio en el índice (sin efecto en el formato plano)."""
+
+    def files(self, suffix):
+        """Archivos de salida existentes con un sufijo."""
+        if not self.output_dir.exists():
+            return []
+        return sorted(self.output_dir.glob(f"*{suffix}"))
+
+    def dirs(self):
+        """Directorios que contienen archivos de salida."""
+        return [self.output_dir] if self.output_dir.exists() else []
+
+
+class ShardedLayout(FlatLayout):
+    """Una carpeta por audio, agrupadas por prefijo de hash, con índice SQLite."""
+
+    name = 'particionado'
+
+    def __init__(self, output_dir):
+        super().__init__(output_dir)
+        self.index_path = self.output_dir / INDEX_NAME
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS audios (nombre TEXT PRIMARY KEY, directorio TEXT, fecha TEXT)"
+            )
+
+    def _connect(self):
+        # Una conexión por operación: varios procesos (workers) comparten el índice
+        return closing(sqlite3.connect(self.index_path, timeout=30, isolation_level=None))
+
+    @staticmethod
+    def bucket(base_name):
+        return hashlib.sha1(base_name.encode('utf-8')).hexdigest()[:2]
+
+    def audio_dir(self, base_name):
+        return self.output_dir / self.bucket(base_name) / base_name
+
+    def register(self, base_name):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO audios (nombre, directorio, fecha) VALUES (?, ?, ?)",
+                (base_name, str(self.audio_dir(base_name).relative_to(self.output_dir)),
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+
+    def audios(self):
+        """Nombres base de los audios registrados."""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT nombre FROM audios ORDER BY nombre")]
+
+    def files(self, suffix):
+        return [path for path in (self.path(base, suffix) for base in self.audios()) if path.exists()]
+
+    def dirs(self):
+        return [path for path in (self.audio_dir(base) for base in self.audios()) if path.is_dir()]
+
+    def has_flat_files(self):
+        """Indica si quedan transcripciones en formato plano en la raíz."""
+        return next(self.output_dir.glob(f"*{TRANSCRIPT_SUFFIX}"), None) is not None
+
+    def reindex(self):
+        """
+        Reconstruye el índice recorriendo las carpetas de los grupos.
+
+        Returns:
+            int: Audios registrados
+        """
+        count = 0
+        for bucket in sorted(self.output_dir.iterdir()):
+            if not bucket.is_dir() or len(bucket.name) != 2 or bucket.name.startswith('.'):
+                continue
+            for audio_dir in bucket.iterdir():
+                if audio_dir.is_dir() and self.bucket(audio_dir.name) == bucket.name:
+                    self.register(audio_dir.name)
+                    count += 1
+        return count
+
+
+def _move(source, target):
+    """Mueve un archivo o carpeta (False si ya no existe, p. ej. lo movió otro worker)."""
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, target)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def migrate(output_dir):
+    """
+    Mueve los archivos de salida del formato plano al particionado.
+
+    Cada archivo se mueve con su marca de completitud, y los checkpoints de
+    formateo pendientes también; los archivos que no son de un audio (índices, estado) quedan
+    en la raíz. Se puede interrumpir y repetir.
+
+    Returns:
+        int: Archivos movidos
+    """
+    # Los archivos sin marca de versiones anteriores se registran antes de moverlos
+    adopt_existing(output_dir)
+    layout = ShardedLayout(output_dir)
+    moved = 0
+    registered = set()
+    for entry in sorted(layout.output_dir.iterdir()):
+        if entry.name.startswith('.') and entry.name.endswith(CHECKPOINT_SUFFIX):
+            # Checkpoint de formateo ('.<archivo>.pendiente.json')
+            base_name = base_name_of(entry.name[1:-len(CHECKPOINT_SUFFIX)])
+        elif entry.name.startswith('.'):
+            continue
+        else:
+            base_name = base_name_of(entry.name)
+        if base_name is None:
+            continue
+        if base_name not in registered:
+            layout.register(base_name)
+            registered.add(base_name)
+        target = layout.audio_dir(base_name) / entry.name
+        if not _move(entry, target):
+            continue
+        moved += 1
+        if target.is_file():
+            _move(marker_path(entry), marker_path(target))
+    if moved:
+        logger.info(f"✓ {moved} archivo(s) de {len(registered)} audio(s) movidos al formato particionado")
+    return moved
+
+
+def create_layout_from_env(output_dir):
+    """
+    Crea la organización de salida según OUTPUT_LAYOUT ('plano' o 'particionado').
+
+    Con 'particionado', si aún hay transcripciones en formato plano en la
+    raíz se migran antes de continuar.
+    """
+    name = os.environ.get('OUTPUT_LAYOUT', 'plano').lower()
+    if name == 'plano':
+        return FlatLayout(output_dir)
+    if name != 'particionado':
+        raise ValueError(f"OUTPUT_LAYOUT inválido: {name} (plano o particionado)")
+    layout = ShardedLayout(output_dir)
+    if layout.has_flat_files():
+        logger.warning("⚠️  Hay archivos en formato plano en la salida; migrando al formato particionado...")
+        migrate(output_dir)
+    return layout
+
+
+def main():
+    """Función principal (CLI)."""
+    setup_logging('output_layout')
+
+    parser = argparse.ArgumentParser(description="Organización de los archivos de salida")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    default_dir = os.environ.get('OUTPUT_DIR', '/app/output')
+
+    migrar = subparsers.add_parser('migrar', help="Mueve la salida plana a carpetas por audio")
+    migrar.add_argument('directorio', nargs='?', default=default_dir)
+
+    reindexar = subparsers.add_parser('reindexar', help="Reconstruye el índice de la salida particionada")
+    reindexar.add_argument('directorio', nargs='?', default=default_dir)
+
+    args = parser.parse_args()
+
+    if args.comando == 'migrar':
+        moved = migrate(args.directorio)
+        print(f"{moved} archivo(s) movidos. Usa OUTPUT_LAYOUT=particionado en las próximas ejecuciones.")
+    else:
+        count = ShardedLayout(args.directorio).reindex()
+        print(f"{count} audio(s) en el índice.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
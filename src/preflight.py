@@ -0,0 +1,331 @@
+"""
+Verificación previa de los audios de entrada, antes de cargar Whisper.
+
+Consulta en paralelo la duración, el códec, la frecuencia de muestreo y los
+canales de cada archivo (ffprobe, o la cabecera en archivos WAV si ffprobe
+no está instalado) y mide el volumen RMS de unos segundos al inicio, al
+medio y al final para detectar archivos en silencio (si las tres muestras
+están en silencio, se recorre el audio completo antes de descartarlo, por
+si solo cayeron en pausas). Los archivos vacíos,
+corruptos o en silencio se omiten o se mueven a cuarentena, y las
+duraciones quedan en output/.preflight.json para planificar el orden de
+procesamiento y estimar tiempos. Los archivos que no cambiaron (tamaño y
+fecha) no se vuelven a verificar.
+"""
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from artifacts import atomic_write
+
+logger = logging.getLogger(__name__)
+
+REPORT_NAME = ".preflight.json"
+QUARANTINE_DIR = "cuarentena"
+SAMPLE_RATE = 16000
+# Segundos de cada muestra de volumen (inicio, medio y final)
+RMS_SAMPLE_SECONDS = 5.0
+# Frecuencia del recorrido completo (suficiente para medir volumen)
+SCAN_SAMPLE_RATE = 8000
+
+
+def _run(command, timeout=60):
+    return subprocess.run(command, capture_output=True, timeout=timeout, check=True).stdout
+
+
+def _rms_db(samples):
+    """Volumen RMS en dBFS de muestras int16 (-inf si no hay señal)."""
+    if not len(samples):
+        return -math.inf
+    rms = np.sqrt(np.mean(np.square(samples.astype(np.float64) / 32768.0)))
+    return 20 * math.log10(rms) if rms > 0 else -math.inf
+
+
+def _sample_offsets(duration):
+    """Inicio de las muestras de volumen: inicio, medio y final del audio."""
+    if not duration or duration <= 3 * RMS_SAMPLE_SECONDS:
+        return [0.0]
+    return [0.0, (duration - RMS_SAMPLE_SECONDS) / 2, duration - RMS_SAMPLE_SECONDS]
+
+
+def probe_ffprobe(path):
+    """
+    Lee duración, códec, frecuencia y canales con ffprobe.
+
+    Raises:
+        subprocess.CalledProcessError: Si ffprobe no puede leer el archivo
+    """
+    info = json.loads(_run([
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_format', '-show_streams', '-select_streams', 'a:0', str(path)
+    ]))
+    streams = info.get('streams') or []
+    if not streams:
+        raise ValueError("sin pista de audio")
+    stream = streams[0]
+    duration = stream.get('duration') or info.get('format', {}).get('duration')
+    return {
+        'duracion': float(duration) if duration else None,
+        'codec': stream.get('codec_name'),
+        'sample_rate': int(stream.get('sample_rate') or 0),
+        'canales': int(stream.get('channels') or 0),
+    }
+
+
+def sample_rms_ffmpeg(path, duration):
+    """Volumen RMS máximo (dBFS) entre las muestras decodificadas con ffmpeg."""
+    levels = []
+    for offset in _sample_offsets(duration):
+        raw = _run([
+            'ffmpeg', '-v', 'error', '-ss', f"{offset:.2f}", '-t', str(RMS_SAMPLE_SECONDS),
+            '-i', str(path), '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-'
+        ])
+        levels.append(_rms_db(np.frombuffer(raw, dtype=np.int16)))
+    return max(levels)
+
+
+def scan_rms_ffmpeg(path, stop_db):
+    """
+    Volumen RMS máximo (dBFS) entre ventanas de RMS_SAMPLE_SECONDS de todo el audio.
+
+    Decodifica en un solo proceso de ffmpeg y se detiene en la primera
+    ventana con volumen >= stop_db.
+    """
+    window = int(RMS_SAMPLE_SECONDS * SCAN_SAMPLE_RATE) * 2
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-i', str(path), '-ac', '1', '-ar', str(SCAN_SAMPLE_RATE),
+         '-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    level = -math.inf
+    try:
+        while level < stop_db:
+            raw = process.stdout.read(window)
+            if not raw:
+                break
+            level = max(level, _rms_db(np.frombuffer(raw[:len(raw) // 2 * 2], dtype=np.int16)))
+    finally:
+        process.kill()
+        process.wait()
+    return level
+
+
+def probe_wav(path):
+    """Lee duración, frecuencia y canales de la cabecera de un WAV (sin ffprobe)."""
+    with wave.open(str(path), 'rb') as audio:
+        rate = audio.getframerate()
+        return {
+            'duracion': audio.getnframes() / rate if rate else None,
+            'codec': f"pcm_s{8 * audio.getsampwidth()}le",
+            'sample_rate': rate,
+            'canales': audio.getnchannels(),
+        }
+
+
+def sample_rms_wav(path, duration):
+    """Volumen RMS máximo (dBFS) entre muestras leídas directamente de un WAV de 16 bits."""
+    levels = []
+    with wave.open(str(path), 'rb') as audio:
+        if audio.getsampwidth() != 2:
+            return None
+        rate, channels = audio.getframerate(), audio.getnchannels()
+        for offset in _sample_offsets(duration):
+            audio.setpos(int(offset * rate))
+            raw = audio.readframes(int(RMS_SAMPLE_SECONDS * rate))
+            levels.append(_rms_db(np.frombuffer(raw, dtype=np.int16)[::channels]))
+    return max(levels)
+
+
+def scan_rms_wav(path, stop_db):
+    """Como scan_rms_ffmpeg(), leyendo directamente un WAV de 16 bits."""
+    level = -math.inf
+    with wave.open(str(path), 'rb') as audio:
+        if audio.getsampwidth() != 2:
+            return None
+        rate, channels = audio.getframerate(), audio.getnchannels()
+        while level < stop_db:
+            raw = audio.readframes(int(RMS_SAMPLE_SECONDS * rate))
+            if not raw:
+                break
+            level = max(level, _rms_db(np.frombuffer(raw, dtype=np.int16)[::channels]))
+    return level
+
+
+def read_durations(output_dir):
+    """
+    Duraciones verificadas en la última ejecución.
+
+    Returns:
+        dict: Nombre del audio -> duración en segundos (None si se desconoce)
+    """
+    try:
+        results = json.loads((Path(output_dir) / REPORT_NAME).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    return {name: entry.get('duracion') for name, entry in results.items()}
+
+
+class Preflight:
+    """Verifica una carpeta de audios y decide cuáles se transcriben."""
+
+    def __init__(self, report_path, action='omitir', silence_db=-50.0, min_duration=0.5, workers=8):
+        """
+        Args:
+            report_path: Archivo JSON con los resultados (y caché entre ejecuciones)
+            action: Qué hacer con los archivos inválidos: 'omitir' o
+                'cuarentena' (moverlos a <entrada>/cuarentena/)
+            silence_db: Volumen RMS (dBFS) por debajo del cual el audio se
+                considera silencio
+            min_duration: Duración mínima (segundos) de un audio válido
+            workers: Archivos verificados en paralelo
+        """
+        self.report_path = Path(report_path)
+        self.action = action
+        self.silence_db = silence_db
+        self.min_duration = min_duration
+        self.workers = workers
+        self.use_ffprobe = shutil.which('ffprobe') is not None and shutil.which('ffmpeg') is not None
+        self.results = {}
+        if self.report_path.exists():
+            try:
+                self.results = json.loads(self.report_path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Reporte de verificación ilegible, se regenera: {e}")
+
+    @classmethod
+    def from_env(cls, output_dir):
+        """Crea el verificador desde PREFLIGHT y PREFLIGHT_SILENCE_DB (None si PREFLIGHT=off)."""
+        action = os.environ.get('PREFLIGHT', 'omitir').lower()
+        if action == 'off':
+            return None
+        if action not in ('omitir', 'cuarentena'):
+            raise ValueError(f"PREFLIGHT inválido: {action} (omitir, cuarentena u off)")
+        return cls(
+            Path(output_dir) / REPORT_NAME,
+            action=action,
+            silence_db=float(os.environ.get('PREFLIGHT_SILENCE_DB', '-50'))
+        )
+
+    def check_file(self, path):
+        """
+        Verifica un archivo de audio.
+
+        Returns:
+            dict: 'duracion', 'codec', 'sample_rate', 'canales', 'rms_db',
+                'estado' ('ok', 'vacio', 'corrupto', 'silencio' o
+                'sin_verificar'), 'motivo', y 'tamano'/'mtime' para la caché
+        """
+        path = Path(path)
+        stat = path.stat()
+        entry = {'tamano': stat.st_size, 'mtime': stat.st_mtime, 'duracion': None, 'rms_db': None}
+
+        if stat.st_size == 0:
+            return dict(entry, estado='vacio', motivo="archivo de 0 bytes")
+
+        if self.use_ffprobe:
+            probe, sample_rms, scan_rms = probe_ffprobe, sample_rms_ffmpeg, scan_rms_ffmpeg
+        elif path.suffix.lower() == '.wav':
+            probe, sample_rms, scan_rms = probe_wav, sample_rms_wav, scan_rms_wav
+        else:
+            return dict(entry, estado='sin_verificar', motivo="ffprobe no disponible")
+
+        try:
+            entry.update(probe(path))
+        except Exception as e:
+            detail = getattr(e, 'stderr', None) or e
+            if isinstance(detail, bytes):
+                detail = detail.decode('utf-8', 'replace').strip()
+            return dict(entry, estado='corrupto', motivo=str(detail)[:200] or "no se pudo leer")
+
+        if entry['duracion'] is not None and entry['duracion'] < self.min_duration:
+            return dict(entry, estado='vacio', motivo=f"duración {entry['duracion']:.2f}s")
+
+        try:
+            level = sample_rms(path, entry['duracion'])
+            if level is not None and level < self.silence_db and len(_sample_offsets(entry['duracion'])) > 1:
+                # Las muestras pueden caer en pausas de una grabación larga:
+                # antes de descartarla se recorre completa
+                level = max(level, scan_rms(path, self.silence_db))
+        except Exception as e:
+            return dict(entry, estado='corrupto', motivo=f"no se pudo decodificar: {e}"[:200])
+        if level is not None:
+            entry['rms_db'] = round(level, 1) if math.isfinite(level) else None
+            if level < self.silence_db:
+                motivo = f"volumen {level:.1f} dBFS" if math.isfinite(level) else "sin señal"
+                return dict(entry, estado='silencio', motivo=motivo)
+        return dict(entry, estado='ok', motivo=None)
+
+    def _cached(self, path):
+        entry = self.results.get(path.name)
+        if entry:
+            stat = path.stat()
+            if entry.get('tamano') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+                return entry
+        return None
+
+    def _save(self):
+        # Temporal por proceso: varios workers pueden guardar el reporte a la vez
+        atomic_write(self.report_path, json.dumps(self.results, ensure_ascii=False, indent=2))
+
+    def run(self, audio_files):
+        """
+        Verifica los archivos en paralelo y aplica la acción a los inválidos.
+
+        Args:
+            audio_files: Rutas de los audios de entrada
+
+        Returns:
+            list: Audios válidos, de mayor a menor duración (los largos
+                primero reparten mejor la carga entre workers)
+        """
+        audio_files = [Path(path) for path in audio_files]
+        pending = [path for path in audio_files if self._cached(path) is None]
+        if pending:
+            logger.info(f"Verificando {len(pending)} archivo(s) de audio...")
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for path, entry in zip(pending, executor.map(self.check_file, pending)):
+                    self.results[path.name] = entry
+
+        accepted = []
+        rejected = 0
+        for path in audio_files:
+            entry = self.results[path.name]
+            if entry['estado'] in ('ok', 'sin_verificar'):
+                accepted.append(path)
+                continue
+            rejected += 1
+            if self.action == 'cuarentena':
+                quarantine = path.parent / QUARANTINE_DIR
+                quarantine.mkdir(exist_ok=True)
+                shutil.move(str(path), str(quarantine / path.name))
+                entry['cuarentena'] = True
+                logger.warning(f"⚠️  {path.name} movido a cuarentena ({entry['estado']}: {entry['motivo']})")
+            else:
+                logger.warning(f"⚠️  Omitiendo {path.name} ({entry['estado']}: {entry['motivo']})")
+
+        # Conservar los archivos que siguen en la entrada (aunque ya estén
+        # transcritos: sus duraciones se usan al exportar) o en cuarentena
+        folders = {path.parent for path in audio_files}
+        self.results = {name: entry for name, entry in self.results.items()
+                        if entry.get('cuarentena') or any((folder / name).exists() for folder in folders)}
+        self._save()
+
+        durations = [self.results[path.name]['duracion'] or 0.0 for path in accepted]
+        logger.info(
+            f"✓ Verificación previa: {len(accepted)} válido(s), {rejected} descartado(s), "
+            f"{sum(durations) / 3600:.2f} h de audio"
+        )
+        return sorted(accepted, key=lambda path: self.results[path.name]['duracion'] or 0.0, reverse=True)
+
+    def duration(self, path):
+        """Duración verificada de un audio en segundos (None si se desconoce)."""
+        entry = self.results.get(Path(path).name)
+        return entry.get('duracion') if entry else None
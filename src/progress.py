@@ -0,0 +1,230 @@
+"""
+Progreso y tiempo estimado de los lotes largos.
+
+Cada etapa (transcripción, formateo, análisis) cuenta lo procesado frente
+al total (segundos de audio o bytes de texto) y emite, como mucho cada
+`interval` segundos, una línea de progreso con el ETA y una actualización
+atómica del archivo de estado (output/.estado.json) que run.ps1 o un panel
+pueden consultar. Reemplaza la salida segmento a segmento de Whisper
+(verbose=True), que escribía megabytes de log por archivo.
+"""
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STATUS_NAME = ".estado.json"
+STAGE_LABELS = {'transcripcion': "Transcripción", 'formateo': "Formateo", 'analisis': "Análisis"}
+# Frames del espectrograma de Whisper por segundo de audio (hop de 10 ms)
+WHISPER_FRAMES_PER_SECOND = 100
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class StatusFile:
+    """
+    Archivo JSON de estado, reescrito de forma atómica (temporal + rename).
+
+    Hay una instancia por ruta y proceso, compartida por todas las etapas.
+    """
+
+    _instances = {}
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.data = {'pid': os.getpid(), 'inicio': datetime.now().isoformat(timespec='seconds'), 'etapas': {}}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, output_dir):
+        """Crea el archivo de estado desde STATUS_FILE (None si STATUS_FILE=none)."""
+        path = os.environ.get('STATUS_FILE') or str(Path(output_dir) / STATUS_NAME)
+        if path.lower() == 'none':
+            return None
+        if path not in cls._instances:
+            cls._instances[path] = cls(path)
+        return cls._instances[path]
+
+    def update(self, stage, state):
+        """Reemplaza el estado de una etapa y reescribe el archivo."""
+        with self._lock:
+            self.data['etapa'] = stage
+            self.data['etapas'][stage] = state
+            self.data['actualizado'] = datetime.now().isoformat(timespec='seconds')
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp_path.write_text(json.dumps(self.data, ensure_ascii=False, indent=2), encoding='utf-8')
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.debug(f"No se pudo escribir el estado: {e}")
+
+
+class StageProgress:
+    """
+    Progreso de una etapa: procesado frente a total, con ETA.
+
+    Las unidades las decide la etapa (segundos de audio, bytes de texto). Con
+    `done_check`, los elementos terminados por otros workers también cuentan
+    como procesados, así el ETA refleja el ritmo de todo el lote.
+    """
+
+    def __init__(self, stage, items, unit='s', status=None, interval=5.0, done_check=None):
+        """
+        Args:
+            stage: Nombre de la etapa ('transcripcion', 'formateo', 'analisis')
+            items: Dict nombre -> tamaño (None si aún se desconoce)
+            unit: Unidad del tamaño ('s' = segundos de audio, 'bytes' = texto)
+            status: StatusFile opcional
+            interval: Segundos mínimos entre dos emisiones
+            done_check: Función nombre -> bool que indica si un elemento ya
+                está terminado (por este u otro worker)
+        """
+        self.stage = stage
+        self.sizes = dict(items)
+        self.unit = unit
+        self.status = status
+        self.interval = interval
+        self.done_check = done_check
+        self.done = set()
+        self.skipped = set()
+        self.current = {}
+        self.started = time.monotonic()
+        self._initial = None
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def total(self):
+        return sum(size or 0 for size in self.sizes.values())
+
+    def _processed(self):
+        done = {name for name in self.sizes if name in self.done
+                or (self.done_check and name not in self.current and self.done_check(name))}
+        processed = sum(self.sizes[name] or 0 for name in done)
+        processed += sum(min(position, self.sizes.get(name) or position)
+                         for name, position in self.current.items() if name not in done)
+        return processed, len(done)
+
+    def start_item(self, name, size=None):
+        """Marca el inicio de un elemento (su tamaño puede conocerse recién ahora)."""
+        with self._lock:
+            if size is not None:
+                self.sizes[name] = size
+            self.sizes.setdefault(name, None)
+            self.current[name] = 0.0
+        self.emit(force=True)
+
+    def advance(self, name, position):
+        """Actualiza la posición alcanzada dentro de un elemento."""
+        with self._lock:
+            self.current[name] = position
+        self.emit()
+
+    def complete(self, name, ok=True):
+        """Marca un elemento como terminado (ok=False: falló)."""
+        with self._lock:
+            self.current.pop(name, None)
+            if ok:
+                self.done.add(name)
+            else:
+                self.skipped.add(name)
+        self.emit(force=True)
+
+    def snapshot(self):
+        """Estado actual: procesado, total, porcentaje, velocidad y ETA."""
+        with self._lock:
+            processed, done = self._processed()
+            total = self.total
+            elapsed = time.monotonic() - self.started
+            if self._initial is None:
+                # Lo ya terminado antes de empezar no cuenta para la velocidad
+                self._initial = processed
+            rate = (processed - self._initial) / elapsed if elapsed > 0 else 0.0
+            remaining = max(total - processed, 0)
+            return {
+                'procesado': round(processed, 1),
+                'total': round(total, 1),
+                'unidad': self.unit,
+                'porcentaje': round(100.0 * processed / total, 1) if total else 0.0,
+                'elementos': {'hechos': done, 'fallidos': len(self.skipped), 'total': len(self.sizes)},
+                'en_curso': sorted(self.current),
+                'velocidad': round(rate, 3),
+                'transcurrido_s': round(elapsed),
+                'eta_s': round(remaining / rate) if rate > 0 else None,
+            }
+
+    def emit(self, force=False, final=False):
+        """Registra el progreso y actualiza el estado (como mucho cada `interval` segundos)."""
+        now = time.monotonic()
+        if not force and now - self._last_emit < self.interval:
+            return
+        self._last_emit = now
+        state = dict(self.snapshot(), terminada=final)
+        if self.status:
+            self.status.update(self.stage, state)
+        if self.unit == 's':
+            amount = f"{_format_duration(state['procesado'])}/{_format_duration(state['total'])} de audio"
+        else:
+            amount = f"{int(state['procesado'])}/{int(state['total'])} {self.unit}"
+        label = STAGE_LABELS.get(self.stage, self.stage)
+        if final:
+            logger.info(f"📊 {label}: {state['porcentaje']:.0f}% ({amount}) en {_format_duration(state['transcurrido_s'])}")
+        else:
+            logger.info(f"⏳ {label}: {state['porcentaje']:.0f}% ({amount}) · ETA {_format_duration(state['eta_s'])}")
+
+    def finish(self):
+        """Emite el estado final de la etapa."""
+        self.emit(force=True, final=True)
+
+
+@contextmanager
+def whisper_progress(callback):
+    """
+    Redirige la barra de progreso de Whisper (verbose=False) a `callback`.
+
+    Whisper actualiza una barra tqdm en frames del espectrograma; aquí se
+    reemplaza por un objeto que convierte los frames a segundos de audio y
+    llama a callback(segundos) sin imprimir nada.
+    """
+    module = importlib.import_module('whisper.transcribe')
+    original = module.tqdm
+
+    class ProgressBar:
+        def __init__(self, *args, **kwargs):
+            self.n = 0
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def update(self, n=1):
+            self.n += n
+            callback(self.n / WHISPER_FRAMES_PER_SECOND)
+
+    class TqdmShim:
+        tqdm = ProgressBar
+
+    module.tqdm = TqdmShim
+    try:
+        yield
+    finally:
+        module.tqdm = original
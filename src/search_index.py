@@ -0,0 +1,305 @@
+"""
+Índice de búsqueda de texto completo sobre todas las transcripciones.
+Usa SQLite FTS5 sobre los segmentos (con audio y timestamp) y re-indexa
+solo las transcripciones nuevas o modificadas.
+
+Uso:
+    python src/search_index.py indexar [directorio]
+    python src/search_index.py buscar "texto a buscar" [--limite 20] [--fts]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+from archive import ArtifactArchive
+from log_setup import setup_logging
+from output_layout import ARCHIVE_SUFFIX, TRANSCRIPT_SUFFIX, create_layout_from_env
+
+logger = logging.getLogger(__name__)
+
+# Fuentes de segmentos por orden de preferencia (sufijo, tipo)
+SOURCES = (
+    ('_segmentos.jsonl', 'jsonl'),
+    (ARCHIVE_SUFFIX, 'archivo'),
+    ('_transcripcion_detallada.txt', 'detallada'),
+    ('_transcripcion.txt', 'texto'),
+)
+
+DETAILED_LINE = re.compile(r'^\[(\d+(?:\.\d+)?)s -> (\d+(?:\.\d+)?)s\] (.*)$')
+# Términos de una consulta simple: "frase exacta" o palabra, con * final opcional
+QUERY_TERM = re.compile(r'"([^"]+)"(\*?)|(\S+?)(\*?)(?=\s|$)')
+
+
+def quote_query(query):
+    """
+    Convierte una consulta simple en una consulta FTS5 segura.
+
+    Cada palabra (o "frase exacta") se cita, así los caracteres especiales
+    de FTS5 (e-mail, c++, comillas sueltas, AND final) se buscan como texto.
+    Se conserva el * final para buscar por prefijo.
+    """
+    terms = []
+    for phrase, phrase_star, word, word_star in QUERY_TERM.findall(query):
+        text = phrase or word
+        terms.append('"' + text.replace('"', '""') + '"' + (phrase_star or word_star))
+    return " ".join(terms)
+
+
+def default_index_path(output_dir):
+    """Ruta por defecto del índice dentro del directorio de salida."""
+    return Path(output_dir) / ".indice_busqueda.sqlite"
+
+
+def _read_segments(path, kind):
+    """
+    Lee los segmentos de una fuente de transcripción.
+
+    Yields:
+        tuple: (inicio_ms, fin_ms, texto)
+    """
+    if kind == 'archivo':
+        # Archivo comprimido: se descomprime en streaming, sin extraerlo
+        audio = path.name[:-len(ARCHIVE_SUFFIX)]
+        with ArtifactArchive(path) as archive:
+            if archive.manifest['segmentos']:
+                yield from _parse_lines(archive.iter_lines(f"{audio}_segmentos.jsonl"), 'jsonl')
+                return
+            if f"{audio}_transcripcion_detallada.txt" in archive:
+                yield from _parse_lines(archive.iter_lines(f"{audio}_transcripcion_detallada.txt"), 'detallada')
+                return
+        path, kind = path.parent / f"{audio}{TRANSCRIPT_SUFFIX}", 'texto'
+        if not path.exists():
+            return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        if kind in ('jsonl', 'detallada'):
+            yield from _parse_lines(f, kind)
+        else:
+            # Texto plano sin timestamps: un único segmento desde 0
+            text = f.read().strip()
+            if text:
+                yield (0, 0, text)
+
+
+def _parse_lines(lines, kind):
+    """Segmentos (inicio_ms, fin_ms, texto) de las líneas de un JSONL o de una transcripción detallada."""
+    if kind == 'jsonl':
+        for line in lines:
+            line = line.strip()
+            if line:
+                segment = json.loads(line)
+                yield (int(segment.get('start', 0) * 1000),
+                       int(segment.get('end', 0) * 1000),
+                       segment.get('text', '').strip())
+    else:
+        for line in lines:
+            match = DETAILED_LINE.match(line.strip())
+            if match:
+                yield (int(float(match.group(1)) * 1000),
+                       int(float(match.group(2)) * 1000),
+                       match.group(3))
+
+
+class TranscriptIndex:
+    """Índice FTS5 incremental de segmentos de transcripción."""
+
+    def __init__(self, index_path):
+        """
+        Abre (o crea) el índice.
+
+        Args:
+            index_path: Ruta al archivo SQLite del índice
+        """
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.index_path))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS archivos (
+                ruta TEXT PRIMARY KEY,
+                audio TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                tamano INTEGER NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS segmentos USING fts5(
+                texto,
+                audio UNINDEXED,
+                ruta UNINDEXED,
+                inicio_ms UNINDEXED,
+                fin_ms UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _discover_sources(self, output_dir):
+        """Elige la mejor fuente de segmentos para cada audio del directorio."""
+        sources = {}
+        paths = (path for directory in create_layout_from_env(output_dir).dirs() for path in directory.iterdir())
+        for path in paths:
+            if not path.is_file():
+                continue
+            for rank, (suffix, kind) in enumerate(SOURCES):
+                if path.name.endswith(suffix):
+                    audio = path.name[:-len(suffix)]
+                    if audio not in sources or rank < sources[audio][0]:
+                        sources[audio] = (rank, path, kind)
+                    break
+        return {audio: (path, kind) for audio, (_, path, kind) in sources.items()}
+
+    def _remove(self, ruta):
+        self.conn.execute("DELETE FROM segmentos WHERE ruta = ?", (ruta,))
+        self.conn.execute("DELETE FROM archivos WHERE ruta = ?", (ruta,))
+
+    def update(self, output_dir):
+        """
+        Indexa las transcripciones nuevas o modificadas de un directorio.
+
+        Args:
+            output_dir: Directorio con las transcripciones
+
+        Returns:
+            dict: Conteo de archivos 'indexados', 'sin_cambios' y 'eliminados'
+        """
+        sources = self._discover_sources(output_dir)
+        known = {
+            ruta: (mtime_ns, tamano)
+            for ruta, mtime_ns, tamano in self.conn.execute(
+                "SELECT ruta, mtime_ns, tamano FROM archivos")
+        }
+        stats = {'indexados': 0, 'sin_cambios': 0, 'eliminados': 0}
+
+        with self.conn:
+            wanted = set()
+            for audio, (path, kind) in sorted(sources.items()):
+                ruta = str(path)
+                wanted.add(ruta)
+                stat = path.stat()
+                if known.get(ruta) == (stat.st_mtime_ns, stat.st_size):
+                    stats['sin_cambios'] += 1
+                    continue
+
+                self._remove(ruta)
+                self.conn.executemany(
+                    "INSERT INTO segmentos (texto, audio, ruta, inicio_ms, fin_ms) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    ((text, audio, ruta, start_ms, end_ms)
+                     for start_ms, end_ms, text in _read_segments(path, kind) if text)
+                )
+                self.conn.execute(
+                    "INSERT INTO archivos (ruta, audio, mtime_ns, tamano) VALUES (?, ?, ?, ?)",
+                    (ruta, audio, stat.st_mtime_ns, stat.st_size)
+                )
+                stats['indexados'] += 1
+
+            # Fuentes que desaparecieron o fueron reemplazadas por una mejor
+            for ruta in set(known) - wanted:
+                self._remove(ruta)
+                stats['eliminados'] += 1
+
+        logger.info(
+            f"Índice de búsqueda actualizado: {stats['indexados']} indexados, "
+            f"{stats['sin_cambios']} sin cambios, {stats['eliminados']} eliminados"
+        )
+        return stats
+
+    def search(self, query, limit=20, raw=False):
+        """
+        Busca un texto en todas las transcripciones indexadas.
+
+        Args:
+            query: Palabras, "frases exactas" y prefijo*
+            limit: Máximo de resultados
+            raw: Pasar la consulta a FTS5 sin citar (operadores AND, OR,
+                NOT, NEAR, columnas); una sintaxis inválida lanza
+                sqlite3.OperationalError
+
+        Returns:
+            list: Diccionarios con 'audio', 'ruta', 'inicio_ms', 'fin_ms',
+                'texto' y 'fragmento', ordenados por relevancia
+        """
+        if not raw:
+            query = quote_query(query)
+            if not query:
+                return []
+        rows = self.conn.execute(
+            "SELECT audio, ruta, inicio_ms, fin_ms, texto, "
+            "snippet(segmentos, 0, '[', ']', '…', 12) "
+            "FROM segmentos WHERE segmentos MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit)
+        )
+        return [
+            {
+                'audio': audio,
+                'ruta': ruta,
+                'inicio_ms': int(inicio_ms),
+                'fin_ms': int(fin_ms),
+                'texto': texto,
+                'fragmento': fragmento,
+            }
+            for audio, ruta, inicio_ms, fin_ms, texto, fragmento in rows
+        ]
+
+
+def _format_ms(ms):
+    """Convierte milisegundos a 'HH:MM:SS'."""
+    seconds = ms // 1000
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def main():
+    """Función principal (CLI)."""
+    setup_logging('search_index')
+
+    output_dir = Path(os.environ.get('OUTPUT_DIR', '/app/output'))
+    index_path = Path(os.environ.get('SEARCH_INDEX_PATH', default_index_path(output_dir)))
+
+    parser = argparse.ArgumentParser(description="Índice de búsqueda de transcripciones")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    indexar = subparsers.add_parser('indexar', help="Indexa transcripciones nuevas o modificadas")
+    indexar.add_argument('directorio', nargs='?', default=str(output_dir))
+
+    buscar = subparsers.add_parser('buscar', help="Busca texto en las transcripciones")
+    buscar.add_argument('consulta')
+    buscar.add_argument('--limite', type=int, default=20)
+    buscar.add_argument('--json', action='store_true', help="Salida en JSON")
+    buscar.add_argument('--fts', action='store_true',
+                        help="Consulta con la sintaxis de FTS5 (AND, OR, NOT, NEAR)")
+
+    args = parser.parse_args()
+
+    with TranscriptIndex(index_path) as index:
+        if args.comando == 'indexar':
+            index.update(args.directorio)
+        else:
+            try:
+                hits = index.search(args.consulta, limit=args.limite, raw=args.fts)
+            except sqlite3.OperationalError as e:
+                logger.error(f"Consulta inválida: {args.consulta!r} ({e})")
+                return 1
+            if args.json:
+                print(json.dumps(hits, ensure_ascii=False, indent=2))
+            elif not hits:
+                print("Sin resultados.")
+            else:
+                for hit in hits:
+                    print(f"{hit['audio']} [{_format_ms(hit['inicio_ms'])}] "
+                          f"({hit['inicio_ms']} ms) {hit['fragmento']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
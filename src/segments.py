@@ -0,0 +1,213 @@
+"""
+Salida estructurada de segmentos de Whisper (JSONL, SRT y VTT).
+Escribe todos los formatos en una sola pasada y permite a las etapas
+posteriores leer los segmentos de forma perezosa, sin re-parsear texto plano.
+"""
+import io
+import json
+import logging
+from pathlib import Path
+
+from artifacts import write_artifact
+
+logger = logging.getLogger(__name__)
+
+# Campos de cada segmento de Whisper que se conservan en el JSONL
+SEGMENT_FIELDS = ('id', 'start', 'end', 'text', 'avg_logprob', 'no_speech_prob', 'speaker')
+
+
+def segments_path_for(transcript_path):
+    """
+    Devuelve la ruta del JSONL de segmentos asociado a una transcripción.
+
+    Args:
+        transcript_path: Ruta a '<nombre>_transcripcion.txt'
+
+    Returns:
+        Path: Ruta a '<nombre>_segmentos.jsonl'
+    """
+    transcript_path = Path(transcript_path)
+    base_name = transcript_path.stem.replace('_transcripcion', '')
+    return transcript_path.parent / f"{base_name}_segmentos.jsonl"
+
+
+def _format_timestamp(seconds, separator):
+    """Convierte segundos a 'HH:MM:SS<sep>mmm' (',' para SRT, '.' para VTT)."""
+    total_ms = int(round(max(seconds, 0.0) * 1000))
+    hours, rest = divmod(total_ms, 3_600_000)
+    minutes, rest = divmod(rest, 60_000)
+    secs, millis = divmod(rest, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+class SegmentWriter:
+    """
+    Escribe segmentos a JSONL, SRT, VTT y texto detallado en una única pasada.
+
+    Cada formato se arma en memoria y se escribe de forma atómica al cerrar
+    el bloque `with`; si hay una excepción no se escribe ninguno.
+    """
+
+    def __init__(self, output_dir, base_name, formats=('jsonl', 'srt', 'vtt'), detailed_header=None):
+        """
+        Inicializa el escritor de segmentos.
+
+        Args:
+            output_dir: Directorio de salida
+            base_name: Nombre base del audio (sin extensión)
+            formats: Formatos a generar (jsonl, srt, vtt, detallada)
+            detailed_header: Cabecera para '_transcripcion_detallada.txt'
+                (texto completo incluido), requerida si se pide 'detallada'
+        """
+        self.output_dir = Path(output_dir)
+        self.base_name = base_name
+        self.formats = tuple(formats)
+        self.detailed_header = detailed_header or ""
+        self.paths = {}
+        self._files = {}
+        self._count = 0
+
+    def _path_for(self, fmt):
+        if fmt == 'jsonl':
+            return self.output_dir / f"{self.base_name}_segmentos.jsonl"
+        if fmt == 'detallada':
+            return self.output_dir / f"{self.base_name}_transcripcion_detallada.txt"
+        return self.output_dir / f"{self.base_name}_transcripcion.{fmt}"
+
+    def __enter__(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        for fmt in self.formats:
+            path = self._path_for(fmt)
+            self.paths[fmt] = path
+            self._files[fmt] = io.StringIO()
+        if 'vtt' in self._files:
+            self._files['vtt'].write("WEBVTT\n\n")
+        if 'detallada' in self._files:
+            self._files['detallada'].write(self.detailed_header)
+            self._files['detallada'].write("SEGMENTOS CON TIMESTAMPS:\n\n")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            for fmt, buffer in self._files.items():
+                write_artifact(self.paths[fmt], buffer.getvalue())
+        self._files = {}
+        return False
+
+    def write(self, segment):
+        """
+        Escribe un segmento en todos los formatos abiertos.
+
+        Args:
+            segment: Diccionario de segmento de Whisper
+        """
+        self._count += 1
+        start = float(segment.get('start', 0))
+        end = float(segment.get('end', 0))
+        text = segment.get('text', '').strip()
+        speaker = segment.get('speaker')
+
+        if 'jsonl' in self._files:
+            record = {field: segment[field] for field in SEGMENT_FIELDS if field in segment}
+            record['text'] = text
+            self._files['jsonl'].write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        if 'srt' in self._files:
+            self._files['srt'].write(
+                f"{self._count}\n"
+                f"{_format_timestamp(start, ',')} --> {_format_timestamp(end, ',')}\n"
+                f"{f'[{speaker}] ' if speaker else ''}{text}\n\n"
+            )
+
+        if 'vtt' in self._files:
+            self._files['vtt'].write(
+                f"{_format_timestamp(start, '.')} --> {_format_timestamp(end, '.')}\n"
+                f"{f'<v {speaker}>' if speaker else ''}{text}\n\n"
+            )
+
+        if 'detallada' in self._files:
+            label = f"{speaker}: " if speaker else ""
+            self._files['detallada'].write(f"[{start:.2f}s -> {end:.2f}s] {label}{text}\n")
+
+    def write_all(self, segments):
+        """Escribe todos los segmentos de un iterable."""
+        for segment in segments:
+            self.write(segment)
+        return self._count
+
+
+def iter_segments(jsonl_path):
+    """
+    Lee segmentos de un JSONL de forma perezosa.
+
+    Args:
+        jsonl_path: Ruta al archivo '_segmentos.jsonl'
+
+    Yields:
+        dict: Un segmento por línea
+    """
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def chunk_segments(segments, max_chars):
+    """
+    Agrupa segmentos en chunks respetando los límites de segmento.
+
+    Args:
+        segments: Iterable de segmentos
+        max_chars: Máximo de caracteres por chunk (un segmento más largo
+            que el límite forma su propio chunk)
+
+    Yields:
+        list: Lista de segmentos de cada chunk
+    """
+    current = []
+    current_length = 0
+
+    for segment in segments:
+        length = len(segment.get('text', '')) + 1
+        if current and current_length + length > max_chars:
+            yield current
+            current = []
+            current_length = 0
+        current.append(segment)
+        current_length += length
+
+    if current:
+        yield current
+
+
+def segments_to_text(segments):
+    """
+    Une el texto de una lista de segmentos.
+
+    Si los segmentos tienen etiqueta de hablante, cada cambio de turno
+    comienza una línea nueva con 'HABLANTE N:'.
+    """
+    lines = []
+    current_speaker = None
+    for segment in segments:
+        text = segment.get('text', '').strip()
+        if not text:
+            continue
+        speaker = segment.get('speaker')
+        if speaker and speaker != current_speaker:
+            lines.append(f"{speaker}: {text}")
+            current_speaker = speaker
+        elif lines:
+            lines[-1] += f" {text}"
+        else:
+            lines.append(text)
+    return "\n".join(lines)
+
+
+def has_speakers(source):
+    """Indica si unos segmentos (ruta a un JSONL o iterable) tienen etiquetas de hablante."""
+    segments = iter_segments(source) if isinstance(source, (str, Path)) else source
+    for segment in segments:
+        return 'speaker' in segment
+    return False
@@ -5,22 +5,29 @@ Adaptado para trabajar localmente con Docker.
 import whisper
 import torch
 import os
+import subprocess
 import sys
+import time
 from pathlib import Path
 import logging
+from contextlib import nullcontext
 from datetime import datetime
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/app/logs/transcription.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from artifacts import adopt_existing, is_complete, write_artifact
+from device_scheduler import DeviceScheduler, load_whisper_model
+from log_setup import file_context, run_id, setup_logging
+from output_layout import TRANSCRIPT_SUFFIX, create_layout_from_env
+from preflight import read_durations
+from progress import StageProgress, StatusFile, whisper_progress
+from segments import SegmentWriter
+from vocabulary import VocabularyPrompter, load_vocabulary
+from work_queue import LeaseQueue, create_lease_queue_from_env
+
 logger = logging.getLogger(__name__)
 
+# Extensiones de audio soportadas por FFmpeg
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.wma', '.opus'}
+
 class AudioTranscriber:
     # Diccionario de modismos por variante regional
     DIALECT_PROMPTS = {
@@ -58,7 +65,8 @@ class AudioTranscriber:
         )
     }
     
-    def __init__(self, model_name="medium", language="es", dialect="es"):
+    def __init__(self, model_name="medium", language="es", dialect="es", word_timestamps=False,
+                 diarizer=None):
         """
         Inicializa el transcriptor de audio.
         
@@ -66,11 +74,16 @@ class AudioTranscriber:
             model_name: Modelo de Whisper a usar (tiny, base, small, medium, large)
             language: Idioma del audio (código ISO, ej: 'es' para español)
             dialect: Variante regional (cl, mx, ar, es)
+            word_timestamps: Si True, guarda también timestamps por palabra
+            diarizer: SpeakerDiarizer opcional para etiquetar hablantes
         """
         self.model_name = model_name
         self.language = language
         self.dialect = dialect
+        self.word_timestamps = word_timestamps
+        self.diarizer = diarizer
         self.model = None
+        self.scheduler = None
         self.device = self._setup_device()
         
         # Seleccionar prompt según variante
@@ -87,11 +100,15 @@ class AudioTranscriber:
         Detecta y configura el dispositivo (GPU/CPU) con límite de VRAM.
         
         Returns:
-            str: 'cuda' o 'cpu'
+            str: 'cuda', 'cpu' o 'simulado' (GPU simulada sobre CPU, para pruebas)
         """
         use_gpu = os.environ.get('USE_GPU', 'auto').lower()
         gpu_memory_limit = int(os.environ.get('GPU_MEMORY_LIMIT', '2048'))  # MB
         
+        if use_gpu == 'simulado':
+            logger.info("🧪 GPU simulada (USE_GPU=simulado): el modelo corre en CPU con memoria de GPU limitada")
+            return "simulado"
+        
         # Verificar disponibilidad de CUDA
         if not torch.cuda.is_available():
             logger.info("🖥️  GPU NVIDIA no detectada. Usando CPU.")
@@ -131,7 +148,9 @@ class AudioTranscriber:
         logger.info(f"Cargando modelo Whisper ({self.model_name})...")
         try:
             # Cargar modelo en el dispositivo configurado
-            self.model = whisper.load_model(self.model_name, device=self.device)
+            self.model = load_whisper_model(self.model_name, self.device)
+            # Respaldo por archivo (modelo menor o CPU) si falta memoria de GPU
+            self.scheduler = DeviceScheduler.from_env(self.model, self.model_name, self.device)
             
             if self.device == "cuda":
                 # Mostrar memoria GPU utilizada
@@ -140,7 +159,7 @@ class AudioTranscriber:
                 logger.info(f"✅ Modelo cargado en GPU")
                 logger.info(f"📊 VRAM utilizada: {memory_allocated:.2f} GB (reservada: {memory_reserved:.2f} GB)")
             else:
-                logger.info(f"✅ Modelo cargado en CPU")
+                logger.info(f"✅ Modelo cargado en CPU" + (" (GPU simulada)" if self.device == "simulado" else ""))
             
             return True
         except Exception as e:
@@ -152,13 +171,17 @@ class AudioTranscriber:
                 logger.error("   3. Deshabilitar GPU con USE_GPU=false")
             return False
     
-    def transcribe_file(self, audio_path, output_path=None):
+    def transcribe_file(self, audio_path, output_path=None, progress=None, vocabulary_root=None):
         """
         Transcribe un archivo de audio.
         
         Args:
             audio_path: Ruta al archivo de audio
             output_path: Ruta donde guardar la transcripción (opcional)
+            progress: StageProgress opcional; recibe los segundos de audio
+                procesados en lugar de imprimir cada segmento
+            vocabulary_root: Directorio de entrada; los vocabulario.txt se
+                buscan desde la carpeta del audio hasta aquí (ver vocabulary.py)
         
         Returns:
             dict: Resultado de la transcripción con 'text', 'segments', etc.
@@ -178,19 +201,49 @@ class AudioTranscriber:
         logger.info(f"Tamaño del archivo: {audio_path.stat().st_size / (1024*1024):.2f} MB")
         
         try:
-            # Transcribir el archivo - configuración simple y estable
-            # Similar a la configuración de Colab que funcionaba bien
-            result = self.model.transcribe(
-                str(audio_path),
-                language=self.language,
-                fp16=False,
-                verbose=True,
-                initial_prompt=self.initial_prompt  # Contexto chileno (opcional, no invasivo)
+            # Decodificar el audio una sola vez (PCM 16 kHz) para Whisper y
+            # para las etapas que trabajan sobre el audio (diarización)
+            audio = whisper.load_audio(str(audio_path))
+            
+            tracking = nullcontext()
+            if progress:
+                progress.start_item(audio_path.name, len(audio) / whisper.audio.SAMPLE_RATE)
+                tracking = whisper_progress(lambda seconds: progress.advance(audio_path.name, seconds))
+            
+            # Términos del vocabulario del proyecto en el prompt de cada ventana
+            prompter = VocabularyPrompter.from_env(
+                load_vocabulary(audio_path, vocabulary_root), self.language
             )
             
+            # Transcribir el archivo - configuración simple y estable
+            # Similar a la configuración de Colab que funcionaba bien.
+            # Sin salida por segmento: el progreso se informa con `progress`
+            with tracking:
+                result, model_name, device = self.scheduler.transcribe(
+                    audio,
+                    decode_hook=prompter,
+                    language=self.language,
+                    fp16=False,
+                    verbose=False if progress else None,
+                    initial_prompt=self.initial_prompt,  # Contexto chileno (opcional, no invasivo)
+                    word_timestamps=self.word_timestamps
+                )
+            if (model_name, device) != (self.model_name, self.device):
+                logger.info(f"♻️  {audio_path.name} transcrito con {model_name} en {device} (respaldo)")
+            
             transcription_text = result["text"]
             logger.info(f"Transcripción completada. Longitud: {len(transcription_text)} caracteres")
             
+            # Etiquetar hablantes (opcional, CPU)
+            if self.diarizer:
+                try:
+                    self.diarizer.diarize(audio, result.get("segments", []))
+                except Exception as e:
+                    # Es un paso opcional: la transcripción se guarda igual
+                    logger.warning(f"⚠️  Diarización fallida en {audio_path.name}, se guarda sin hablantes: {e}")
+                    for segment in result.get("segments", []):
+                        segment.pop('speaker', None)
+            
             # Guardar la transcripción
             if output_path:
                 output_path = Path(output_path)
@@ -201,31 +254,44 @@ class AudioTranscriber:
             # Asegurar que el directorio de salida existe
             output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            # Guardar el archivo
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(transcription_text)
+            # Guardar la versión detallada y los segmentos estructurados
+            # (JSONL, SRT, VTT) en una sola pasada sobre los segmentos
+            detailed_header = (
+                f"Transcripción de: {audio_path.name}\n"
+                f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                f"Modelo: {model_name}\n"
+                f"Idioma: {self.language}\n"
+                + "="*80 + "\n\n"
+                + "TRANSCRIPCIÓN COMPLETA:\n\n"
+                + transcription_text
+                + "\n\n" + "="*80 + "\n\n"
+            )
+            base_name = output_path.stem.replace('_transcripcion', '')
+            with SegmentWriter(
+                output_path.parent,
+                base_name,
+                formats=('detallada', 'jsonl', 'srt', 'vtt'),
+                detailed_header=detailed_header
+            ) as writer:
+                writer.write_all(result.get("segments", []))
+                detailed_path = writer.paths['detallada']
             
-            logger.info(f"Transcripción guardada en: {output_path}")
+            logger.info(f"Versión detallada guardada en: {detailed_path}")
+            logger.info(f"Segmentos guardados en: {writer.paths['jsonl'].name}, "
+                        f"{writer.paths['srt'].name}, {writer.paths['vtt'].name}")
             
-            # Guardar también la versión detallada con timestamps (opcional)
-            detailed_path = output_path.parent / f"{audio_path.stem}_transcripcion_detallada.txt"
-            with open(detailed_path, 'w', encoding='utf-8') as f:
-                f.write(f"Transcripción de: {audio_path.name}\n")
-                f.write(f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Modelo: {self.model_name}\n")
-                f.write(f"Idioma: {self.language}\n")
-                f.write("="*80 + "\n\n")
-                f.write("TRANSCRIPCIÓN COMPLETA:\n\n")
-                f.write(transcription_text)
-                f.write("\n\n" + "="*80 + "\n\n")
-                f.write("SEGMENTOS CON TIMESTAMPS:\n\n")
-                for segment in result.get("segments", []):
-                    start = segment.get("start", 0)
-                    end = segment.get("end", 0)
-                    text = segment.get("text", "").strip()
-                    f.write(f"[{start:.2f}s -> {end:.2f}s] {text}\n")
+            # Guardar la tabla compacta de palabras (opcional)
+            if self.word_timestamps:
+                from words import WordTable, words_dir_for
+                
+                table = WordTable.from_segments(result.get("segments", []))
+                words_dir = table.save(words_dir_for(output_path.parent, base_name))
+                logger.info(f"Timestamps por palabra guardados en: {words_dir} ({len(table)} palabras)")
             
-            logger.info(f"Versión detallada guardada en: {detailed_path}")
+            # La transcripción se escribe al final: su marca de completitud
+            # indica que todos los archivos del audio están guardados
+            write_artifact(output_path, transcription_text)
+            logger.info(f"Transcripción guardada en: {output_path}")
             
             return result
             
@@ -235,59 +301,257 @@ class AudioTranscriber:
             logger.error(traceback.format_exc())
             return None
     
-    def process_directory(self, input_dir, output_dir=None):
+    def process_directory(self, input_dir, output_dir=None, lease_queue=None, audio_files=None):
         """
         Procesa todos los archivos de audio en un directorio.
         
         Args:
             input_dir: Directorio con archivos de audio
             output_dir: Directorio donde guardar las transcripciones
+            lease_queue: LeaseQueue opcional (modo worker): cada archivo se
+                reclama con un lease para que varios workers compartan la cola
+            audio_files: Archivos a procesar, en orden (por defecto todos los
+                audios de input_dir)
         """
         input_dir = Path(input_dir)
         output_dir = Path(output_dir) if output_dir else Path("/app/output")
         
-        # Extensiones de audio soportadas por FFmpeg
-        audio_extensions = {'.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.wma', '.opus'}
-        
-        audio_files = [f for f in input_dir.iterdir() 
-                      if f.is_file() and f.suffix.lower() in audio_extensions]
+        if audio_files is None:
+            audio_files = [f for f in input_dir.iterdir() 
+                          if f.is_file() and f.suffix.lower() in AUDIO_EXTENSIONS]
         
         if not audio_files:
             logger.warning(f"No se encontraron archivos de audio en: {input_dir}")
             return
         
         logger.info(f"Encontrados {len(audio_files)} archivo(s) de audio para procesar")
+        layout = create_layout_from_env(output_dir)
+        
+        # Progreso en segundos de audio (duraciones de la verificación previa);
+        # los archivos terminados por otros workers también cuentan
+        durations = read_durations(output_dir)
+        progress = StageProgress(
+            'transcripcion',
+            {f.name: durations.get(f.name) for f in audio_files},
+            unit='s',
+            status=StatusFile.from_env(output_dir),
+            done_check=lambda name: is_complete(layout.path(Path(name).stem, TRANSCRIPT_SUFFIX))
+        )
         
         processed = 0
         skipped = 0
+        pending = audio_files
         
-        for idx, audio_file in enumerate(audio_files, 1):
-            output_path = output_dir / f"{audio_file.stem}_transcripcion.txt"
+        while pending:
+            # Archivos reclamados por otros workers: se revisan en otra pasada
+            # por si su lease vence (worker caído)
+            busy = []
             
-            # Saltar si ya existe la transcripción
-            if output_path.exists():
-                logger.info(f"⏭️  Saltando {audio_file.name} (ya transcrito)")
-                skipped += 1
-                continue
-            
-            logger.info(f"\n{'='*80}")
-            logger.info(f"Procesando archivo {idx}/{len(audio_files)}: {audio_file.name}")
-            logger.info(f"{'='*80}\n")
+            for idx, audio_file in enumerate(pending, 1):
+                output_path = layout.path(audio_file.stem, TRANSCRIPT_SUFFIX)
+                
+                # Saltar si la transcripción ya está completa
+                if is_complete(output_path):
+                    logger.info(f"⏭️  Saltando {audio_file.name} (ya transcrito)")
+                    skipped += 1
+                    continue
+                
+                lease = None
+                if lease_queue:
+                    lease = lease_queue.claim(audio_file.name)
+                    if lease is None:
+                        logger.info(f"⏳ {audio_file.name} en proceso por otro worker")
+                        busy.append(audio_file)
+                        continue
+                    if is_complete(output_path):
+                        # Otro worker lo terminó entre la comprobación y el reclamo
+                        lease.release()
+                        skipped += 1
+                        continue
+                
+                logger.info(f"\n{'='*80}")
+                logger.info(f"Procesando archivo {idx}/{len(pending)}: {audio_file.name}")
+                logger.info(f"{'='*80}\n")
+                
+                # Registrar el audio antes de escribir: así el índice nunca
+                # omite una transcripción ya guardada
+                layout.register(audio_file.stem)
+                result = None
+                try:
+                    with file_context(audio_file.name):
+                        result = self.transcribe_file(audio_file, output_path, progress=progress,
+                                                      vocabulary_root=input_dir)
+                finally:
+                    progress.complete(audio_file.name, ok=result is not None)
+                    if lease:
+                        lease.release()
+                processed += 1
             
-            self.transcribe_file(audio_file, output_path)
-            processed += 1
+            pending = busy
+            if pending:
+                logger.info(f"Esperando {len(pending)} archivo(s) en proceso por otros workers...")
+                time.sleep(lease_queue.heartbeat)
         
+        progress.finish()
         logger.info(f"\n{'='*80}")
         logger.info(f"Resumen: {processed} procesados, {skipped} saltados")
         logger.info(f"{'='*80}\n")
 
 
+def find_pending_audio(input_dir, output_dir):
+    """
+    Audios de input_dir sin transcripción, verificados antes de cargar Whisper.
+    
+    Con PREFLIGHT distinto de 'off' se descartan (u omiten a cuarentena) los
+    archivos vacíos, corruptos o en silencio y se ordenan de mayor a menor
+    duración. Con DEDUPE_AUDIO=true se quitan los audios con el mismo
+    contenido que otro (ver fingerprint.py), que reutilizan su transcripción.
+    
+    Returns:
+        list: Rutas de los audios a transcribir
+    """
+    from fingerprint import AudioDeduplicator
+    from preflight import Preflight
+    
+    output_dir = Path(output_dir)
+    adopt_existing(output_dir)
+    layout = create_layout_from_env(output_dir)
+    audio_files = sorted(
+        f for f in Path(input_dir).iterdir()
+        if f.is_file() and f.suffix.lower() in AUDIO_EXTENSIONS
+        and not is_complete(layout.path(f.stem, TRANSCRIPT_SUFFIX))
+    )
+    preflight = Preflight.from_env(output_dir)
+    if preflight and audio_files:
+        audio_files = preflight.run(audio_files)
+    deduplicator = AudioDeduplicator.from_env(output_dir)
+    if deduplicator and audio_files:
+        audio_files = deduplicator.run(
+            audio_files, lambda name: is_complete(layout.path(Path(name).stem, TRANSCRIPT_SUFFIX))
+        )
+        deduplicator.reuse(layout)
+    return audio_files
+
+
+def start_extra_workers(count, threads, cpu_only=False, model_name=None):
+    """
+    Lanza procesos de transcripción adicionales en modo worker.
+    
+    Cada proceso carga su propio modelo y reclama los archivos con leases en
+    el mismo directorio de salida, repartiéndose la cola con este proceso.
+    
+    Args:
+        count: Procesos a lanzar
+        threads: Hilos de torch de cada proceso
+        cpu_only: Forzar CPU en los procesos (pool CPU del modo híbrido)
+        model_name: Modelo de Whisper de los procesos (None = el mismo)
+    
+    Returns:
+        list: Procesos lanzados (subprocess.Popen)
+    """
+    env = dict(
+        os.environ,
+        WORKER_MODE='true',
+        AUTOTUNE='false',
+        DEVICE_MODE='gpu',
+        TRANSCRIPTION_WORKERS='1',
+        TORCH_THREADS=str(threads),
+        # Los archivos inválidos ya se apartaron en este proceso
+        PREFLIGHT='omitir',
+        # El estado lo escribe este proceso (cuenta lo que terminan los demás)
+        STATUS_FILE='none'
+    )
+    if cpu_only:
+        env['USE_GPU'] = 'false'
+    if model_name:
+        env['WHISPER_MODEL'] = model_name
+    # Mismo run_id que este proceso, cada worker con su propio archivo de log
+    env['RUN_ID'] = run_id()
+    script = Path(__file__).resolve()
+    prefix = "transcription-cpu" if cpu_only else "transcription"
+    return [
+        subprocess.Popen([sys.executable, str(script)], env=dict(env, LOG_NAME=f"{prefix}-worker{k}"))
+        for k in range(1, count + 1)
+    ]
+
+
+def transcribe_directory(transcriber, input_dir, output_dir, lease_queue=None, audio_files=None):
+    """
+    Transcribe un directorio con los workers e hilos de la calibración automática.
+    
+    Con AUTOTUNE=false se usan TRANSCRIPTION_WORKERS y TORCH_THREADS. Con más
+    de un worker se lanzan procesos adicionales que comparten la cola
+    mediante leases. Con DEVICE_MODE=hibrido y el modelo en GPU, además se
+    lanzan HYBRID_CPU_WORKERS procesos en CPU (modelo HYBRID_CPU_MODEL) que
+    vacían la misma cola junto al worker de GPU.
+    
+    Args:
+        transcriber: AudioTranscriber con el modelo cargado
+        input_dir: Directorio con archivos de audio
+        output_dir: Directorio donde guardar las transcripciones
+        lease_queue: LeaseQueue opcional (modo worker)
+        audio_files: Archivos a procesar (ver find_pending_audio)
+    """
+    from autotune import AutoTuner, cgroup_cpu_limit
+    
+    workers = int(os.environ.get('TRANSCRIPTION_WORKERS') or 1)
+    threads = int(os.environ.get('TORCH_THREADS') or 0)
+    tuner = AutoTuner.from_env(output_dir)
+    if tuner:
+        tuning = tuner.tune_transcription(transcriber, input_dir)
+        workers, threads = tuning['trabajadores'], tuning['hilos']
+    else:
+        # Sin hilos explícitos, repartir las CPUs entre los workers
+        threads = threads or max(1, int(cgroup_cpu_limit()) // workers)
+        torch.set_num_threads(threads)
+    
+    cpu_workers = 0
+    if transcriber.device != 'cpu' and os.environ.get('DEVICE_MODE', 'gpu').lower() == 'hibrido':
+        cpu_workers = int(os.environ.get('HYBRID_CPU_WORKERS') or 1)
+    
+    children = []
+    if workers > 1 or cpu_workers:
+        if lease_queue is None:
+            lease_queue = LeaseQueue(Path(output_dir) / ".leases", ttl=float(os.environ.get('LEASE_TTL', '120')))
+    if workers > 1:
+        logger.info(f"Lanzando {workers - 1} worker(s) de transcripción adicionales")
+        children += start_extra_workers(workers - 1, threads)
+    if cpu_workers:
+        # El worker de GPU apenas usa CPU: el resto se reparte entre el pool
+        cpu_threads = max(1, (int(cgroup_cpu_limit()) - 1) // cpu_workers)
+        cpu_model = os.environ.get('HYBRID_CPU_MODEL') or transcriber.model_name
+        logger.info(f"Modo híbrido: {cpu_workers} worker(s) en CPU ({cpu_model}, {cpu_threads} hilo(s)) junto a la GPU")
+        children += start_extra_workers(cpu_workers, cpu_threads, cpu_only=True, model_name=cpu_model)
+    
+    try:
+        transcriber.process_directory(input_dir, output_dir, lease_queue=lease_queue, audio_files=audio_files)
+    finally:
+        for child in children:
+            child.wait()
+
+
+def create_diarizer_from_env():
+    """Crea un SpeakerDiarizer si ENABLE_DIARIZATION=true (None si no)."""
+    if os.environ.get('ENABLE_DIARIZATION', 'false').lower() != 'true':
+        return None
+    
+    from diarize import SpeakerDiarizer
+    
+    num_speakers = int(os.environ.get('DIARIZATION_SPEAKERS', '0')) or None
+    logger.info(f"Diarización habilitada (hablantes: {num_speakers or 'auto'})")
+    return SpeakerDiarizer(num_speakers=num_speakers)
+
+
 def main():
     """Función principal."""
+    setup_logging('transcription')
+    
     # Configuración desde variables de entorno
     model_name = os.environ.get('WHISPER_MODEL', 'medium')
     language = os.environ.get('AUDIO_LANGUAGE', 'es')
     dialect = os.environ.get('AUDIO_DIALECT', 'es')
+    word_timestamps = os.environ.get('WORD_TIMESTAMPS', 'false').lower() == 'true'
+    diarizer = create_diarizer_from_env()
     input_dir = Path(os.environ.get('INPUT_DIR', '/app/input'))
     output_dir = Path(os.environ.get('OUTPUT_DIR', '/app/output'))
     
@@ -301,8 +565,24 @@ def main():
     logger.info(f"Directorio de salida: {output_dir}")
     logger.info("="*80 + "\n")
     
+    if not input_dir.exists():
+        logger.error(f"El directorio de entrada no existe: {input_dir}")
+        sys.exit(1)
+    
+    # Verificar los audios antes de cargar el modelo
+    audio_files = find_pending_audio(input_dir, output_dir)
+    if not audio_files:
+        logger.warning(f"No hay archivos de audio pendientes en: {input_dir}")
+        return
+    
     # Crear transcriptor con variante regional
-    transcriber = AudioTranscriber(model_name=model_name, language=language, dialect=dialect)
+    transcriber = AudioTranscriber(
+        model_name=model_name,
+        language=language,
+        dialect=dialect,
+        word_timestamps=word_timestamps,
+        diarizer=diarizer
+    )
     
     # Cargar modelo
     if not transcriber.load_model():
@@ -310,11 +590,18 @@ def main():
         sys.exit(1)
     
     # Procesar archivos
-    if input_dir.exists():
-        transcriber.process_directory(input_dir, output_dir)
-    else:
-        logger.error(f"El directorio de entrada no existe: {input_dir}")
-        sys.exit(1)
+    transcribe_directory(
+        transcriber,
+        input_dir,
+        output_dir,
+        lease_queue=create_lease_queue_from_env(output_dir),
+        audio_files=audio_files
+    )
+    
+    # Audios duplicados: copiar la transcripción de su original
+    from fingerprint import reuse_duplicates_from_env
+    
+    reuse_duplicates_from_env(output_dir)
     
     logger.info("\n" + "="*80)
     logger.info("PROCESAMIENTO COMPLETADO")
@@ -0,0 +1,243 @@
+"""
+Vocabulario personalizado (nombres de productos, personas, siglas) para Whisper.
+
+Los términos se leen de archivos de texto junto a los audios, un término
+por línea (las líneas con '#' son comentarios), en orden de prioridad:
+
+- <carpeta>/vocabulario.txt: para todos los audios de la carpeta (y de sus
+  subcarpetas, hasta el directorio de entrada)
+- <carpeta>/<audio>.vocabulario.txt: solo para ese audio
+
+Un vocabulario largo no cabe en el prompt de Whisper (223 tokens), así que
+en cada ventana de 30 s se eligen los términos más pertinentes: los que
+aparecen (o casi, por prefijo) en el texto de la ventana anterior, luego
+los ya aparecidos en el audio y después el resto en orden de prioridad. Los
+términos se tokenizan una sola vez por proceso y el prompt se arma
+concatenando tokens en caché, sin pasadas extra del modelo: se intercepta
+model.decode() durante la transcripción (ver DeviceScheduler.transcribe).
+"""
+import dataclasses
+import logging
+import os
+import re
+import unicodedata
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+VOCABULARY_FILE = "vocabulario.txt"
+VOCABULARY_SUFFIX = ".vocabulario.txt"
+# Tokens máximos del prompt de Whisper (n_text_ctx // 2 - 1)
+PROMPT_BUDGET = 223
+# Largo del prefijo con el que se reconocen variantes de una palabra
+PREFIX_LENGTH = 5
+HEADER = "Glosario:"
+
+_WORD = re.compile(r"\w+")
+_cache = {}
+
+
+def _normalize(text):
+    """Minúsculas y sin tildes, para comparar palabras."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _keys(text):
+    """Claves de búsqueda de un texto: cada palabra y su prefijo."""
+    keys = set()
+    for word in _WORD.findall(_normalize(text)):
+        if len(word) < 3:
+            continue
+        keys.add(word)
+        if len(word) > PREFIX_LENGTH:
+            keys.add(word[:PREFIX_LENGTH])
+    return keys
+
+
+class Vocabulary:
+    """Lista de términos con un índice invertido por palabra y prefijo."""
+
+    def __init__(self, terms):
+        """
+        Args:
+            terms: Términos en orden de prioridad (se ignoran los repetidos)
+        """
+        self.terms = list(dict.fromkeys(term for term in terms if term))
+        self._index = {}
+        for position, term in enumerate(self.terms):
+            for key in _keys(term):
+                self._index.setdefault(key, []).append(position)
+        # Tokens de cada término por codificación (tokenizado una sola vez)
+        self._tokens = {}
+
+    @classmethod
+    def load(cls, paths):
+        """Une los términos de varios archivos (los primeros tienen prioridad)."""
+        terms = []
+        for path in paths:
+            for line in Path(path).read_text(encoding='utf-8').splitlines():
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    terms.append(line)
+        return cls(terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def lookup(self, text):
+        """
+        Términos mencionados en un texto.
+
+        Returns:
+            dict: Posición del término -> palabras del texto que coinciden
+        """
+        hits = {}
+        for key in _keys(text):
+            for position in self._index.get(key, ()):
+                hits[position] = hits.get(position, 0) + 1
+        return hits
+
+    def tokens(self, tokenizer, position):
+        """Tokens de un término (' término,'), en caché por codificación."""
+        key = (getattr(tokenizer.encoding, 'name', id(tokenizer)), position)
+        if key not in self._tokens:
+            self._tokens[key] = tokenizer.encode(f" {self.terms[position]},")
+        return self._tokens[key]
+
+    def header_tokens(self, tokenizer):
+        key = (getattr(tokenizer.encoding, 'name', id(tokenizer)), None)
+        if key not in self._tokens:
+            self._tokens[key] = tokenizer.encode(HEADER)
+        return self._tokens[key]
+
+
+def vocabulary_files(audio_path, root=None):
+    """
+    Archivos de vocabulario de un audio, del más específico al más general.
+
+    Args:
+        audio_path: Ruta del audio
+        root: Directorio de entrada (no se buscan vocabularios por encima)
+    """
+    audio_path = Path(audio_path)
+    files = [audio_path.with_name(f"{audio_path.stem}{VOCABULARY_SUFFIX}")]
+    folder = audio_path.parent
+    root = Path(root).resolve() if root else folder.resolve()
+    while True:
+        files.append(folder / VOCABULARY_FILE)
+        if folder.resolve() == root or folder.parent == folder:
+            break
+        folder = folder.parent
+    return [path for path in files if path.is_file()]
+
+
+def load_vocabulary(audio_path, root=None):
+    """
+    Vocabulario de un audio (None si no tiene archivos de vocabulario).
+
+    Cada combinación de archivos se lee una sola vez por proceso, mientras
+    no cambien.
+    """
+    files = vocabulary_files(audio_path, root)
+    if not files:
+        return None
+    key = tuple((str(path), path.stat().st_mtime) for path in files)
+    if key not in _cache:
+        vocabulary = Vocabulary.load(files)
+        logger.info(f"📖 Vocabulario: {len(vocabulary)} término(s) de {', '.join(path.name for path in files)}")
+        _cache[key] = vocabulary
+    return _cache[key] or None
+
+
+def _get_tokenizer(model, language):
+    from whisper.tokenizer import get_tokenizer
+
+    try:
+        return get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                             language=language, task='transcribe')
+    except TypeError:
+        # Versiones de Whisper sin num_languages
+        return get_tokenizer(model.is_multilingual, language=language, task='transcribe')
+
+
+class VocabularyPrompter:
+    """
+    Antepone al prompt de cada ventana los términos más pertinentes.
+
+    Se usa como decode_hook de DeviceScheduler.transcribe(); una instancia
+    por audio (o por sesión en vivo), porque recuerda el texto de la ventana
+    anterior y los términos ya aparecidos.
+    """
+
+    def __init__(self, vocabulary, language=None, max_tokens=120):
+        """
+        Args:
+            vocabulary: Vocabulary
+            language: Idioma del audio (para el tokenizador)
+            max_tokens: Tokens del prompt reservados al vocabulario; el resto
+                queda para el contexto (prompt inicial o texto anterior)
+        """
+        self.vocabulary = vocabulary
+        self.language = language
+        self.max_tokens = min(max_tokens, PROMPT_BUDGET)
+        self.previous_text = ""
+        self.seen = set()
+        self.selected = []
+
+    @classmethod
+    def from_env(cls, vocabulary, language=None):
+        """Crea el selector con VOCABULARY_MAX_TOKENS (None si no hay vocabulario)."""
+        if not vocabulary:
+            return None
+        return cls(vocabulary, language, max_tokens=int(os.environ.get('VOCABULARY_MAX_TOKENS') or 120))
+
+    def select(self, tokenizer):
+        """
+        Términos de la próxima ventana, dentro del presupuesto de tokens.
+
+        Returns:
+            list: Tokens del glosario (vacío si no entra ningún término)
+        """
+        hits = self.vocabulary.lookup(self.previous_text) if self.previous_text else {}
+        # Mencionados en la ventana anterior, luego ya aparecidos, luego por prioridad
+        order = sorted(
+            range(len(self.vocabulary)),
+            key=lambda position: (-hits.get(position, 0), position not in self.seen, position)
+        )
+        tokens = list(self.vocabulary.header_tokens(tokenizer))
+        self.selected = []
+        for position in order:
+            term_tokens = self.vocabulary.tokens(tokenizer, position)
+            if len(tokens) + len(term_tokens) > self.max_tokens:
+                continue
+            tokens += term_tokens
+            self.selected.append(position)
+        return tokens if self.selected else []
+
+    def build_prompt(self, tokenizer, context):
+        """Glosario + el final del contexto de Whisper, dentro de PROMPT_BUDGET tokens."""
+        glossary = self.select(tokenizer)
+        room = PROMPT_BUDGET - len(glossary)
+        return glossary + (list(context)[-room:] if room > 0 and context else [])
+
+    def record(self, text):
+        """Guarda el texto de la ventana decodificada para elegir los términos de la siguiente."""
+        self.previous_text = text
+        self.seen.update(self.vocabulary.lookup(text))
+
+    def __call__(self, model, decode):
+        """Envuelve model.decode para la transcripción de un audio."""
+        tokenizer = _get_tokenizer(model, self.language)
+
+        def biased_decode(mel, options):
+            context = options.prompt
+            if isinstance(context, str):
+                context = tokenizer.encode(" " + context.strip())
+            options = dataclasses.replace(options, prompt=self.build_prompt(tokenizer, context or []))
+            result = decode(mel, options)
+            # Un segmento (transcribe) o un lote de segmentos
+            self.record(" ".join(r.text for r in result) if isinstance(result, list) else result.text)
+            return result
+
+        return biased_decode
@@ -0,0 +1,180 @@
+"""
+Tabla compacta de timestamps por palabra.
+Guarda inicio/fin/probabilidad de cada palabra como arreglos numpy y un
+índice de offsets, en lugar de listas de diccionarios, para que la tabla de
+un audio de varias horas ocupe pocos MB y pueda abrirse con memory mapping.
+"""
+import io
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from artifacts import write_artifact
+
+logger = logging.getLogger(__name__)
+
+
+def words_dir_for(output_dir, base_name):
+    """Devuelve el directorio de la tabla de palabras de un audio."""
+    return Path(output_dir) / f"{base_name}_palabras"
+
+
+class WordTable:
+    """Timestamps por palabra almacenados en arreglos columnares."""
+
+    def __init__(self, start, end, prob, text_bytes, text_offsets, segment_offsets):
+        """
+        Inicializa la tabla a partir de sus arreglos.
+
+        Args:
+            start: float32[n] inicio de cada palabra (segundos)
+            end: float32[n] fin de cada palabra (segundos)
+            prob: float32[n] probabilidad de cada palabra
+            text_bytes: uint8[m] texto UTF-8 de todas las palabras concatenado
+            text_offsets: int64[n+1] offsets de cada palabra dentro de text_bytes
+            segment_offsets: int64[s+1] rango de palabras de cada segmento
+        """
+        self.start = start
+        self.end = end
+        self.prob = prob
+        self.text_bytes = text_bytes
+        self.text_offsets = text_offsets
+        self.segment_offsets = segment_offsets
+        # Índice palabra normalizada -> posiciones, creado en la primera búsqueda
+        self._index = None
+
+    @classmethod
+    def from_segments(cls, segments):
+        """
+        Construye la tabla desde los segmentos de Whisper con 'words'.
+
+        Args:
+            segments: Segmentos devueltos por transcribe(word_timestamps=True)
+
+        Returns:
+            WordTable: Tabla de palabras
+        """
+        starts, ends, probs, encoded = [], [], [], []
+        segment_offsets = [0]
+
+        for segment in segments:
+            for word in segment.get('words', []):
+                starts.append(word.get('start', 0.0))
+                ends.append(word.get('end', 0.0))
+                probs.append(word.get('probability', 0.0))
+                encoded.append(word.get('word', '').strip().encode('utf-8'))
+            segment_offsets.append(len(starts))
+
+        text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(w) for w in encoded], out=text_offsets[1:])
+
+        return cls(
+            start=np.asarray(starts, dtype=np.float32),
+            end=np.asarray(ends, dtype=np.float32),
+            prob=np.asarray(probs, dtype=np.float32),
+            text_bytes=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            text_offsets=text_offsets,
+            segment_offsets=np.asarray(segment_offsets, dtype=np.int64),
+        )
+
+    def save(self, directory):
+        """
+        Guarda la tabla como archivos .npy (compatibles con memory mapping).
+
+        Args:
+            directory: Directorio destino (se crea si no existe)
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, array in (
+            ("start.npy", self.start),
+            ("end.npy", self.end),
+            ("prob.npy", self.prob),
+            ("text_offsets.npy", self.text_offsets),
+            ("segment_offsets.npy", self.segment_offsets),
+            ("text.npy", self.text_bytes),
+        ):
+            buffer = io.BytesIO()
+            np.save(buffer, array)
+            write_artifact(directory / name, buffer.getvalue())
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Carga una tabla guardada con save().
+
+        Args:
+            directory: Directorio de la tabla
+            mmap: Si True, los arreglos se abren con memory mapping (solo lectura)
+
+        Returns:
+            WordTable: Tabla de palabras
+        """
+        directory = Path(directory)
+        mode = 'r' if mmap else None
+        return cls(
+            start=np.load(directory / "start.npy", mmap_mode=mode),
+            end=np.load(directory / "end.npy", mmap_mode=mode),
+            prob=np.load(directory / "prob.npy", mmap_mode=mode),
+            text_bytes=np.load(directory / "text.npy", mmap_mode=mode),
+            text_offsets=np.load(directory / "text_offsets.npy", mmap_mode=mode),
+            segment_offsets=np.load(directory / "segment_offsets.npy", mmap_mode=mode),
+        )
+
+    def __len__(self):
+        return len(self.start)
+
+    def word(self, index):
+        """Devuelve el texto de la palabra en la posición indicada."""
+        lo, hi = int(self.text_offsets[index]), int(self.text_offsets[index + 1])
+        return bytes(self.text_bytes[lo:hi]).decode('utf-8')
+
+    def word_at(self, seconds):
+        """
+        Busca la palabra que se está diciendo en un instante dado.
+
+        Args:
+            seconds: Instante en segundos
+
+        Returns:
+            int: Índice de la palabra, o -1 si no hay ninguna
+        """
+        index = int(np.searchsorted(self.start, seconds, side='right')) - 1
+        if index < 0 or seconds > self.end[index]:
+            return -1
+        return index
+
+    def segment_words(self, segment_index):
+        """Devuelve el rango (inicio, fin) de palabras de un segmento."""
+        return int(self.segment_offsets[segment_index]), int(self.segment_offsets[segment_index + 1])
+
+    def find(self, term):
+        """
+        Busca todas las apariciones de una palabra (sin distinguir mayúsculas).
+
+        Args:
+            term: Palabra a buscar
+
+        Returns:
+            list: Tuplas (índice, inicio, fin) de cada aparición
+        """
+        positions = self._word_index().get(term.strip().lower())
+        if positions is None:
+            return []
+        starts, ends = self.start[positions], self.end[positions]
+        return [(int(index), float(start), float(end)) for index, start, end in zip(positions, starts, ends)]
+
+    def _word_index(self):
+        """Índice de palabras en minúsculas y sin puntuación (se arma una vez por tabla)."""
+        if self._index is None:
+            data = bytes(self.text_bytes)
+            offsets = self.text_offsets.tolist()
+            groups = {}
+            for index, (lo, hi) in enumerate(zip(offsets, offsets[1:])):
+                key = data[lo:hi].decode('utf-8').lower().strip('.,;:¿?¡!"\'')
+                groups.setdefault(key, []).append(index)
+            self._index = {key: np.array(indices, dtype=np.int64) for key, indices in groups.items()}
+        return self._index
@@ -0,0 +1,163 @@
+"""
+Cola de trabajo distribuida sobre el sistema de archivos.
+Varios workers (contenedores u hosts) que comparten los mismos directorios
+input/ y output/ reclaman cada archivo mediante archivos de lease atómicos.
+Los leases tienen heartbeat y expiran, de modo que el archivo de un worker
+caído vuelve a quedar disponible. No requiere broker externo.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id():
+    """Identificador del worker: WORKER_ID o '<hostname>-<pid>'."""
+    return os.environ.get('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Lease:
+    """Lease activo sobre un trabajo, renovado por un hilo de heartbeat."""
+
+    def __init__(self, queue, key, path):
+        self.queue = queue
+        self.key = key
+        self.path = path
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.heartbeat):
+            try:
+                if self.queue._read_owner(self.path) != self.queue.worker_id:
+                    logger.warning(f"⚠️  Lease perdido para {self.key} (otro worker lo reclamó)")
+                    return
+                os.utime(self.path)
+            except OSError as e:
+                logger.warning(f"⚠️  No se pudo renovar el lease de {self.key}: {e}")
+
+    def release(self):
+        """Detiene el heartbeat y elimina el lease (si sigue siendo nuestro)."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        try:
+            if self.queue._read_owner(self.path) == self.queue.worker_id:
+                self.path.unlink()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class LeaseQueue:
+    """Reclamo de trabajos mediante archivos de lease creados con O_EXCL."""
+
+    def __init__(self, lease_dir, worker_id=None, ttl=120.0, heartbeat=None):
+        """
+        Args:
+            lease_dir: Directorio compartido de leases (ej: output/.leases)
+            worker_id: Identificador de este worker
+            ttl: Segundos sin heartbeat tras los que un lease se considera vencido
+            heartbeat: Intervalo de renovación (por defecto ttl/4)
+        """
+        self.lease_dir = Path(lease_dir)
+        self.lease_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self.heartbeat = heartbeat or ttl / 4
+
+    def _path(self, key):
+        safe = key.replace(os.sep, '_').replace('/', '_')
+        return self.lease_dir / f"{safe}.lease"
+
+    @staticmethod
+    def _read_owner(path):
+        try:
+            return json.loads(path.read_text(encoding='utf-8')).get('worker')
+        except (OSError, ValueError):
+            return None
+
+    def _try_create(self, path, key):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'worker': self.worker_id, 'trabajo': key, 'inicio': time.time()}, f)
+        return True
+
+    def _is_expired(self, path):
+        try:
+            return time.time() - path.stat().st_mtime > self.ttl
+        except FileNotFoundError:
+            return True
+
+    def claim(self, key):
+        """
+        Intenta reclamar un trabajo.
+
+        Args:
+            key: Identificador del trabajo (ej: nombre del archivo de audio)
+
+        Returns:
+            Lease: Lease activo (usar como context manager), o None si otro
+                worker lo tiene reclamado
+        """
+        path = self._path(key)
+        if self._try_create(path, key):
+            return Lease(self, key, path).start()
+
+        if not self._is_expired(path):
+            return None
+
+        # Lease vencido (worker caído): solo un worker logra renombrarlo
+        stale = path.with_name(f"{path.name}.{self.worker_id}.vencido")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return None
+        if not self._is_expired(stale):
+            # Otro worker lo reclamó entre la comprobación y el renombrado:
+            # devolverlo a su lugar (link falla si ya existe uno nuevo)
+            try:
+                os.link(stale, path)
+            except OSError:
+                pass
+            stale.unlink(missing_ok=True)
+            return None
+        previous = self._read_owner(stale)
+        stale.unlink(missing_ok=True)
+
+        if self._try_create(path, key):
+            logger.info(f"♻️  Lease vencido de {previous or 'desconocido'} recuperado: {key}")
+            return Lease(self, key, path).start()
+        return None
+
+    def is_claimed(self, key):
+        """Indica si un trabajo tiene un lease vigente de otro worker."""
+        path = self._path(key)
+        return path.exists() and not self._is_expired(path)
+
+
+def create_lease_queue_from_env(output_dir):
+    """Crea una LeaseQueue si WORKER_MODE=true (None si no)."""
+    if os.environ.get('WORKER_MODE', 'false').lower() != 'true':
+        return None
+    ttl = float(os.environ.get('LEASE_TTL', '120'))
+    queue = LeaseQueue(Path(output_dir) / ".leases", ttl=ttl)
+    logger.info(f"Modo worker: {queue.worker_id} (leases en {queue.lease_dir}, TTL {ttl:.0f}s)")
+    return queue